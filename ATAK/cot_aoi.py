@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""Area-of-interest filtering for the CoT bridge
+
+Each peer can have an area (a bounding box or a radius) outside which it
+doesn't want position traffic. The map is cut into a grid of CELL-degree
+cells, and each cell's relation to every area (inside, outside or on the
+edge) is worked out once and cached. Deciding who gets an event is then
+one dict lookup, plus an exact test only for peers whose edge runs
+through that cell.
+
+    index = AoiIndex()
+    index.set_policy(peer, parse_area("radius:37.77,-122.42,25"))
+    wanted, entered = index.targets(xml, peers)   # the peers that should get xml
+
+Areas are written as
+    bbox:SOUTH,WEST,NORTH,EAST      degrees
+    radius:LAT,LON,KM
+"""
+import math
+import re
+import cot_codec
+
+CELL = 0.05                 # grid cell size in degrees (~5.5 km of latitude)
+MAX_CELLS = 65536           # cached cell relations before the cache is cleared
+MAX_CONTACTS = 4096         # contacts whose last recipients are remembered
+ALWAYS = (b"b-t-f", b"b-a-", b"b-r-f-h-c", b"t-x-")  # chat, alerts, medevac, control: sent everywhere
+
+INSIDE, OUTSIDE, EDGE = 0, 1, 2
+EARTH_KM = 6371.0
+
+_POINT_RE = re.compile(rb'<point\s[^>]*>')
+_ATTR_RE = re.compile(rb'\s([\w:-]+)=(["\'])(.*?)\2')
+
+
+def parse_event(xml):
+    """(uid, type, lat, lon) from the <event> and <point> tags; lat/lon None if absent"""
+    event = cot_codec.event_header(xml)
+    if not event:
+        return None, b"", None, None
+    point = _POINT_RE.search(xml)
+    lat = lon = None
+    if point:
+        p = {m.group(1): m.group(3) for m in _ATTR_RE.finditer(point.group(0))}
+        try:
+            lat, lon = float(p[b"lat"]), float(p[b"lon"])
+        except (KeyError, ValueError):
+            pass
+    return event.get(b"uid"), event.get(b"type", b""), lat, lon
+
+
+class BoundingBox:
+    def __init__(self, south, west, north, east):
+        if south > north:
+            raise ValueError("bbox south is north of north")
+        self.south, self.west, self.north, self.east = south, west, north, east
+
+    def contains(self, lat, lon):
+        # A box with west > east crosses the antimeridian
+        inside_lon = self.west <= lon <= self.east if self.west <= self.east else lon >= self.west or lon <= self.east
+        return self.south <= lat <= self.north and inside_lon
+
+    def relation(self, cell):
+        s, w = cell[0] * CELL, cell[1] * CELL
+        n, e = s + CELL, w + CELL
+        if n < self.south or s > self.north:
+            return OUTSIDE
+        lat_inside = self.south <= s and n <= self.north
+        if self.west <= self.east:
+            if e < self.west or w > self.east:
+                return OUTSIDE
+            return INSIDE if lat_inside and self.west <= w and e <= self.east else EDGE
+        # Crosses the antimeridian; contains() settles the edge cases
+        return INSIDE if lat_inside and (w >= self.west or e <= self.east) else EDGE
+
+    def __str__(self):
+        return f"bbox:{self.south},{self.west},{self.north},{self.east}"
+
+
+class Radius:
+    def __init__(self, lat, lon, km):
+        if km <= 0:
+            raise ValueError("radius must be positive")
+        self.lat, self.lon, self.km = lat, lon, km
+
+    def distance(self, lat, lon):
+        """Great-circle distance in km (haversine)"""
+        p1, p2 = math.radians(self.lat), math.radians(lat)
+        dp, dl = p2 - p1, math.radians(lon - self.lon)
+        a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+        return 2 * EARTH_KM * math.asin(min(1, math.sqrt(a)))
+
+    def contains(self, lat, lon):
+        return self.distance(lat, lon) <= self.km
+
+    def relation(self, cell):
+        s, w = cell[0] * CELL, cell[1] * CELL
+        if all(self.contains(lat, lon) for lat in (s, s + CELL) for lon in (w, w + CELL)):
+            return INSIDE
+        # Nearest point of the cell to the centre
+        lat = min(max(self.lat, s), s + CELL)
+        lon = min(max(self.lon, w), w + CELL)
+        return EDGE if self.contains(lat, lon) else OUTSIDE
+
+    def __str__(self):
+        return f"radius:{self.lat},{self.lon},{self.km}"
+
+
+def parse_area(spec):
+    """BoundingBox or Radius from "bbox:S,W,N,E" or "radius:LAT,LON,KM"; ValueError if malformed"""
+    kind, _, values = spec.partition(":")
+    try:
+        nums = [float(v) for v in values.split(",")]
+    except ValueError:
+        raise ValueError(f"area {spec!r}: values must be numbers") from None
+    if kind == "bbox" and len(nums) == 4:
+        return BoundingBox(*nums)
+    if kind == "radius" and len(nums) == 3:
+        return Radius(*nums)
+    raise ValueError(f"area {spec!r}: expected bbox:S,W,N,E or radius:LAT,LON,KM")
+
+
+class AoiIndex:
+    """Per-peer areas over a grid, and which peers each contact was last sent to
+
+    A peer with no area gets everything. Events of an ALWAYS type, and
+    events without a position, go to every peer. When a contact leaves a
+    peer's area, the first update outside it is still sent so the peer
+    sees it go rather than freeze at the edge.
+    """
+
+    def __init__(self, always=ALWAYS):
+        self.always = tuple(always)
+        self.policies = {}      # peer -> area
+        self.cells = {}         # cell -> (peers inside, peers on the edge)
+        self.contacts = {}      # uid -> peers the last update went to
+        self.suppressed = 0
+
+    def set_policy(self, peer, area):
+        if area is None:
+            self.policies.pop(peer, None)
+        else:
+            self.policies[peer] = area
+        self.cells.clear()
+
+    def remove(self, peer):
+        if self.policies.pop(peer, None) is not None:
+            self.cells.clear()
+
+    def cell_peers(self, cell):
+        entry = self.cells.get(cell)
+        if entry is None:
+            inside, edge = set(), set()
+            for peer, area in self.policies.items():
+                rel = area.relation(cell)
+                if rel == INSIDE:
+                    inside.add(peer)
+                elif rel == EDGE:
+                    edge.add(peer)
+            if len(self.cells) >= MAX_CELLS:
+                self.cells.clear()
+            entry = self.cells[cell] = (inside, edge)
+        return entry
+
+    def targets(self, xml, peers):
+        """(peers that should get xml, True if it just entered someone's area)"""
+        if not self.policies:
+            return peers, False
+        uid, typ, lat, lon = parse_event(xml)
+        if lat is None or (lat == 0 and lon == 0) or typ.startswith(self.always):
+            return peers, False
+        inside, edge = self.cell_peers((math.floor(lat / CELL), math.floor(lon / CELL)))
+        wanted = [p for p in peers if p not in self.policies or p in inside
+                  or (p in edge and self.policies[p].contains(lat, lon))]
+        entered = False
+        if uid is not None:
+            now = set(wanted)
+            before = self.contacts.pop(uid, None)
+            if before is None:
+                entered = True
+            else:
+                entered = bool(now - before)
+                # One last update to peers it has just left
+                wanted = [p for p in peers if p in now or p in before]
+            self.contacts[uid] = now
+            if len(self.contacts) > MAX_CONTACTS:
+                del self.contacts[next(iter(self.contacts))]
+        self.suppressed += len(peers) - len(wanted)
+        return wanted, entered
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""Benchmark the CoT bridge's encode/decode pipeline without a radio
+
+Runs each corpus through the same steps the bridge uses on a link
+(delta coding, aggregation, compression, fragmentation, parity or
+Resource hand-off) and back through reassembly, decompression and delta
+decoding. The output must match the input byte for byte. The report
+covers throughput, CPU time and bytes on the air per message.
+
+Aggregation, framing and parity are the bridge's own (cot_bridge.py must
+sit alongside). By default a dictionary is trained on half the devices
+in the corpus and the benchmark runs on the other half, so zdict is
+measured on traffic it has not seen; --shipped-dict measures the
+shipped dictionary on the whole corpus instead, which flatters it if
+that corpus is the one it was trained on.
+
+Run it on the node hardware when comparing codec or framing changes.
+Desktop numbers say little about a Pi-class CPU.
+
+Usage:
+    python3 cot_bench.py                         # every file in ./corpus
+    python3 cot_bench.py corpus/sa.xml -n 50     # one corpus, 50 passes
+    python3 cot_bench.py --mode zlib --no-delta  # the original bridge format
+    python3 cot_bench.py --mode lzma             # any codec[:level], or auto
+    python3 cot_bench.py --loss 0.1              # a peer reporting 10% loss gets parity
+    python3 cot_bench.py --shipped-dict          # the dictionary in cot_codec.py, on its own corpus
+    python3 cot_bench.py --json > before.json    # machine-readable results
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+import cot_bridge
+import cot_codec
+import cot_dict
+import cot_metrics
+
+LINK_MDU = 431          # Reticulum link MDU over a 500-byte MTU
+
+# Reticulum link framing, for the on-air estimate
+LINK_HEADER = 19        # flags, hops, link id, context
+TOKEN_OVERHEAD = 48     # link encryption IV + HMAC; the body is padded to 16 bytes
+RESOURCE_SDU = 464      # Resource part size
+RESOURCE_SETUP = 3 * (LINK_HEADER + TOKEN_OVERHEAD + 96)  # advertisement, request, proof (approximate)
+
+
+def packet_on_air(n):
+    return LINK_HEADER + TOKEN_OVERHEAD + (n // 16 + 1) * 16
+
+
+def resource_on_air(n):
+    body = TOKEN_OVERHEAD + (n // 16 + 1) * 16
+    parts = -(-body // RESOURCE_SDU)
+    return body + parts * LINK_HEADER + RESOURCE_SETUP
+
+
+class Sender:
+    """The bridge's outbound path: events in, link packets and Resources out
+
+    With aggregation on, consecutive small events are packed as if they
+    all arrived within the bridge's hold time, the best case for it.
+    Stands in for the bridge in its Batch.
+    """
+
+    def __init__(self, mode, delta, aggregate, mdu, loss, zdict):
+        candidates = cot_bridge.CODEC_CANDIDATES if mode == "auto" else [mode]
+        self.codec_selector = cot_codec.CodecSelector(candidates, cot_bridge.SEND_RATE)
+        self.peers = [set(cot_codec.CODECS)]
+        self.zdict = zdict
+        self.mdu = mdu
+        self.loss = loss
+        self.encoder = cot_codec.DeltaEncoder() if delta else None
+        self.batch = cot_bridge.Batch(self) if aggregate else None
+        metrics = cot_metrics.Registry()
+        self.m_ratio = metrics.histogram("compression_ratio", "", (1,), ("type",))
+        self.m_codec = metrics.counter("codec_messages_total", "", ("codec",))
+        self.m_aggregated = metrics.counter("aggregated_events_total", "", ("type",))
+
+    def add_event(self, text, level="info"):
+        pass
+
+    def send(self, events):
+        """Yield (packets, bulk) per transmission; bulk is a Resource payload or None"""
+        batch = self.batch
+        for xml in events:
+            payload = (self.encoder.encode(xml) if self.encoder else None) or xml
+            if batch:
+                if batch.add(payload, len(xml), 0, None, self.mdu, self.peers, self.zdict):
+                    continue
+                if batch.payloads:
+                    yield from map(self.frame, batch.flush("CoT"))
+                    if batch.add(payload, len(xml), 0, None, self.mdu, self.peers, self.zdict):
+                        continue
+            yield self.frame(self.codec_selector.compress(payload, self.peers, self.zdict)[0])
+        if batch and batch.payloads:
+            yield from map(self.frame, batch.flush("CoT"))
+
+    def frame(self, message):
+        """Packets and parity, as the bridge queues them for one link, or a Resource"""
+        packets = cot_bridge.frame_for(message, self.mdu)
+        if isinstance(packets, cot_bridge.BulkPayload):
+            return [], bytes(packets)
+        if len(packets) > 1:
+            groups = cot_codec.parity_groups(len(packets), self.loss, cot_bridge.FEC_TARGET,
+                                             cot_bridge.FEC_MAX_GROUPS)
+            packets += cot_codec.parity(packets, groups) if groups else []
+        return packets, None
+
+
+class Receiver:
+    """The bridge's inbound path: link packets and Resources in, CoT XML out"""
+
+    def __init__(self):
+        self.decoder = cot_codec.DeltaDecoder()
+        self.fragments = cot_codec.FragmentStore(max_total=cot_bridge.MAX_FRAGMENTS_RX)
+
+    def receive(self, packet):
+        tag = packet[:1]
+        if tag == cot_codec.AGGREGATE_TAG:
+            return [self.decode(p) for p in cot_codec.unpack_aggregate(packet)]
+        if tag == cot_codec.FRAGMENT_TAG:
+            full = self.fragments.add(*cot_codec.parse_fragment(packet))
+            return [self.decode(full)] if full else []
+        if tag == cot_codec.PARITY_TAG:
+            full = self.fragments.add_parity(*cot_codec.parse_parity(packet))
+            return [self.decode(full)] if full else []
+        return [self.decode(packet)]
+
+    def decode(self, payload):
+        payload = cot_codec.decompress(payload)
+        if payload[:1] == cot_codec.DELTA_TAG:
+            payload = self.decoder.decode(payload)
+        return payload
+
+
+def run(events, passes, mode, delta, aggregate, mdu, loss, zdict):
+    """Stats for `passes` runs over events, each with fresh codec state"""
+    enc_wall = enc_cpu = dec_wall = dec_cpu = 0.0
+    packets = resources = link_bytes = air_bytes = 0
+    ok = True
+    for _ in range(passes):
+        sender, receiver = Sender(mode, delta, aggregate, mdu, loss, zdict), Receiver()
+
+        w, c = time.perf_counter(), time.process_time()
+        sent = list(sender.send(events))
+        enc_wall += time.perf_counter() - w
+        enc_cpu += time.process_time() - c
+
+        w, c = time.perf_counter(), time.process_time()
+        received = []
+        for pkts, bulk in sent:
+            for pkt in pkts:
+                received += receiver.receive(pkt)
+            if bulk is not None:
+                received.append(receiver.decode(bulk))
+        dec_wall += time.perf_counter() - w
+        dec_cpu += time.process_time() - c
+
+        ok = ok and received == events
+        for pkts, bulk in sent:
+            packets += len(pkts)
+            link_bytes += sum(len(p) for p in pkts)
+            air_bytes += sum(packet_on_air(len(p)) for p in pkts)
+            if bulk is not None:
+                resources += 1
+                link_bytes += len(bulk)
+                air_bytes += resource_on_air(len(bulk))
+
+    n = len(events) * passes
+    return {
+        "messages": len(events),
+        "encode_msgs_per_s": n / enc_wall if enc_wall else 0,
+        "decode_msgs_per_s": n / dec_wall if dec_wall else 0,
+        "cpu_us_per_msg": (enc_cpu + dec_cpu) / n * 1e6,
+        "cot_bytes_per_msg": sum(len(e) for e in events) / len(events),
+        "link_bytes_per_msg": link_bytes / n,
+        "air_bytes_per_msg": air_bytes / n,
+        "packets_per_msg": packets / n,
+        "resources_per_msg": resources / n,
+        "round_trip_ok": ok,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the CoT bridge codec pipeline")
+    parser.add_argument("paths", nargs="*", help="corpus files (default: every file in ./corpus)")
+    parser.add_argument("-n", "--passes", type=int, default=20, help="passes over each corpus (default: 20)")
+    parser.add_argument("--mode", default="zdict",
+                        help=f"codec[:level] or auto (default: zdict; available: {', '.join(cot_codec.CODECS)})")
+    parser.add_argument("--no-delta", action="store_true", help="don't delta-code SA beacons")
+    parser.add_argument("--no-aggregate", action="store_true", help="send every event in its own packet")
+    parser.add_argument("--mdu", type=int, default=LINK_MDU, help=f"link MDU in bytes (default: {LINK_MDU})")
+    parser.add_argument("--loss", type=float, default=0.0,
+                        help="fragment loss the peer reports, which sets the parity sent (default: 0)")
+    parser.add_argument("--shipped-dict", action="store_true",
+                        help="use the shipped dictionary on the whole corpus, not one trained on half the devices")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+    if args.mode != "auto":
+        try:
+            cot_codec.parse_codec(args.mode)
+        except ValueError as e:
+            parser.error(str(e))
+
+    corpus_dir = os.path.join(HERE, "corpus")
+    paths = args.paths or sorted(os.path.join(corpus_dir, f) for f in os.listdir(corpus_dir))
+    corpora = {os.path.splitext(os.path.basename(p))[0]: cot_dict.load_corpus([p]) for p in paths}
+    zdict = cot_codec.ZDICT_VERSION
+    if not args.shipped_dict:
+        # Train on half the devices as cot_dict.py --install would, under the next version
+        # number, and keep the other half to measure on
+        fit, held = cot_dict.split_sources([e for events in corpora.values() for e in events])
+        if not fit or not held:
+            parser.error("the corpus needs CoT from at least two devices (or use --shipped-dict)")
+        zdict = max(cot_codec.ZDICTS, default=0) + 1
+        cot_codec.ZDICTS[zdict] = cot_dict.train(fit, cot_dict.DICT_SIZE)
+        held = set(held)
+        corpora = {name: [e for e in events if e in held] for name, events in corpora.items()}
+        corpora = {name: events for name, events in corpora.items() if events}
+    dictionary = "shipped" if args.shipped_dict else "held-out"
+    results = {}
+    everything = []
+    for name, events in corpora.items():
+        everything += events
+        results[name] = run(events, args.passes, args.mode, not args.no_delta, not args.no_aggregate, args.mdu,
+                            args.loss, zdict)
+    if len(corpora) > 1:
+        results["all"] = run(everything, args.passes, args.mode, not args.no_delta, not args.no_aggregate, args.mdu,
+                             args.loss, zdict)
+
+    if args.json:
+        print(json.dumps({"mode": args.mode, "delta": not args.no_delta, "aggregate": not args.no_aggregate, "mdu": args.mdu,
+                          "loss": args.loss, "dictionary": dictionary, "passes": args.passes, "results": results}, indent=2))
+        return
+
+    print(f"mode={args.mode} delta={'off' if args.no_delta else 'on'} "
+          f"aggregate={'off' if args.no_aggregate else 'on'} mdu={args.mdu} loss={args.loss:g} "
+          f"dict={dictionary} passes={args.passes}")
+    print()
+    print(f"{'corpus':<10} {'msgs':>5} {'enc msg/s':>10} {'dec msg/s':>10} {'cpu us':>8} "
+          f"{'CoT B':>7} {'link B':>7} {'air B':>7} {'pkts':>5}  ok")
+    for name, r in results.items():
+        print(f"{name:<10} {r['messages']:>5} {r['encode_msgs_per_s']:>10.0f} {r['decode_msgs_per_s']:>10.0f} "
+              f"{r['cpu_us_per_msg']:>8.0f} {r['cot_bytes_per_msg']:>7.0f} {r['link_bytes_per_msg']:>7.0f} "
+              f"{r['air_bytes_per_msg']:>7.0f} {r['packets_per_msg']:>5.2f}  {'yes' if r['round_trip_ok'] else 'NO'}")
+    print()
+    print("Per message. cpu us = encode + decode CPU time. air B estimates Reticulum link")
+    print("framing and encryption; Resources are counted in air B but not in pkts, parity in both.")
+    if not all(r["round_trip_ok"] for r in results.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1062 @@
+"""CoT wire codec — compression framing shared by the bridge and its tools
+
+Payload formats on a Reticulum link (first bytes decide):
+    78 01 / 78 9c / 78 da   zlib stream (original bridge format)
+    Z + version + deflate   raw deflate against preset dictionary <version>
+    C + codec id + body     any other registered codec (see CODECS)
+    H + version + tokens    capability hello, sent when a link comes up
+    A + compressed block    several events packed into one packet
+    F + id + seq + total    one fragment of a larger payload
+    N + id + total + seqs   request to resend the listed fragments of a message
+    P + id + group + ...    XOR parity over a group of fragments (see parity())
+    L + loss                fragment loss the receiver measured, in 1/10000
+    B                       delta-coded SA beacon (see DeltaEncoder)
+    R + key                 resync request for a delta-coded UID
+    <                       uncompressed CoT XML
+"""
+import calendar
+import hashlib
+import random
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+ZLIB_MAGIC = (b"\x78\x9c", b"\x78\x01", b"\x78\xda")
+ZDICT_TAG = b"Z"
+
+# Preset dictionaries, keyed by the version byte sent on the wire. Never
+# change or remove an entry that has shipped: peers running older builds
+# still send it. Regenerate with `python3 cot_dict.py --install`.
+# ── BEGIN ZDICTS (generated by cot_dict.py) ────────────────────────
+ZDICTS = {
+    1: (
+        b'" type="u-d-f" time="" type="b-m-r" time="" type="a-h-G" time=""'
+        b' type="b-m-p-w" time="" type="b-a-o-tbl" time="" type="b-m-p-s-m'
+        b'" time="</emergency></detail></event>"/><emergency type="911 Ale'
+        b'rt">" version="5.1.0.1"/></marti></detail></event>" how="h-e"><p'
+        b'oint lat="</remarks><marti><dest callsign="" production_time="</'
+        b'remarks></detail></event>"><chatgrp uid0="" senderCallsign="" ty'
+        b'pe="b-t-f" time=""/></__chat><link uid="</remarks><archive/><lab'
+        b'els_on value="true"/><precisionlocation altsrc="???"/></detail><'
+        b'/event>" name="Blue"/><status battery="" name="Cyan"/><status ba'
+        b'ttery="" type="a-f-G-U-C" parent_callsign=""/><strokeColor value'
+        b'="-16776961"/><strokeWeight value="4.0"/><fillColor value="16777'
+        b'21855"/><contact callsign=""/><remarks/><archive/><usericon icon'
+        b'setpath="COT_MAPPING_SPOTMAP/b-m-p-s-m/-65536"/><color argb="-65'
+        b'536"/><precisionlocation altsrc="DTED0"/></detail></event>"/><tr'
+        b'ack course="" ce="3.2" le="9999999.0"/><detail><takv os="34" ver'
+        b'sion="5.2.0.5 (4e1c7b2a).1712345678-CIV" device="SAMSUNG SM-8U" '
+        b'platform="ATAK-CIV"/><contact endpoint=""/></detail></event>" ty'
+        b'pe="a-f-G-U-C" relation="p-p"/><remarks source="" how="h-g-i-g-o'
+        b'"><point lat="" ce="9999999.0" le="9999999.0"/><detail><status r'
+        b'eadiness="true"/><archive/><link uid="" how="m-g"><point lat="" '
+        b'type="a-f-G-U-C" time="" remarks="" relation="c"/><link_attr pla'
+        b'nningmethod="Infil" color="-1" method="Walking" prefix="CP" type'
+        b'="On Foot" stroke="3" direction="Infil" routetype="Primary" orde'
+        b'r="Ascending Check Points"/><strokeColor value="-1"/><strokeWeig'
+        b'ht value="3.0"/><__routeinfo><__navcues/></__routeinfo><contact '
+        b'callsign=""/><link point="" type="b-m-p-w" point="" ce="9999999.'
+        b'0" le="9999999.0"/><detail><__chat parent="RootContactGroup" gro'
+        b'upOwner="false" messageId=""/><precisionlocation altsrc="GPS" ge'
+        b'opointsrc="GPS"/><__group role="Team Member" name="" remarks="" '
+        b'relation="c"/><link uid="<?xml version="1.0" encoding="UTF-8" st'
+        b'andalone="yes"?><event version="2.0" uid="'
+    ),
+}
+# ── END ZDICTS ─────────────────────────────────────────────────────
+ZDICT_VERSION = max(ZDICTS) if ZDICTS else 0
+
+
+def deflate(data, zdict=None, level=9):
+    """Raw deflate (no zlib header or checksum), primed with zdict if given"""
+    if zdict:
+        c = zlib.compressobj(level, zlib.DEFLATED, -15, 9, zlib.Z_DEFAULT_STRATEGY, zdict)
+    else:
+        c = zlib.compressobj(level, zlib.DEFLATED, -15, 9)
+    return c.compress(data) + c.flush()
+
+
+def inflate(data, zdict=None):
+    d = zlib.decompressobj(-15, zdict) if zdict else zlib.decompressobj(-15)
+    return d.decompress(data) + d.flush()
+
+
+# ── Codec registry ─────────────────────────────────────────────────
+# zlib and zdict keep their original framing so older bridges can read
+# them. Every other codec is sent as C + codec id + body; a bridge only
+# uses those towards peers that listed the codec in their hello.
+CODEC_TAG = b"C"
+HELLO_TAG = b"H"
+HELLO_VERSION = 1
+LEGACY_CODECS = ("zlib",)           # assumed for a peer that never sends a hello, e.g. the original bridge
+LEGACY_ZDICTS = (1,)                # dictionary versions assumed for a peer whose hello lists none
+
+
+class Codec:
+    """One compression format: encode(data, level) and decode(body)"""
+
+    def __init__(self, name, wire_id, encode, decode, level, levels=range(1, 10)):
+        self.name = name
+        self.wire_id = wire_id      # None: self-identifying legacy format
+        self.encode = encode
+        self.decode = decode
+        self.level = level          # default
+        self.levels = levels
+
+
+CODECS = {}     # name -> Codec, only those usable on this node
+_BY_ID = {}
+
+
+def register(codec):
+    CODECS[codec.name] = codec
+    if codec.wire_id is not None:
+        _BY_ID[codec.wire_id] = codec
+
+
+def parse_codec(spec):
+    """(Codec, level) for a spec such as "zlib:6"; ValueError if unknown here"""
+    name, _, level = spec.partition(":")
+    codec = CODECS.get(name)
+    if codec is None:
+        raise ValueError(f"codec {name!r} not available (have {', '.join(CODECS)})")
+    level = int(level) if level else codec.level
+    if level not in codec.levels:
+        raise ValueError(f"{name} level must be {codec.levels[0]}..{codec.levels[-1]}")
+    return codec, level
+
+
+def _zdict_encode(data, level, version=None):
+    version = version or ZDICT_VERSION
+    return ZDICT_TAG + bytes([version]) + deflate(data, ZDICTS[version], level)
+
+
+def shared_zdict(peers):
+    """Newest dictionary version we and every peer (sets of versions) have, 0 if none"""
+    common = set(ZDICTS)
+    for versions in peers:
+        common &= versions
+    return max(common, default=0)
+
+
+if ZDICT_VERSION:
+    register(Codec("zdict", None, _zdict_encode, None, 9))
+register(Codec("zlib", None, zlib.compress, zlib.decompress, 9))
+register(Codec("deflate", 1, lambda d, l: deflate(d, None, l), inflate, 6))
+
+try:
+    import lzma     # a separate package on OpenWrt (python3-lzma)
+    # Raw LZMA2 with a fixed dictionary so the decoder needs no header
+    _LZMA_DICT = 1 << 20
+
+    register(Codec(
+        "lzma", 2,
+        lambda d, l: lzma.compress(d, lzma.FORMAT_RAW, filters=[
+            {"id": lzma.FILTER_LZMA2, "preset": l, "dict_size": _LZMA_DICT}]),
+        lambda b: lzma.decompress(b, lzma.FORMAT_RAW, filters=[
+            {"id": lzma.FILTER_LZMA2, "dict_size": _LZMA_DICT}]),
+        6, range(0, 10)))
+except ImportError:
+    pass
+
+try:
+    import zstandard
+    register(Codec(
+        "zstd", 3,
+        lambda d, l: zstandard.ZstdCompressor(level=l, write_checksum=False).compress(d),
+        lambda b: zstandard.ZstdDecompressor().decompress(b),
+        3, range(1, 20)))
+except ImportError:
+    pass
+
+try:
+    import brotli
+    register(Codec("brotli", 4, lambda d, l: brotli.compress(d, quality=l), brotli.decompress, 5, range(0, 12)))
+except ImportError:
+    pass
+
+
+def compress(data, mode="zdict", zdict=None):
+    """Compress CoT XML for the link; falls back to raw if it doesn't shrink
+
+    mode is a codec name with an optional level, e.g. "zdict" or "zlib:6".
+    zdict is the dictionary version for "zdict", by default the newest.
+    """
+    codec, level = parse_codec(mode)
+    out = _zdict_encode(data, level, zdict) if codec.name == "zdict" else codec.encode(data, level)
+    if codec.wire_id is not None:
+        out = CODEC_TAG + bytes([codec.wire_id]) + out
+    return out if len(out) < len(data) else data
+
+
+def decompress(payload):
+    """Undo compress() for any format a peer may send"""
+    if payload[:1] == ZDICT_TAG:
+        version = payload[1]
+        if version not in ZDICTS:
+            raise ValueError(f"unknown zdict version {version}")
+        return inflate(payload[2:], ZDICTS[version])
+    if payload[:1] == CODEC_TAG:
+        codec = _BY_ID.get(payload[1])
+        if codec is None:
+            raise ValueError(f"unknown codec id {payload[1]}")
+        return codec.decode(payload[2:])
+    if payload[:2] in ZLIB_MAGIC:
+        return zlib.decompress(payload)
+    return payload
+
+
+# ── Capability hello ───────────────────────────────────────────────
+# H + version + space-separated tokens, sent when a link comes up and
+# again until the peer confirms it (see cot_bridge.CotBridge.hello).
+# Unknown tokens are ignored, so later features can be advertised the
+# same way.
+def hello(tokens):
+    return HELLO_TAG + bytes([HELLO_VERSION]) + " ".join(tokens).encode()
+
+
+def parse_hello(packet):
+    """Token set from a hello packet"""
+    return set(packet[2:].decode("ascii", "replace").split())
+
+
+# ── Codec selection ────────────────────────────────────────────────
+class CodecSelector:
+    """Pick the cheapest codec per message from measured cost
+
+    Cost is in seconds: the bytes sent at `rate` bytes/s plus the CPU time
+    spent compressing, times cpu_weight. Ratio and CPU time per byte are
+    kept as moving averages per codec and size class. Every `explore`
+    messages the least recently measured candidate is tried instead, so
+    the averages follow the traffic.
+    """
+
+    SIZE_CLASSES = (256, 1024, 4096)
+    ALPHA = 0.2
+
+    def __init__(self, candidates, rate, cpu_weight=1.0, explore=32):
+        self.candidates = []
+        for spec in candidates:
+            try:
+                parse_codec(spec)
+            except ValueError:
+                continue            # not installed here
+            self.candidates.append(spec)
+        self.rate = rate
+        self.cpu_weight = cpu_weight
+        self.explore = explore
+        self.stats = {}         # (spec, size class) -> [ratio, seconds per byte, last used]
+        self.packed = {}        # (spec, size class) -> ratio of aggregates, which compress better than one event
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def size_class(self, size):
+        for i, bound in enumerate(self.SIZE_CLASSES):
+            if size <= bound:
+                return i
+        return len(self.SIZE_CLASSES)
+
+    def usable(self, peers):
+        """Candidates every peer in `peers` (sets of codec names) can decode"""
+        out = [c for c in self.candidates if all(c.partition(":")[0] in p for p in peers)]
+        if out:
+            return out
+        # Someone only speaks the original format
+        return ["zdict"] if all("zdict" in p for p in peers) and "zdict" in CODECS else ["zlib"]
+
+    def choose(self, size, peers):
+        usable = self.usable(peers)
+        if len(usable) == 1:
+            return usable[0]
+        cls = self.size_class(size)
+        with self.lock:
+            self.count += 1
+            unmeasured = [c for c in usable if (c, cls) not in self.stats]
+            if unmeasured:
+                return unmeasured[0]
+            if self.count % self.explore == 0:
+                return min(usable, key=lambda c: self.stats[c, cls][2])
+            return min(usable, key=lambda c: self.cost(c, cls, size))
+
+    def cost(self, spec, cls, size):
+        ratio, per_byte, _ = self.stats[spec, cls]
+        return size * ratio / self.rate + size * per_byte * self.cpu_weight
+
+    def record(self, spec, size, out, seconds, packed=False):
+        """Feed back one measured compression of size bytes into out bytes; packed for an aggregate"""
+        if not size:
+            return
+        key = spec, self.size_class(size)
+        with self.lock:
+            if packed:
+                ratio = self.packed.get(key, out / size)
+                self.packed[key] = ratio + self.ALPHA * (out / size - ratio)
+            s = self.stats.get(key)
+            if s is None:
+                self.stats[key] = [out / size, seconds / size, self.count]
+                return
+            s[0] += self.ALPHA * (out / size - s[0])
+            s[1] += self.ALPHA * (seconds / size - s[1])
+            s[2] = self.count
+
+    def estimate(self, size, peers, packed=False):
+        """Expected compressed size of size bytes for peers, from the nearest size class measured"""
+        usable = self.usable(peers)
+        cls = self.size_class(size)
+        with self.lock:
+            for near in sorted(range(len(self.SIZE_CLASSES) + 1), key=lambda c: abs(c - cls)):
+                measured = [c for c in usable if (c, near) in self.stats]
+                if measured:
+                    spec = min(measured, key=lambda c: self.cost(c, near, size))
+                    ratio = self.packed.get((spec, near), self.stats[spec, near][0]) if packed else self.stats[spec, near][0]
+                    return int(size * ratio) + 1
+        return size
+
+    def compress(self, data, peers, zdict=None):
+        """(compressed, codec spec) for data sent to peers; zdict as for compress()"""
+        spec = self.choose(len(data), peers)
+        start = time.perf_counter()
+        out = compress(data, spec, zdict)
+        self.record(spec, len(data), len(out), time.perf_counter() - start)
+        return out, spec
+
+
+# ── Varints ────────────────────────────────────────────────────────
+def put_varint(out, n):
+    while n > 0x7f:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def varint_size(n):
+    return max(1, (n.bit_length() + 6) // 7)
+
+
+def get_varint(buf, pos):
+    n = shift = 0
+    while True:
+        if shift > 63:
+            raise ValueError("varint too long")
+        b = buf[pos]
+        pos += 1
+        n |= (b & 0x7f) << shift
+        if b < 0x80:
+            return n, pos
+        shift += 7
+
+
+def zigzag(n):
+    return n * 2 if n >= 0 else -n * 2 - 1
+
+
+def unzigzag(n):
+    return n >> 1 if not n & 1 else -(n >> 1) - 1
+
+
+# ── Delta codec for SA beacons ─────────────────────────────────────
+#
+# A beacon is split into a template (the XML with every numeric or
+# timestamp attribute value cut out) and the list of cut values. The
+# first beacon for a UID is sent as a keyframe carrying both; after that
+# only the values that differ from the keyframe are sent, as small
+# integer deltas. Deltas are relative to the keyframe, not to the
+# previous beacon, so a lost delta never corrupts the ones after it.
+#
+#   B + 0 + key(4) + gen(1) + template_len + template + slots + values
+#   B + 1 + key(4) + gen(1) + changed-slot bitmap + values
+#
+# A receiver that has no keyframe for key/gen answers with
+#   R + key(4)
+# and the sender starts over with a keyframe.
+DELTA_TAG = b"B"
+RESYNC_TAG = b"R"
+KEYFRAME = 0
+DELTA = 1
+
+_VALUE_RE = re.compile(rb'=(["\'])([-\d.:TZ]+)\1')
+_EVENT_RE = re.compile(rb'<event\s[^>]*>')
+_ATTR_RE = re.compile(rb'\s([\w:-]+)=(["\'])(.*?)\2')
+_NUM_RE = re.compile(rb'-?\d{1,18}(?:\.\d{1,18})?')
+_TIME_RE = re.compile(rb'(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)(?:\.(\d{1,9}))?Z')
+
+# Value tags
+NUM = 1         # scale, zigzag mantissa
+NUM_DELTA = 2   # zigzag mantissa change from keyframe
+TIME = 3        # fraction digits, zigzag units
+TIME_DELTA = 4  # zigzag units change from keyframe
+TIME_SAME = 5   # same change as the previous TIME_DELTA in this frame
+
+
+class ResyncNeeded(Exception):
+    """A delta referenced a keyframe this receiver doesn't hold"""
+    def __init__(self, key):
+        super().__init__(f"no keyframe for {key.hex()}")
+        self.key = key
+
+
+def _format_num(scale, mant):
+    if not scale:
+        return str(mant).encode()
+    sign = "-" if mant < 0 else ""
+    digits = str(abs(mant)).rjust(scale + 1, "0")
+    return f"{sign}{digits[:-scale]}.{digits[-scale:]}".encode()
+
+
+def _format_time(frac, units):
+    secs, sub = divmod(units, 10 ** frac)
+    out = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(secs))
+    if frac:
+        out += "." + str(sub).rjust(frac, "0")
+    return (out + "Z").encode()
+
+
+def _tokenize(value):
+    """Integer form of a numeric or timestamp attribute, if it round-trips"""
+    m = _TIME_RE.fullmatch(value)
+    if m:
+        frac = len(m.group(7) or b"")
+        secs = calendar.timegm(tuple(int(g) for g in m.groups()[:6]))
+        tok = (TIME, frac, secs * 10 ** frac + int(m.group(7) or 0))
+    elif _NUM_RE.fullmatch(value):
+        scale = len(value) - value.index(b".") - 1 if b"." in value else 0
+        tok = (NUM, scale, int(value.replace(b".", b"")))
+    else:
+        return None
+    return tok if _render(tok) == value else None
+
+
+def _render(tok):
+    return _format_time(tok[1], tok[2]) if tok[0] == TIME else _format_num(tok[1], tok[2])
+
+
+def parse_time(value):
+    """Seconds since the epoch for a CoT timestamp like b"2025-03-14T18:22:07.047Z", or None"""
+    m = _TIME_RE.fullmatch(value or b"")
+    if not m:
+        return None
+    secs = calendar.timegm(tuple(int(g) for g in m.groups()[:6]))
+    return secs + (int(m.group(7)) / 10 ** len(m.group(7)) if m.group(7) else 0)
+
+
+def event_header(xml):
+    """Attributes of the <event> start tag, e.g. {b"uid": ..., b"type": ...}"""
+    head = _EVENT_RE.search(xml, 0, 2048)
+    if not head:
+        return {}
+    return {m.group(1): m.group(3) for m in _ATTR_RE.finditer(head.group(0))}
+
+
+def split_event(xml):
+    """Split CoT XML into (uid, type, template, slot offsets, value tokens)"""
+    attrs = event_header(xml)
+    if b"uid" not in attrs:
+        return None
+    template, offsets, tokens, last = bytearray(), [], [], 0
+    for m in _VALUE_RE.finditer(xml):
+        tok = _tokenize(m.group(2))
+        if tok is None:
+            continue
+        template += xml[last:m.start(2)]
+        offsets.append(len(template))
+        tokens.append(tok)
+        last = m.end(2)
+    template += xml[last:]
+    return attrs[b"uid"], attrs.get(b"type", b""), bytes(template), offsets, tokens
+
+
+def join_event(template, offsets, tokens):
+    out, last = bytearray(), 0
+    for off, tok in zip(offsets, tokens):
+        out += template[last:off]
+        out += _render(tok)
+        last = off
+    out += template[last:]
+    return bytes(out)
+
+
+def uid_key(uid):
+    return hashlib.blake2s(uid, digest_size=4).digest()
+
+
+def _put_value(out, tok, ref=None, prev_dt=None):
+    """Write one value; returns the time delta used, if any"""
+    if ref is not None and ref[0] == tok[0] and ref[1] == tok[1]:
+        diff = tok[2] - ref[2]
+        if tok[0] == NUM:
+            out.append(NUM_DELTA)
+            put_varint(out, zigzag(diff))
+            return None
+        if diff == prev_dt:
+            out.append(TIME_SAME)
+        else:
+            out.append(TIME_DELTA)
+            put_varint(out, zigzag(diff))
+        return diff
+    out.append(tok[0])
+    out.append(tok[1])
+    put_varint(out, zigzag(tok[2]))
+    return None
+
+
+def _get_value(buf, pos, ref=None, prev_dt=None):
+    tag = buf[pos]
+    pos += 1
+    if tag in (NUM, TIME):
+        scale = buf[pos]
+        n, pos = get_varint(buf, pos + 1)
+        return (tag, scale, unzigzag(n)), pos, None
+    if ref is None:
+        raise ValueError("delta value without keyframe value")
+    if tag == TIME_SAME:
+        if prev_dt is None:
+            raise ValueError("TIME_SAME without a previous time delta")
+        return (ref[0], ref[1], ref[2] + prev_dt), pos, prev_dt
+    if tag in (NUM_DELTA, TIME_DELTA):
+        n, pos = get_varint(buf, pos)
+        diff = unzigzag(n)
+        return (ref[0], ref[1], ref[2] + diff), pos, (diff if tag == TIME_DELTA else None)
+    raise ValueError(f"bad value tag {tag}")
+
+
+class DeltaEncoder:
+    """Sender side: keyframe state per UID, deltas against it"""
+
+    def __init__(self, refresh=30, max_age=300, max_uids=512, types=(b"a-",)):
+        self.refresh = refresh      # deltas before a fresh keyframe
+        self.max_age = max_age      # seconds before a fresh keyframe
+        self.max_uids = max_uids
+        self.types = types          # CoT type prefixes worth tracking
+        self.state = OrderedDict()  # key -> [gen, template, offsets, tokens, deltas, time]
+        # Shared by all UIDs and never reset, so a keyframe after reset(),
+        # resync() or eviction doesn't reuse the generation of one the peer
+        # still holds; random start for the same across restarts
+        self.generation = random.randrange(256)
+        self.lock = threading.Lock()
+        self.keyframes = 0
+        self.deltas = 0
+
+    def encode(self, xml):
+        """B-frame for xml, or None if this event isn't a tracked type"""
+        parts = split_event(xml)
+        if not parts:
+            return None
+        uid, typ, template, offsets, tokens = parts
+        if not typ.startswith(self.types):
+            return None
+        key = uid_key(uid)
+        now = time.monotonic()
+        with self.lock:
+            st = self.state.get(key)
+            if (st and st[1] == template and st[2] == offsets and st[4] < self.refresh
+                    and now - st[5] < self.max_age):
+                self.state.move_to_end(key)
+                st[4] += 1
+                self.deltas += 1
+                return self._delta(key, st, tokens)
+            self.generation = (self.generation + 1) & 0xff
+            if st and st[0] == self.generation:
+                self.generation = (self.generation + 1) & 0xff
+            gen = self.generation
+            self.state[key] = [gen, template, offsets, tokens, 0, now]
+            self.state.move_to_end(key)
+            while len(self.state) > self.max_uids:
+                self.state.popitem(last=False)
+            self.keyframes += 1
+        return self._keyframe(key, gen, template, offsets, tokens)
+
+    def _keyframe(self, key, gen, template, offsets, tokens):
+        out = bytearray(DELTA_TAG + bytes([KEYFRAME]) + key + bytes([gen]))
+        put_varint(out, len(template))
+        out += template
+        put_varint(out, len(offsets))
+        last = 0
+        for off in offsets:
+            put_varint(out, off - last)
+            last = off
+        for tok in tokens:
+            _put_value(out, tok)
+        return bytes(out)
+
+    def _delta(self, key, st, tokens):
+        ref = st[3]
+        out = bytearray(DELTA_TAG + bytes([DELTA]) + key + bytes([st[0]]))
+        mask = bytearray((len(tokens) + 7) // 8)
+        values = bytearray()
+        dt = None
+        for i, (tok, r) in enumerate(zip(tokens, ref)):
+            if tok == r:
+                continue
+            mask[i // 8] |= 1 << (i % 8)
+            d = _put_value(values, tok, r, dt)
+            if d is not None:
+                dt = d
+        return bytes(out + mask + values)
+
+    def resync(self, key):
+        """Peer lost our keyframe: send a full event next time"""
+        with self.lock:
+            self.state.pop(key, None)
+
+    def reset(self):
+        with self.lock:
+            self.state.clear()
+
+
+class DeltaDecoder:
+    """Receiver side: rebuilds byte-identical CoT XML from B-frames"""
+
+    def __init__(self, max_uids=512):
+        self.max_uids = max_uids
+        self.state = OrderedDict()  # key -> (gen, template, offsets, tokens)
+
+    def decode(self, frame):
+        kind, key, gen = frame[1], frame[2:6], frame[6]
+        pos = 7
+        if kind == KEYFRAME:
+            n, pos = get_varint(frame, pos)
+            template = bytes(frame[pos:pos + n])
+            pos += n
+            count, pos = get_varint(frame, pos)
+            offsets, last = [], 0
+            for _ in range(count):
+                d, pos = get_varint(frame, pos)
+                last += d
+                offsets.append(last)
+            tokens = []
+            for _ in range(count):
+                tok, pos, _ = _get_value(frame, pos)
+                tokens.append(tok)
+            self.state[key] = (gen, template, offsets, tokens)
+            self.state.move_to_end(key)
+            while len(self.state) > self.max_uids:
+                self.state.popitem(last=False)
+            return join_event(template, offsets, tokens)
+        if kind != DELTA:
+            raise ValueError(f"bad B-frame kind {kind}")
+        st = self.state.get(key)
+        if not st or st[0] != gen:
+            raise ResyncNeeded(bytes(key))
+        _, template, offsets, ref = st
+        mask_len = (len(ref) + 7) // 8
+        mask = frame[pos:pos + mask_len]
+        pos += mask_len
+        tokens = list(ref)
+        dt = None
+        for i in range(len(ref)):
+            if mask[i // 8] & (1 << (i % 8)):
+                tok, pos, d = _get_value(frame, pos, ref[i], dt)
+                if d is not None:
+                    dt = d
+                tokens[i] = tok
+        return join_event(template, offsets, tokens)
+
+
+# ── Fragmentation ──────────────────────────────────────────────────
+FRAGMENT_TAG = b"F"
+FRAGMENT_HEADER = 7     # tag + msg_id(4) + seq + total
+PARITY_TAG = b"P"
+PARITY_HEADER = 9       # tag + msg_id(4) + group + total + payload length(2)
+NACK_TAG = b"N"
+LOSS_TAG = b"L"
+
+
+def fragment(payload, msg_id, size):
+    """Split payload into F packets of at most size bytes
+
+    Fragments leave room for the longer parity header, so a P packet
+    over them fits the same link.
+    """
+    step = size - PARITY_HEADER
+    chunks = [payload[i:i + step] for i in range(0, len(payload), step)]
+    return [FRAGMENT_TAG + msg_id + bytes([seq, len(chunks)]) + chunk for seq, chunk in enumerate(chunks)]
+
+
+def parse_fragment(packet):
+    """(msg_id, seq, total, data) of an F packet"""
+    if len(packet) < FRAGMENT_HEADER:
+        raise ValueError("short fragment")
+    return packet[1:5], packet[5], packet[6], packet[7:]
+
+
+def parity(packets, groups):
+    """P packets for the F packets of one message, one per group
+
+    Group g covers fragments g, g + groups, g + 2*groups, ... and its P
+    packet is their XOR, each padded to the longest. Any one missing
+    fragment of a group can be rebuilt from the rest and the P packet.
+    """
+    msg_id, total = packets[0][1:5], packets[0][6]
+    chunks = [p[FRAGMENT_HEADER:] for p in packets]
+    step, length = len(chunks[0]), sum(len(c) for c in chunks)
+    if length > 0xffff or not 0 < groups < 16:
+        return []
+    out = []
+    for first in range(min(groups, total)):
+        x = 0
+        for c in chunks[first::groups]:
+            x ^= int.from_bytes(c.ljust(step, b"\0"), "big")
+        out.append(PARITY_TAG + msg_id + bytes([groups << 4 | first, total]) + length.to_bytes(2, "big")
+                   + x.to_bytes(step, "big"))
+    return out
+
+
+def parse_parity(packet):
+    """(msg_id, groups, first, total, payload length, data) of a P packet"""
+    if len(packet) <= PARITY_HEADER:
+        raise ValueError("short parity")
+    return (packet[1:5], packet[5] >> 4, packet[5] & 15, packet[6], int.from_bytes(packet[7:9], "big"),
+            packet[PARITY_HEADER:])
+
+
+def delivery(n, loss, groups):
+    """Chance an n-fragment message arrives whole, with parity over groups groups"""
+    q = 1 - loss
+    if not groups:
+        return q ** n
+    p = 1.0
+    for first in range(min(groups, n)):
+        k = len(range(first, n, groups)) + 1    # fragments and parity
+        p *= q ** k + k * loss * q ** (k - 1)
+    return p
+
+
+def parity_groups(n, loss, target=0.99, most=2):
+    """Fewest parity groups, up to most, that deliver an n-fragment message with chance target"""
+    for groups in range(most + 1):
+        if delivery(n, loss, groups) >= target:
+            return groups
+    return most
+
+
+def loss_report(loss):
+    return LOSS_TAG + min(10000, round(loss * 10000)).to_bytes(2, "big")
+
+
+def parse_loss_report(packet):
+    return int.from_bytes(packet[1:3], "big") / 10000
+
+
+def nack(msg_id, total, missing):
+    """N packet asking for the fragments in missing of a total-fragment message"""
+    return NACK_TAG + msg_id + bytes([total]) + bytes(missing)
+
+
+def parse_nack(packet):
+    """(msg_id, total, missing seqs) of an N packet"""
+    if len(packet) < 7:
+        raise ValueError("short nack")
+    return packet[1:5], packet[5], list(packet[6:])
+
+
+# ── Fragment reassembly ────────────────────────────────────────────
+class FragmentStore:
+    """Bounded reassembly of F-fragments, with P-parity recovery
+
+    Partial messages sit in an OrderedDict keyed by msg_id. Every entry
+    gets the same timeout, so insertion order is deadline order: expiry
+    and eviction only ever look at the front. Slots are indexed by seq,
+    so adding a fragment is O(1) and completion needs no sorting.
+    gaps() reports messages that have stopped arriving, so the caller
+    can ask the source for the missing fragments. Recently completed
+    ids are remembered, so late copies don't start a new partial.
+
+    Fragment loss is counted per source: every fragment a message needed
+    that didn't arrive first time, whether it was rebuilt from parity,
+    resent, or never came.
+    """
+
+    def __init__(self, timeout=30, max_messages=64, max_bytes=256 * 1024, max_total=255):
+        self.timeout = timeout
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.max_total = max_total      # most fragments a message may have
+        # msg_id -> [deadline, total, slots, received, nbytes, source, last, asked, parity, lost]
+        self.partial = OrderedDict()
+        self.done = OrderedDict()       # msg_id -> None, recently completed
+        self.nbytes = 0
+        self.lock = threading.Lock()
+        self.completed = 0
+        self.duplicates = 0
+        self.out_of_range = 0
+        self.expired = 0
+        self.evicted = 0
+        self.repaired = 0   # completed after gaps() reported them
+        self.recovered = 0  # fragments rebuilt from parity
+        self.loss = {}      # source -> [fragments needed, fragments lost]
+
+    def _entry(self, msg_id, total, n, now, source):
+        """The partial entry for msg_id, made if new; None if it is done or doesn't match"""
+        if msg_id in self.done:
+            self.duplicates += 1
+            return None
+        entry = self.partial.get(msg_id)
+        if entry is None:
+            self._make_room(n)
+            entry = [now + self.timeout, total, [None] * total, 0, 0, source, now, 0, [], 0]
+            self.partial[msg_id] = entry
+        elif entry[1] != total:
+            self.out_of_range += 1
+            return None
+        return entry
+
+    def _fill(self, msg_id, entry, seq, data):
+        """Store one fragment; False if its message had to be dropped to keep within max_bytes"""
+        entry[2][seq] = data
+        entry[3] += 1
+        entry[4] += len(data)
+        self.nbytes += len(data)
+        while self.nbytes > self.max_bytes:
+            # Older messages go first; this one only if it is too big on its own
+            victim = next((m for m in self.partial if m != msg_id), msg_id)
+            self._evict(victim)
+            if victim == msg_id:
+                return False
+        return True
+
+    def add(self, msg_id, seq, total, data, now=None, source=None):
+        """Store one fragment; returns the whole message once complete"""
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            if not 0 <= seq < total <= self.max_total:
+                self.out_of_range += 1
+                return None
+            entry = self._entry(msg_id, total, len(data), now, source)
+            if entry is None:
+                return None
+            if entry[2][seq] is not None:
+                self.duplicates += 1
+                return None
+            if not self._fill(msg_id, entry, seq, data):
+                return None
+            entry[6] = now
+            if entry[7]:
+                entry[9] += 1       # only came after asking
+            return self._finish(msg_id, entry)
+
+    def add_parity(self, msg_id, groups, first, total, length, data, now=None, source=None):
+        """Store one parity packet; returns the whole message if it completes it"""
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            if not (0 <= first < groups and first < total <= self.max_total):
+                self.out_of_range += 1
+                return None
+            if msg_id in self.done:
+                return None         # every fragment came; parity not needed
+            entry = self._entry(msg_id, total, len(data), now, source)
+            if entry is None:
+                return None
+            entry[8].append((groups, first, length, data))
+            entry[6] = now
+            return self._finish(msg_id, entry)
+
+    def _finish(self, msg_id, entry):
+        """Rebuild what parity allows; the whole message if nothing is missing"""
+        total, slots = entry[1], entry[2]
+        for groups, first, length, data in entry[8]:
+            missing = [i for i in range(first, total, groups) if slots[i] is None]
+            if len(missing) != 1:
+                continue
+            step = len(data)
+            x = int.from_bytes(data, "big")
+            for i in range(first, total, groups):
+                if slots[i] is not None:
+                    x ^= int.from_bytes(slots[i].ljust(step, b"\0"), "big")
+            seq = missing[0]
+            size = min(step, length - seq * step)
+            if size <= 0:
+                self.out_of_range += 1
+                continue
+            if not self._fill(msg_id, entry, seq, x.to_bytes(step, "big")[:size]):
+                return None
+            entry[9] += 1
+            self.recovered += 1
+        if entry[3] < total:
+            return None
+        del self.partial[msg_id]
+        self.done[msg_id] = None
+        if len(self.done) > 4 * self.max_messages:
+            self.done.popitem(last=False)
+        self.nbytes -= entry[4]
+        self.completed += 1
+        if entry[7]:
+            self.repaired += 1
+        self._count_loss(entry)
+        return b"".join(slots)
+
+    def _count_loss(self, entry):
+        if entry[5] is not None:
+            counts = self.loss.setdefault(entry[5], [0, 0])
+            counts[0] += entry[1]
+            counts[1] += entry[9] + entry[1] - entry[3]
+
+    def loss_reports(self, min_fragments):
+        """[(source, fragment loss)] for sources with at least min_fragments counted; restarts their counts"""
+        with self.lock:
+            out = [(src, lost / needed) for src, (needed, lost) in self.loss.items() if needed >= min_fragments]
+            for src, _ in out:
+                del self.loss[src]
+        return out
+
+    def gaps(self, quiet, retries, now=None):
+        """Partial messages with no new fragment for quiet seconds, each reported at most retries times
+
+        Returns a list of (msg_id, source, total, missing seqs).
+        """
+        now = time.monotonic() if now is None else now
+        out = []
+        with self.lock:
+            for msg_id, entry in self.partial.items():
+                if entry[7] < retries and now - entry[6] >= quiet:
+                    entry[6] = now
+                    entry[7] += 1
+                    out.append((msg_id, entry[5], entry[1], [i for i, d in enumerate(entry[2]) if d is None]))
+        return out
+
+    def _make_room(self, n):
+        while self.partial and (len(self.partial) >= self.max_messages or self.nbytes + n > self.max_bytes):
+            self._evict(next(iter(self.partial)))
+
+    def _evict(self, msg_id):
+        entry = self.partial.pop(msg_id)
+        self.nbytes -= entry[4]
+        self.evicted += 1
+        self._count_loss(entry)
+
+    def expire(self, now=None):
+        """Drop partial messages past their deadline; returns how many"""
+        now = time.monotonic() if now is None else now
+        dropped = 0
+        with self.lock:
+            while self.partial:
+                msg_id, entry = next(iter(self.partial.items()))
+                if entry[0] > now:
+                    break
+                del self.partial[msg_id]
+                self.nbytes -= entry[4]
+                self._count_loss(entry)
+                dropped += 1
+            self.expired += dropped
+        return dropped
+
+    def __len__(self):
+        return len(self.partial)
+
+
+# ── Aggregation ────────────────────────────────────────────────────
+#
+#   A + compress(00 + len + payload + len + payload ...)
+#
+# The leading 00 keeps an uncompressed block from being mistaken for a
+# compressed one. Payloads are prepared events (XML or B-frames) and are
+# compressed together, so the dictionary and cross-event repetition
+# both help.
+AGGREGATE_TAG = b"A"
+
+
+def pack_aggregate(payloads, mode="zdict", zdict=None):
+    block = bytearray(b"\x00")
+    for p in payloads:
+        put_varint(block, len(p))
+        block += p
+    return AGGREGATE_TAG + compress(bytes(block), mode, zdict)
+
+
+def unpack_aggregate(frame):
+    block = decompress(frame[1:])
+    if block[:1] != b"\x00":
+        raise ValueError("bad aggregate block")
+    payloads, pos = [], 1
+    while pos < len(block):
+        n, pos = get_varint(block, pos)
+        if pos + n > len(block):
+            raise ValueError("truncated aggregate block")
+        payloads.append(block[pos:pos + n])
+        pos += n
+    return payloads
+
+
+# ── Stream framing ─────────────────────────────────────────────────
+# TAK streaming CoT over TCP is a plain concatenation of XML documents
+# with no length prefix, each <event> optionally after an <?xml ?> prolog.
+class EventFramer:
+    """Pull complete <event> documents out of a byte stream
+
+    feed() only scans bytes it has not looked at yet: an event split
+    across reads resumes its search where the last one stopped. Bytes
+    outside any event (whitespace, keep-alive junk) are discarded, and
+    an event over max_size is dropped rather than buffered forever.
+    """
+
+    START = b"<event"
+    END = b"</event>"
+    PROLOG = b"<?xml"
+
+    def __init__(self, max_size=1048576):
+        self.max_size = max_size
+        self.buf = bytearray()
+        self.scan = 0           # where the next search starts
+        self.in_event = False   # buf starts with an event (or its prolog)
+        self.in_body = False    # the <event ...> start tag is complete
+        self.oversize = 0
+
+    def feed(self, data):
+        """Every event completed by data, as bytes"""
+        buf = self.buf
+        buf += data
+        events = []
+        while True:
+            if not self.in_event:
+                i = buf.find(self.START, self.scan)
+                if i < 0:
+                    # Keep a prolog, or just enough to spot a start tag split across reads
+                    p = buf.rfind(self.PROLOG)
+                    del buf[:p if p >= 0 else max(len(buf) - len(self.START) + 1, 0)]
+                    self.scan = max(len(buf) - len(self.START) + 1, 0)
+                    if len(buf) > self.max_size:
+                        self.oversize += 1
+                        buf.clear()
+                        self.scan = 0
+                    break
+                p = buf.rfind(self.PROLOG, 0, i)
+                start = p if p >= 0 else i
+                del buf[:start]
+                self.scan = i - start + len(self.START)
+                self.in_event, self.in_body = True, False
+            if not self.in_body:
+                j = buf.find(b">", self.scan)
+                if j < 0:
+                    self.scan = len(buf)
+                    if not self.check_size():
+                        continue
+                    break
+                if buf[j - 1:j] == b"/":    # <event .../>
+                    events.append(self.take(j + 1))
+                    continue
+                self.in_body = True
+                self.scan = j + 1
+            k = buf.find(self.END, self.scan)
+            if k < 0:
+                self.scan = max(self.scan, len(buf) - len(self.END) + 1)
+                if not self.check_size():
+                    continue
+                break
+            events.append(self.take(k + len(self.END)))
+        return events
+
+    def take(self, n):
+        event = bytes(self.buf[:n])
+        del self.buf[:n]
+        self.scan = 0
+        self.in_event = self.in_body = False
+        return event
+
+    def check_size(self):
+        """False (and the partial event dropped) if it has outgrown max_size"""
+        if len(self.buf) <= self.max_size:
+            return True
+        self.oversize += 1
+        self.take(len(self.buf))
+        return False
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""Train the zlib preset dictionary used by the CoT bridge
+
+Builds a dictionary of the substrings that recur across a corpus of real
+CoT traffic (SA beacons, GeoChat, markers) and reports how well it
+compresses compared to plain zlib, on devices held out of training. With
+--install the dictionary is added to cot_codec.py under the next version
+number; older versions are kept so nodes that have not been updated can
+still be decoded.
+
+Usage:
+    python3 cot_dict.py                          # train on ./corpus, print stats
+    python3 cot_dict.py corpus/*.xml captures/   # explicit corpus files or dirs
+    python3 cot_dict.py --size 4096 --install    # write a new dictionary version
+"""
+import argparse
+import os
+import re
+import sys
+import zlib
+from collections import Counter
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+import cot_codec
+
+KMER = 12          # substring length used to find shared content
+MIN_SEGMENT = 16   # shortest run worth a slot in the dictionary
+DICT_SIZE = 4096   # dictionary bytes; zlib uses at most 32 KB
+BEGIN_MARK = "# ── BEGIN ZDICTS"
+END_MARK = "# ── END ZDICTS"
+
+# Attribute values that name a unit, a place or a moment. Segments never run
+# through them or through element text, so the dictionary holds the shape of
+# CoT rather than the callsigns, UIDs and positions of the capture
+VOLATILE = (b"uid", b"uid0", b"uid1", b"id", b"messageId", b"callsign", b"senderCallsign", b"parent_callsign",
+            b"chatroom", b"Droid", b"endpoint", b"source", b"to", b"time", b"start", b"stale", b"production_time",
+            b"lat", b"lon", b"hae", b"point", b"battery", b"course", b"speed")
+_VOLATILE_RE = re.compile(rb'\s(?:%s)="([^"]*)"|>([^<]+)<' % b"|".join(VOLATILE))
+_CREATOR_RE = re.compile(rb'<link uid="([^"]+)"[^>]*relation="p-p"')
+
+
+def load_corpus(paths):
+    """Read CoT events: one event per line, or one event per file"""
+    files = []
+    for p in paths:
+        if os.path.isdir(p):
+            files += sorted(os.path.join(p, f) for f in os.listdir(p) if f.endswith((".xml", ".cot")))
+        else:
+            files.append(p)
+    events = []
+    for path in files:
+        with open(path, "rb") as f:
+            raw = f.read()
+        lines = [l.strip() for l in raw.split(b"\n") if l.strip()]
+        if all(l.startswith(b"<?xml") or l.startswith(b"<event") for l in lines):
+            events += lines
+        else:
+            events.append(raw.strip())
+    return events
+
+
+def source(ev):
+    """The device an event came from: the creator of a chat or marker, else the event's own UID"""
+    m = _CREATOR_RE.search(ev)
+    return m.group(1) if m else cot_codec.event_header(ev).get(b"uid", ev[:64])
+
+
+def split_sources(events):
+    """Split events in two by device, so neither half shares a unit with the other"""
+    sources = sorted({source(ev) for ev in events})
+    held = set(sources[1::2])
+    return [ev for ev in events if source(ev) not in held], [ev for ev in events if source(ev) in held]
+
+
+def pieces(ev):
+    """The parts of an event between its volatile values"""
+    out, last = [], 0
+    for m in _VOLATILE_RE.finditer(ev):
+        start = m.start(1) if m.group(1) is not None else m.start(2)
+        out.append(ev[last:start])
+        last = m.end(1) if m.group(1) is not None else m.end(2)
+    out.append(ev[last:])
+    return [p for p in out if len(p) >= KMER]
+
+
+def train(events, size):
+    """Pick the highest-value shared segments until the dictionary is full"""
+    # Document frequency of every k-mer, counted per device: content that
+    # many units send is what a preset dictionary can cover, while content
+    # only one unit sends is its own callsign and kit
+    by_source = {}
+    for ev in events:
+        by_source.setdefault(source(ev), []).extend(pieces(ev))
+    df = Counter()
+    for parts in by_source.values():
+        df.update({p[i:i + KMER] for p in parts for i in range(len(p) - KMER + 1)})
+
+    # Maximal runs of shared k-mers become candidate segments
+    segments = Counter()
+    for ev in (p for parts in by_source.values() for p in parts):
+        i, n = 0, len(ev) - KMER + 1
+        while i < n:
+            if df[ev[i:i + KMER]] < 2:
+                i += 1
+                continue
+            j = i
+            while j < n and df[ev[j:j + KMER]] >= 2:
+                j += 1
+            seg = ev[i:j + KMER - 1]
+            if len(seg) >= MIN_SEGMENT:
+                segments[seg] += 1
+            i = j
+
+    scored = sorted(segments.items(), key=lambda kv: kv[1] * len(kv[0]), reverse=True)
+    chosen, used, covered = [], 0, set()
+    for seg, count in scored:
+        if used >= size:
+            break
+        kmers = {seg[i:i + KMER] for i in range(len(seg) - KMER + 1)}
+        # Skip near-duplicates of content the dictionary already holds
+        if len(kmers - covered) * 2 < len(kmers):
+            continue
+        seg = seg[:size - used]
+        chosen.append(seg)
+        covered |= kmers
+        used += len(seg)
+
+    # zlib matches closer to the end of the dictionary with shorter
+    # distance codes, so the most valuable segments go last
+    return b"".join(reversed(chosen))
+
+
+def measure(events, zdict):
+    raw = sum(len(e) for e in events)
+    plain = sum(len(zlib.compress(e, 9)) for e in events)
+    trained = sum(len(cot_codec.deflate(e, zdict)) + 2 for e in events)
+    return raw, plain, trained
+
+
+def install(zdict):
+    path = os.path.join(HERE, "cot_codec.py")
+    with open(path) as f:
+        src = f.read()
+    start = src.index(BEGIN_MARK)
+    end = src.index(END_MARK)
+    version = max(cot_codec.ZDICTS) + 1 if cot_codec.ZDICTS else 1
+    if version > 255:
+        sys.exit("dictionary version space exhausted")
+    body = src[start:end].rstrip()
+    assert body.endswith("}")
+    lines = [f"    {version}: ("]
+    for i in range(0, len(zdict), 64):
+        lines.append(f"        {zdict[i:i + 64]!r}")
+    lines.append("    ),")
+    body = body[:-1].rstrip() + "\n" + "\n".join(lines) + "\n}\n"
+    with open(path, "w") as f:
+        f.write(src[:start] + body + src[end:])
+    return version
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the CoT zlib preset dictionary")
+    parser.add_argument("corpus", nargs="*", default=[os.path.join(HERE, "corpus")],
+                        help="corpus files or directories (default: ./corpus)")
+    parser.add_argument("--size", type=int, default=DICT_SIZE, help=f"dictionary size in bytes (default: {DICT_SIZE})")
+    parser.add_argument("--install", action="store_true", help="add the dictionary to cot_codec.py as a new version")
+    args = parser.parse_args()
+
+    events = load_corpus(args.corpus)
+    devices = len({source(ev) for ev in events})
+    if devices < 2:
+        sys.exit("need CoT from at least two devices to train on")
+    zdict = train(events, args.size)
+
+    print(f"  Corpus        : {len(events)} events from {devices} devices, {sum(len(e) for e in events)} bytes")
+    print(f"  Dictionary    : {len(zdict)} bytes")
+    # Train on half the devices and evaluate on the other half so the
+    # numbers reflect units the dictionary has not seen
+    fit, held = split_sources(events)
+    if devices >= 4:
+        raw, plain, trained = measure(held, train(fit, args.size))
+        print(f"  Held-out raw  : {raw} bytes from {devices // 2} devices")
+        print(f"  zlib -9       : {plain} bytes ({100 - plain * 100 // raw}% saved)")
+        print(f"  zlib + zdict  : {trained} bytes ({100 - trained * 100 // raw}% saved)")
+    else:
+        print("  Held-out      : needs CoT from at least four devices")
+    for name, sample in (("current", cot_codec.ZDICTS.get(cot_codec.ZDICT_VERSION)), ("trained", zdict)):
+        if sample:
+            _, _, size = measure(events, sample)
+            print(f"  Full corpus   : {size} bytes with {name} dictionary")
+
+    if args.install:
+        version = install(zdict)
+        print(f"  Installed as dictionary version {version} in cot_codec.py")
+
+
+if __name__ == "__main__":
+    main()
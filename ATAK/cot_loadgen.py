@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""Record, replay and synthesize ATAK CoT traffic to load-test a bridge pair
+
+    record   capture SA and chat multicast to a file with timestamps
+    replay   play a recording back into the local multicast groups, 1-50x
+    synth    generate SA beacons (and optional chat) for N virtual clients
+    sink     on the far side, count what the bridges delivered
+
+replay and synth tag every event with a run id and sequence number in
+a <loadgen> detail element. sink uses the tags to report delivery, loss
+and latency per run. Tagging also makes every datagram unique, so the
+bridge's duplicate suppression doesn't swallow a looped recording.
+
+Usage:
+    python3 cot_loadgen.py record capture.cotrec --duration 600
+    python3 cot_loadgen.py replay capture.cotrec --speed 10 --loop 3
+    python3 cot_loadgen.py synth --clients 50 --interval 5 --chat 6 --duration 300
+    python3 cot_loadgen.py sink --duration 320              # on the far node's network
+
+Run record/replay/synth on a machine attached to one bridge node. Run
+sink on a machine attached to the other. The bridge publishes with
+multicast loopback off, so sink gets nothing on the bridge host itself.
+latency is only meaningful when both machines' clocks are in sync (NTP).
+"""
+import argparse
+import gzip
+import os
+import random
+import re
+import socket
+import struct
+import sys
+import time
+import uuid
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+from cot_dict import load_corpus
+
+COT_SA_MULTICAST = "239.2.3.1"
+COT_SA_PORT = 6969
+COT_CHAT_MULTICAST = "224.10.10.1"
+COT_CHAT_PORT = 17012
+GROUPS = ((COT_SA_MULTICAST, COT_SA_PORT), (COT_CHAT_MULTICAST, COT_CHAT_PORT))
+MAGIC = b"COTREC1\n"
+RECORD = struct.Struct(">IBH")  # ms since previous record, group index, length
+MAX_SPEED = 50
+
+_TAG_RE = re.compile(rb'<loadgen run="([0-9a-f]+)" seq="(\d+)" t="([\d.]+)"/>')
+_TIME_ATTR_RE = re.compile(rb'\b(time|start|stale)="[^"]*"')
+
+
+# ── Multicast ──────────────────────────────────────────────────────
+def listen_socket(mcast_addr, port, iface="0.0.0.0"):
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    s.bind(("", port))
+    mreq = struct.pack("4s4s", socket.inet_aton(mcast_addr), socket.inet_aton(iface))
+    s.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+    s.settimeout(0.5)
+    return s
+
+
+def send_socket(iface=None):
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    s.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+    # Loopback on, so a bridge on this same host hears us
+    s.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+    if iface:
+        s.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(iface))
+    return s
+
+
+# ── Tagging ────────────────────────────────────────────────────────
+def tag(xml, run, seq):
+    """Insert a <loadgen> marker into the event's detail block"""
+    marker = b'<loadgen run="%s" seq="%d" t="%.3f"/>' % (run.encode(), seq, time.time())
+    xml = _TAG_RE.sub(b"", xml)
+    if b"<detail>" in xml:
+        return xml.replace(b"<detail>", b"<detail>" + marker, 1)
+    return xml.replace(b"</event>", b"<detail>" + marker + b"</detail></event>", 1)
+
+
+def cot_time(t):
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(t)).encode() + b".%03dZ" % int(t % 1 * 1000)
+
+
+def retime(xml, now, stale_after=75):
+    """Set time/start to now and stale to now + stale_after"""
+    def sub(m):
+        t = now + stale_after if m.group(1) == b"stale" else now
+        return m.group(1) + b'="' + cot_time(t) + b'"'
+    return _TIME_ATTR_RE.sub(sub, xml)
+
+
+class Pacer:
+    """Sends datagrams on schedule and counts how far behind it falls"""
+
+    def __init__(self, iface=None):
+        self.sock = send_socket(iface)
+        self.run = uuid.uuid4().hex[:8]
+        self.seq = 0
+        self.sent = [0, 0]
+        self.bytes = 0
+        self.late = 0
+        self.max_lag = 0.0
+        self.start = time.monotonic()
+
+    def send_at(self, due, group, xml):
+        lag = time.monotonic() - due
+        if lag < 0:
+            time.sleep(-lag)
+        elif lag > 0.05:
+            self.late += 1
+            self.max_lag = max(self.max_lag, lag)
+        data = tag(xml, self.run, self.seq)
+        self.seq += 1
+        self.sock.sendto(data, GROUPS[group])
+        self.sent[group] += 1
+        self.bytes += len(data)
+
+    def report(self):
+        elapsed = time.monotonic() - self.start
+        total = sum(self.sent)
+        print(f"run {self.run}: sent {total} events ({self.sent[0]} SA, {self.sent[1]} chat), "
+              f"{self.bytes / 1024:.1f} KB in {elapsed:.1f}s = {total / elapsed if elapsed else 0:.1f} events/s")
+        if self.late:
+            print(f"  {self.late} sends more than 50 ms late (worst {self.max_lag * 1000:.0f} ms): "
+                  f"this machine can't keep up with the requested rate")
+        print(f"  on the far side: python3 cot_loadgen.py sink   (then look for run {self.run})")
+
+
+# ── record ─────────────────────────────────────────────────────────
+def record(args):
+    socks = [listen_socket(addr, port, args.iface) for addr, port in GROUPS]
+    for s in socks:
+        s.setblocking(False)
+    import selectors
+    sel = selectors.DefaultSelector()
+    for i, s in enumerate(socks):
+        sel.register(s, selectors.EVENT_READ, i)
+    count = 0
+    end = time.monotonic() + args.duration if args.duration else None
+    with gzip.open(args.file, "wb") as out:
+        out.write(MAGIC)
+        last = time.monotonic()
+        print(f"recording to {args.file}, Ctrl+C to stop")
+        try:
+            while end is None or time.monotonic() < end:
+                for key, _ in sel.select(0.5):
+                    data = key.fileobj.recv(65535)
+                    now = time.monotonic()
+                    out.write(RECORD.pack(min(int((now - last) * 1000), 0xFFFFFFFF), key.data, len(data)) + data)
+                    last = now
+                    count += 1
+        except KeyboardInterrupt:
+            pass
+    print(f"recorded {count} events")
+
+
+def read_recording(path):
+    """[(seconds from start, group, data)]"""
+    events, t = [], 0.0
+    with gzip.open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise SystemExit(f"{path}: not a CoT recording")
+        while True:
+            head = f.read(RECORD.size)
+            if len(head) < RECORD.size:
+                break
+            delta_ms, group, n = RECORD.unpack(head)
+            t += delta_ms / 1000
+            events.append((t, group, f.read(n)))
+    return events
+
+
+# ── replay ─────────────────────────────────────────────────────────
+def replay(args):
+    if not 1 <= args.speed <= MAX_SPEED:
+        raise SystemExit(f"--speed must be between 1 and {MAX_SPEED}")
+    events = read_recording(args.file)
+    if not events:
+        raise SystemExit("recording is empty")
+    span = events[-1][0] + 1
+    pacer = Pacer(args.iface)
+    print(f"replaying {len(events)} events ({span:.0f}s) x{args.loop} at {args.speed}x as run {pacer.run}")
+    try:
+        for n in range(args.loop):
+            base = pacer.start + n * span / args.speed
+            for t, group, data in events:
+                xml = retime(data, time.time()) if args.retime else data
+                pacer.send_at(base + t / args.speed, group, xml)
+    except KeyboardInterrupt:
+        pass
+    pacer.report()
+
+
+# ── synth ──────────────────────────────────────────────────────────
+def synth(args):
+    sa = load_corpus([os.path.join(HERE, "corpus", "sa.xml")])
+    chat = load_corpus([os.path.join(HERE, "corpus", "geochat.xml")])
+    rng = random.Random(args.seed)
+    clients = []
+    for i in range(args.clients):
+        uid = f"LOADGEN-{i:04d}".encode()
+        xml = re.sub(rb'uid="ANDROID-[^"]*"', b'uid="' + uid + b'"', sa[i % len(sa)])
+        xml = re.sub(rb'(callsign|Droid)="[^"]*"', rb'\1="LOAD-%d"' % i, xml)
+        lat = float(re.search(rb'lat="([-\d.]+)"', xml).group(1)) + rng.uniform(-0.01, 0.01)
+        lon = float(re.search(rb'lon="([-\d.]+)"', xml).group(1)) + rng.uniform(-0.01, 0.01)
+        clients.append([xml, lat, lon, rng.uniform(0, args.interval)])
+
+    pacer = Pacer(args.iface)
+    chat_every = 60 / args.chat if args.chat else None
+    next_chat = pacer.start + (chat_every or 0)
+    end = pacer.start + args.duration
+    print(f"{args.clients} clients beaconing every {args.interval}s"
+          + (f", {args.chat} chat messages/min" if args.chat else "") + f" as run {pacer.run}")
+    try:
+        while True:
+            client = min(clients, key=lambda c: c[3])
+            due = pacer.start + client[3]
+            if chat_every and next_chat < due:
+                msg = re.sub(rb'messageId="[^"]*"', b'messageId="' + str(uuid.uuid4()).encode() + b'"',
+                             rng.choice(chat))
+                if next_chat >= end:
+                    break
+                pacer.send_at(next_chat, 1, retime(msg, time.time(), 86400))
+                next_chat += chat_every
+                continue
+            if due >= end:
+                break
+            # Walk a few metres per beacon
+            client[1] += rng.uniform(-0.0001, 0.0001)
+            client[2] += rng.uniform(-0.0001, 0.0001)
+            xml = re.sub(rb'lat="[-\d.]+" lon="[-\d.]+"', b'lat="%.7f" lon="%.7f"' % (client[1], client[2]), client[0])
+            pacer.send_at(due, 0, retime(xml, time.time()))
+            client[3] += args.interval
+    except KeyboardInterrupt:
+        pass
+    pacer.report()
+
+
+# ── sink ───────────────────────────────────────────────────────────
+def sink(args):
+    import selectors
+    sel = selectors.DefaultSelector()
+    for addr, port in GROUPS:
+        s = listen_socket(addr, port, args.iface)
+        s.setblocking(False)
+        sel.register(s, selectors.EVENT_READ)
+    runs = {}   # run -> {seq: first latency}
+    copies = 0
+    untagged = 0
+    end = time.monotonic() + args.duration if args.duration else None
+    print("listening for loadgen traffic, Ctrl+C for the report")
+    try:
+        while end is None or time.monotonic() < end:
+            for key, _ in sel.select(0.5):
+                data = key.fileobj.recv(65535)
+                m = _TAG_RE.search(data)
+                if not m:
+                    untagged += 1
+                    continue
+                seen = runs.setdefault(m.group(1).decode(), {})
+                seq = int(m.group(2))
+                if seq in seen:
+                    # Routed to both groups, e.g. with --route b-t-f=sa,chat
+                    copies += 1
+                    continue
+                seen[seq] = time.time() - float(m.group(3))
+    except KeyboardInterrupt:
+        pass
+
+    if not runs:
+        print("no loadgen events received")
+        return
+    for run, seen in runs.items():
+        expected = max(seen) + 1
+        lat = sorted(seen.values())
+        pct = lambda p: lat[min(len(lat) - 1, int(p * len(lat)))] * 1000
+        print(f"run {run}: delivered {len(seen)} of at least {expected} "
+              f"({len(seen) / expected * 100:.1f}%), {expected - len(seen)} not delivered")
+        print(f"  latency ms  p50 {pct(0.5):.0f}  p95 {pct(0.95):.0f}  max {lat[-1] * 1000:.0f}")
+    print(f"{copies} repeat copies, {untagged} untagged events ignored")
+    print("Not delivered includes SA superseded in the bridge queue (latest wins) as well as losses;")
+    print("compare with cot_bridge_queue_dropped_total on the sending bridge.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CoT traffic recorder, replayer and load generator")
+    parser.add_argument("--iface", default=None, help="local IP of the interface to use for multicast")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("record", help="capture SA and chat multicast to a file")
+    p.add_argument("file")
+    p.add_argument("--duration", type=float, help="seconds to record (default: until Ctrl+C)")
+    p.set_defaults(func=record)
+
+    p = sub.add_parser("replay", help="play a recording into the multicast groups")
+    p.add_argument("file")
+    p.add_argument("--speed", type=float, default=1, help=f"playback speed, 1-{MAX_SPEED} (default: 1)")
+    p.add_argument("--loop", type=int, default=1, help="times to play the recording (default: 1)")
+    p.add_argument("--retime", action="store_true", help="rewrite time/start/stale to the send time")
+    p.set_defaults(func=replay)
+
+    p = sub.add_parser("synth", help="generate traffic for N virtual ATAK clients")
+    p.add_argument("--clients", type=int, default=10, help="virtual clients (default: 10)")
+    p.add_argument("--interval", type=float, default=5, help="seconds between each client's SA beacons (default: 5)")
+    p.add_argument("--chat", type=float, default=0, help="chat messages per minute across all clients (default: 0)")
+    p.add_argument("--duration", type=float, default=60, help="seconds to run (default: 60)")
+    p.add_argument("--seed", type=int, default=1, help="random seed for positions")
+    p.set_defaults(func=synth)
+
+    p = sub.add_parser("sink", help="count loadgen events delivered on this side")
+    p.add_argument("--duration", type=float, help="seconds to listen (default: until Ctrl+C)")
+    p.set_defaults(func=sink)
+
+    args = parser.parse_args()
+    if args.iface is None:
+        args.iface = "0.0.0.0" if args.func in (record, sink) else None
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
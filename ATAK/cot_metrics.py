@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""Prometheus-style metrics for the CoT bridge
+
+Counters and histograms are sharded per thread: each thread updates its
+own dict without taking a lock, and only a scrape walks every shard.
+Gauges are read from a callback at scrape time, so queue depths and the
+like cost nothing until someone asks.
+
+    registry = Registry()
+    sent = registry.counter("packets_total", "Packets sent", ("direction",))
+    sent.inc(direction="tx")
+    serve(registry, "127.0.0.1", 9105)   # GET /metrics
+"""
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(v):
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+def _number(v):
+    if v == float("inf"):
+        return "+Inf"
+    if isinstance(v, float) and v.is_integer():
+        return str(int(v))
+    return repr(v) if isinstance(v, float) else str(v)
+
+
+class _Sharded:
+    """Per-thread value dicts merged on read; subclasses define merge(into, key, value)"""
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.local = threading.local()
+        self.shards = []    # (owning thread, values)
+        self.retired = {}   # values folded in from threads that have exited
+        self.shards_lock = threading.Lock()  # only taken once per thread, and by readers
+
+    def shard(self):
+        try:
+            return self.local.values
+        except AttributeError:
+            values = {}
+            with self.shards_lock:
+                self.shards.append((threading.current_thread(), values))
+            self.local.values = values
+            return values
+
+    def key(self, labels):
+        return tuple(labels.get(n, "") for n in self.labels)
+
+    def merged(self):
+        """Every shard folded into one dict of label values -> value"""
+        with self.shards_lock:
+            # Short-lived callback threads would otherwise leave a shard each
+            for thread, values in [s for s in self.shards if not s[0].is_alive()]:
+                for key, v in values.items():
+                    self.merge(self.retired, key, v)
+                self.shards.remove((thread, values))
+            merged = {}
+            for key, v in self.retired.items():
+                self.merge(merged, key, v)
+            for _, values in self.shards:
+                # dict.items() copied in one C call, so a writer can't resize it mid-read
+                for key, v in list(values.items()):
+                    self.merge(merged, key, v)
+        return merged
+
+
+class Counter(_Sharded):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        values = self.shard()
+        key = self.key(labels)
+        values[key] = values.get(key, 0) + amount
+
+    def merge(self, into, key, v):
+        into[key] = into.get(key, 0) + v
+
+    def value(self, **labels):
+        return self.merged().get(self.key(labels), 0)
+
+    def render(self):
+        return [f"{self.name}{_labels(self.labels, k)} {_number(v)}"
+                for k, v in sorted(self.merged().items())]
+
+
+class Histogram(_Sharded):
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets, labels=()):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        values = self.shard()
+        key = self.key(labels)
+        h = values.get(key)
+        if h is None:
+            # per-bucket counts, then +Inf, then sum
+            h = values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        h[bisect.bisect_left(self.buckets, value)] += 1
+        h[-1] += value
+
+    def merge(self, into, key, h):
+        m = into.setdefault(key, [0] * len(h))
+        for i, v in enumerate(list(h)):
+            m[i] += v
+
+    def render(self):
+        lines = []
+        for key, h in sorted(self.merged().items()):
+            running = 0
+            for bound, n in zip(self.buckets + (float("inf"),), h[:-1]):
+                running += n
+                le = _labels(self.labels + ("le",), key + (_number(bound),))
+                lines.append(f"{self.name}_bucket{le} {running}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, key)} {_number(h[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.labels, key)} {running}")
+        return lines
+
+
+class Gauge:
+    """Value read from fn() at scrape time
+
+    fn returns a number, or a dict of label-value tuple -> number.
+    """
+
+    def __init__(self, name, help, fn, labels=(), kind="gauge"):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.labels = tuple(labels)
+        self.kind = kind
+
+    def render(self):
+        v = self.fn()
+        if not isinstance(v, dict):
+            v = {(): v}
+        return [f"{self.name}{_labels(self.labels, k)} {_number(n)}" for k, n in sorted(v.items())]
+
+
+class Registry:
+    def __init__(self, prefix=""):
+        self.prefix = prefix
+        self.metrics = []
+
+    def add(self, metric):
+        metric.name = self.prefix + metric.name
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.add(Counter(name, help, labels))
+
+    def histogram(self, name, help, buckets, labels=()):
+        return self.add(Histogram(name, help, buckets, labels))
+
+    def gauge(self, name, help, fn, labels=(), kind="gauge"):
+        """kind="counter" for totals kept elsewhere (e.g. object attributes)"""
+        return self.add(Gauge(name, help, fn, labels, kind))
+
+    def render(self):
+        out = []
+        for m in self.metrics:
+            out.append(f"# HELP {m.name} {m.help}")
+            out.append(f"# TYPE {m.name} {m.kind}")
+            try:
+                out.extend(m.render())
+            except Exception as e:
+                out.append(f"# {m.name} unavailable: {e}")
+        return "\n".join(out) + "\n"
+
+
+def serve(registry, addr, port):
+    """Serve registry at http://addr:port/metrics on a daemon thread"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/metrics", "/"):
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((addr, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,224 @@
+"""In-memory stand-in for RNS, and loopback sockets in place of multicast
+
+Links, packets and Resources are delivered synchronously between the
+bridges of one Network. Each bridge wraps its callbacks for its own
+loop, so this behaves like RNS calling them from its own thread.
+"""
+import asyncio
+import hashlib
+import io
+import os
+import socket
+import types
+
+import RNS
+
+
+class Identity:
+    def __init__(self, key=None):
+        self.key = key or os.urandom(16)
+        self.hash = hashlib.sha256(self.key).digest()[:16]
+
+    def to_file(self, path):
+        with open(path, "wb") as f:
+            f.write(self.key)
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, "rb") as f:
+            return cls(f.read())
+
+
+class Link:
+    ACTIVE = RNS.Link.ACTIVE
+    CLOSED = RNS.Link.CLOSED
+    ACCEPT_APP = RNS.Link.ACCEPT_APP
+
+    def __init__(self, network, link_id, mdu):
+        self.network = network
+        self.link_id = link_id
+        self.mdu = mdu
+        self.status = self.ACTIVE
+        self.other = None
+        self.packet_callback = self.closed_callback = self.established_callback = None
+        self.resource_callback = self.resource_concluded_callback = None
+
+    def set_packet_callback(self, cb):
+        self.packet_callback = cb
+
+    def set_link_established_callback(self, cb):
+        self.established_callback = cb
+
+    def set_link_closed_callback(self, cb):
+        self.closed_callback = cb
+
+    def set_resource_strategy(self, strategy):
+        pass
+
+    def set_resource_callback(self, cb):
+        self.resource_callback = cb
+
+    def set_resource_concluded_callback(self, cb):
+        self.resource_concluded_callback = cb
+
+    def ready_for_new_resource(self):
+        return True
+
+    def teardown(self):
+        for link in (self, self.other):
+            if link.status == self.ACTIVE:
+                link.status = self.CLOSED
+                if link.closed_callback:
+                    link.closed_callback(link)
+
+
+class Packet:
+    def __init__(self, link, data):
+        self.link = link
+        self.data = bytes(data)
+
+    def send(self):
+        link = self.link
+        if link.status != Link.ACTIVE:
+            return None
+        link.network.sent.append((link, self.data))
+        if not link.network.drop(link, self.data) and link.other.packet_callback:
+            link.other.packet_callback(self.data, Packet(link.other, self.data))
+        return self
+
+
+class Advertisement:
+    def __init__(self, size):
+        self.size = size
+
+    def get_data_size(self):
+        return self.size
+
+
+class Resource:
+    """Sent whole at once; the receiver's data is closed once its callback returns, as in RNS"""
+    COMPLETE = RNS.Resource.COMPLETE
+    FAILED = RNS.Resource.FAILED
+
+    def __init__(self, data, link, auto_compress=True, callback=None, progress_callback=None):
+        self.link = link
+        self.status = self.FAILED
+        link.network.resources.append((link, bytes(data)))
+        other = link.other
+        if other.resource_callback and other.resource_callback(Advertisement(len(data))):
+            received = Resource.__new__(Resource)
+            received.link, received.status, received.data = other, self.COMPLETE, io.BytesIO(data)
+            other.resource_concluded_callback(received)
+            received.data.close()
+            self.status = self.COMPLETE
+        if progress_callback:
+            progress_callback(self)
+        if callback:
+            callback(self)
+
+    def get_progress(self):
+        return 1.0
+
+
+class Network:
+    """The RNS stand-in (transport=network.rns) shared by the bridges under test"""
+
+    def __init__(self, mdu=431):
+        self.mdu = mdu
+        self.destinations = {}      # hash -> inbound Destination
+        self.handlers = []
+        self.sent = []              # (link, packet) in send order
+        self.resources = []         # (link, data) in send order
+        self.drop = lambda link, data: False
+        self.links = 0
+        network = self
+
+        class Destination:
+            IN, OUT, SINGLE = 1, 2, 0
+
+            def __init__(self, identity, direction, kind, app, *aspects):
+                self.identity = identity
+                self.hash = identity.hash
+                self.direction = direction
+                self.established = None
+                if direction == self.IN:
+                    network.destinations[self.hash] = self
+
+            def set_link_established_callback(self, cb):
+                self.established = cb
+
+            def announce(self):
+                for handler in network.handlers:
+                    handler.received_announce(self.hash, self.identity, None, None, False)
+
+        class Transport:
+            @staticmethod
+            def has_path(h):
+                return h in network.destinations
+
+            @staticmethod
+            def request_path(h):
+                pass
+
+            @staticmethod
+            def register_announce_handler(handler):
+                network.handlers.append(handler)
+
+            @staticmethod
+            def deregister_announce_handler(handler):
+                network.handlers.remove(handler)
+
+            @staticmethod
+            def deregister_destination(destination):
+                network.destinations.pop(destination.hash, None)
+
+        class NetIdentity(Identity):
+            @staticmethod
+            def recall(h):
+                d = network.destinations.get(h)
+                return d and d.identity
+
+        class NetLink(Link):
+            def __new__(cls, destination):
+                return network.link(destination)
+
+        self.rns = types.SimpleNamespace(Identity=NetIdentity, Destination=Destination, Link=NetLink,
+                                         Packet=Packet, Resource=Resource, Transport=Transport)
+
+    def link(self, destination):
+        """Open a link to destination; both ends come up at once"""
+        self.links += 1
+        link_id = self.links.to_bytes(16, "big")
+        out, inbound = Link(self, link_id, self.mdu), Link(self, link_id[::-1], self.mdu)
+        out.other, inbound.other = inbound, out
+        self.destinations[destination.hash].established(inbound)
+        # The caller sets the established callback after the Link is made
+        asyncio.get_running_loop().call_soon(lambda: out.established_callback(out))
+        return out
+
+
+class LoopbackSocket:
+    """Datagram socket for a bridge's group: inject() stands in for ATAK, published holds what it sent"""
+
+    def __init__(self, group, port):
+        self.group = (group, port)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.setblocking(False)
+        self.published = []
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def recvfrom(self, n):
+        return self.sock.recvfrom(n)
+
+    def sendto(self, data, addr):
+        self.published.append(data)
+
+    def inject(self, data):
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.sendto(data, self.sock.getsockname())
+
+    def close(self):
+        self.sock.close()
@@ -0,0 +1,132 @@
+import asyncio
+import os
+import time
+
+import pytest
+
+import cot_bridge
+from cot_loadgen import retime
+from fake_transport import LoopbackSocket, Network
+
+CORPUS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "corpus")
+
+
+def corpus(name):
+    with open(os.path.join(CORPUS, name + ".xml"), "rb") as f:
+        return [retime(line.strip(), time.time(), 86400) for line in f if line.strip()]
+
+
+async def until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        await asyncio.sleep(0.02)
+
+
+def published(bridge):
+    return bridge.sa_socket.published + bridge.chat_socket.published
+
+
+async def start(tmp_path, network, name, **kw):
+    bridge = cot_bridge.CotBridge(transport=network.rns, socket_factory=LoopbackSocket, tcp_port=0,
+                                  identity_file=str(tmp_path / name), **kw)
+    await bridge.start()
+    return bridge
+
+
+async def linked_pair(tmp_path, network, **kw):
+    """Bridge a links to bridge b; returns once both have the other's hello"""
+    b = await start(tmp_path, network, "b", **kw)
+    a = await start(tmp_path, network, "a", peers=[b.destination.hash], **kw)
+    await until(lambda: a.active_peers() and b.active_peers()
+                and all(p.hello_acked for p in list(a.peers.values()) + list(b.peers.values())))
+    return a, b
+
+
+def bridged(tmp_path, network, sa=(), chat=(), **kw):
+    """Send events from ATAK on a's side and wait until b has published all of them"""
+    events = list(sa) + list(chat)
+
+    async def go():
+        a, b = await linked_pair(tmp_path, network, **kw)
+        try:
+            for data in sa:
+                a.sa_socket.inject(data)
+            for data in chat:
+                a.chat_socket.inject(data)
+            await until(lambda: all(data in published(b) for data in events))
+            return a, b
+        finally:
+            await a.stop()
+            await b.stop()
+    return asyncio.run(go())
+
+
+def test_packets(tmp_path):
+    network = Network()
+    bridged(tmp_path, network, sa=corpus("sa")[:3], chat=corpus("geochat")[:2])
+    assert not network.resources
+
+
+def test_fragments(tmp_path):
+    network = Network(mdu=120)
+    bridged(tmp_path, network, chat=corpus("geochat")[:2])
+    assert [d for _, d in network.sent if d[:1] == b"F"]
+    assert not network.resources
+
+
+def test_resources_are_read_before_rns_closes_them(tmp_path):
+    network = Network(mdu=120)
+    a, b = bridged(tmp_path, network, chat=corpus("large")[:2])
+    assert network.resources
+    assert not [e for e in b.event_log if "ERR" in e]
+
+
+def test_large_message_to_a_peer_without_resources_goes_as_fragments(tmp_path, monkeypatch):
+    monkeypatch.setattr(cot_bridge, "FEATURES", tuple(f for f in cot_bridge.FEATURES if f != "resource"))
+    network = Network(mdu=120)
+    bridged(tmp_path, network, chat=corpus("large")[:1])
+    assert not network.resources
+    assert len([d for _, d in network.sent if d[:1] == b"F"]) > cot_bridge.MAX_FRAGMENTS
+
+
+@pytest.mark.parametrize("mdu", [431, 120])
+def test_every_event_is_published_once(tmp_path, mdu):
+    network = Network(mdu=mdu)
+    sa, chat = corpus("sa")[:4], corpus("geochat")[:4]
+    a, b = bridged(tmp_path, network, sa, chat)
+    assert all(published(b).count(data) == 1 for data in sa)
+
+
+def test_peers_that_link_to_each_other_send_on_one_link(tmp_path):
+    network = Network()
+    sa = corpus("sa")
+
+    async def go():
+        ids = {}
+        for name in "ab":
+            ids[name] = network.rns.Identity()
+            ids[name].to_file(tmp_path / name)
+        a = await start(tmp_path, network, "a", peers=[ids["b"].hash])
+        b = await start(tmp_path, network, "b", peers=[ids["a"].hash])
+        low, high = sorted((a, b), key=lambda x: x.destination.hash)
+
+        def one_link():
+            ours, theirs = low.active_peers(), high.active_peers()
+            return (len(ours) == len(theirs) == 1 and ours[0].direction == "out"
+                    and ours[0].link.other is theirs[0].link)
+        try:
+            await until(one_link)
+            low.sa_socket.inject(sa[0])
+            await until(lambda: published(high) == [sa[0]])
+            # Both of the lower hash's links close: the other end sends on its own until it relinks
+            for p in list(low.peers.values()):
+                if p.direction == "out":
+                    p.link.teardown()
+            high.sa_socket.inject(sa[1])
+            await until(lambda: sa[1] in published(low))
+            await until(one_link)
+        finally:
+            await a.stop()
+            await b.stop()
+    asyncio.run(go())
@@ -0,0 +1,45 @@
+import pytest
+
+import cot_codec
+
+SA = (b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+      b'<event version="2.0" uid="ANDROID-5f3c9a1b2d4e6f70" type="a-f-G-U-C" '
+      b'time="2025-03-14T18:22:07.047Z" start="2025-03-14T18:22:07.047Z" '
+      b'stale="2025-03-14T18:23:22.047Z" how="m-g">'
+      b'<point lat="%s" lon="-122.4545382" hae="78.112" ce="9.9" le="9999999.0"/>'
+      b'<detail><contact callsign="GREEN-1"/><status battery="%d"/></detail></event>')
+
+
+def beacon(i):
+    return SA % (b"37.75%05d" % i, 90 - i)
+
+
+def test_delta_round_trip():
+    enc, dec = cot_codec.DeltaEncoder(), cot_codec.DeltaDecoder()
+    for i in range(5):
+        assert dec.decode(enc.encode(beacon(i))) == beacon(i)
+    assert enc.keyframes == 1 and enc.deltas == 4
+
+
+@pytest.mark.parametrize("drop", ["reset", "resync", "evict"])
+def test_lost_keyframe_after_reset_asks_for_resync(drop):
+    enc, dec = cot_codec.DeltaEncoder(max_uids=1), cot_codec.DeltaDecoder()
+    dec.decode(enc.encode(beacon(0)))
+    dec.decode(enc.encode(beacon(1)))
+    if drop == "reset":
+        enc.reset()
+    elif drop == "resync":
+        enc.resync(cot_codec.uid_key(b"ANDROID-5f3c9a1b2d4e6f70"))
+    else:
+        enc.encode(SA.replace(b"5f3c9a1b", b"00000000") % (b"1", 1))
+    lost = enc.encode(beacon(2))
+    assert lost[1] == cot_codec.KEYFRAME
+    with pytest.raises(cot_codec.ResyncNeeded):
+        dec.decode(enc.encode(beacon(3)))
+
+
+def test_generation_never_repeats_for_a_uid():
+    enc = cot_codec.DeltaEncoder(refresh=0)
+    first = enc.encode(beacon(0))
+    enc.generation = first[6] - 1 & 0xff
+    assert enc.encode(beacon(1))[6] != first[6]
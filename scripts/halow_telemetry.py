@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""Cached HaLow radio telemetry shared by the Haven dashboards
+
+Radio settings (mesh ID, channel, encryption, hardware) hardly ever
+change, so `iwinfo` is forked at most once per STATIC_TTL. Signal and
+bit rate come from `iw dev <iface> station dump` (the strongest peer),
+since a mesh interface isn't listed in /proc/net/wireless; noise comes
+from /proc/net/wireless when it is listed, else from iwinfo. Both are
+refreshed at most once per TTL. Readers always get the cached sample.
+
+    from halow_telemetry import HalowTelemetry
+    radio = HalowTelemetry("wlan0")
+    s = radio.sample()
+    print(s.channel, s.frequency, s.signal)
+
+Run it directly to print one sample.
+"""
+import re
+import subprocess
+import threading
+import time
+from typing import NamedTuple, Optional
+
+# ── Config ──────────────────────────────────────────────────────────
+INTERFACE = "wlan0"
+TTL = 2                   # seconds a signal and bit rate reading is reused
+STATIC_TTL = 30           # seconds between iwinfo runs
+PROC_WIRELESS = "/proc/net/wireless"
+
+# One pass over the whole iwinfo output per field instead of per line
+_IWINFO_RE = {
+    "mesh_id": re.compile(r'ESSID:\s*"([^"]+)"'),
+    "channel": re.compile(r'Channel:\s*(\d+)\s*\(([^)]+)\)'),
+    "bitrate": re.compile(r'Bit Rate:\s*(.+?)\s*$', re.M),
+    "signal": re.compile(r'Signal:\s*(-?\d+) dBm'),
+    "noise": re.compile(r'Noise:\s*(-?\d+) dBm'),
+    "encryption": re.compile(r'Encryption:\s*(.+?)\s*$', re.M),
+    "hardware": re.compile(r'Hardware:\s*(.+?)\s*$', re.M),
+}
+
+_STATION_RE = re.compile(r'^Station\s', re.M)
+_STATION_SIGNAL_RE = re.compile(r'^\s*signal:\s*(-?\d+)', re.M)
+_STATION_BITRATE_RE = re.compile(r'^\s*tx bitrate:\s*([\d.]+ \S+)', re.M)
+
+
+class HalowSample(NamedTuple):
+    """One reading of the radio; text fields are None when unknown"""
+    interface: str
+    mode: Optional[str] = None
+    mesh_id: Optional[str] = None
+    channel: Optional[str] = None
+    frequency: Optional[str] = None
+    bitrate: Optional[str] = None
+    encryption: Optional[str] = None
+    hardware: Optional[str] = None
+    signal_dbm: Optional[int] = None
+    noise_dbm: Optional[int] = None
+    timestamp: float = 0.0
+
+    @property
+    def signal(self):
+        return None if self.signal_dbm is None else f"{self.signal_dbm} dBm"
+
+    @property
+    def snr(self):
+        if self.signal_dbm is None or self.noise_dbm is None:
+            return None
+        return self.signal_dbm - self.noise_dbm
+
+
+def parse_iwinfo(out):
+    """Fields of `iwinfo <iface> info` output as a dict"""
+    info = {}
+    for key, regex in _IWINFO_RE.items():
+        m = regex.search(out)
+        if not m:
+            continue
+        if key == "channel":
+            info["channel"], info["frequency"] = m.group(1), m.group(2)
+        elif key in ("signal", "noise"):
+            info[key + "_dbm"] = int(m.group(1))
+        else:
+            info[key] = m.group(1)
+    if re.search(r'Mode:\s*Mesh', out):
+        info["mode"] = "Mesh Point"
+    return info
+
+
+def parse_station_dump(out):
+    """Signal and tx bit rate of the strongest station in `iw dev <iface> station dump` output"""
+    best = {}
+    for block in _STATION_RE.split(out)[1:]:
+        m = _STATION_SIGNAL_RE.search(block)
+        if not m:
+            continue
+        signal = int(m.group(1))
+        if "signal_dbm" in best and signal <= best["signal_dbm"]:
+            continue
+        best = {"signal_dbm": signal}
+        m = _STATION_BITRATE_RE.search(block)
+        if m:
+            best["bitrate"] = m.group(1)
+    return best
+
+
+def read_proc_wireless(iface, path=PROC_WIRELESS):
+    """(signal, noise) in dBm from /proc/net/wireless, None if not listed"""
+    try:
+        with open(path) as f:
+            for line in f:
+                name, _, rest = line.partition(":")
+                if name.strip() != iface:
+                    continue
+                fields = rest.split()
+                signal = int(float(fields[2]))
+                noise = int(float(fields[3]))
+                if signal == 0:
+                    return None   # not associated / driver doesn't report
+                # -256 is the "no reading" value some drivers report
+                return signal, noise if noise > -256 else None
+    except (OSError, IndexError, ValueError):
+        pass
+    return None
+
+
+class HalowTelemetry:
+    """Thread-safe, TTL-cached source of HalowSample for one interface"""
+
+    def __init__(self, iface=INTERFACE, ttl=TTL, static_ttl=STATIC_TTL):
+        self.iface = iface
+        self.ttl = ttl
+        self.static_ttl = static_ttl
+        self.lock = threading.Lock()
+        self.static = {}
+        self.static_at = None
+        self.current = HalowSample(iface)
+        self.iwinfo_runs = 0
+        self.iw_runs = 0
+
+    def refresh_static(self, now):
+        self.static_at = now
+        try:
+            out = subprocess.check_output(["iwinfo", self.iface, "info"],
+                                          stderr=subprocess.DEVNULL, timeout=5).decode()
+        except (OSError, subprocess.SubprocessError):
+            return
+        self.iwinfo_runs += 1
+        self.static = parse_iwinfo(out)
+
+    def read_stations(self):
+        try:
+            out = subprocess.check_output(["iw", "dev", self.iface, "station", "dump"],
+                                          stderr=subprocess.DEVNULL, timeout=5).decode()
+        except (OSError, subprocess.SubprocessError):
+            return {}
+        self.iw_runs += 1
+        return parse_station_dump(out)
+
+    def sample(self):
+        """The cached sample, refreshed if older than the TTL"""
+        now = time.monotonic()
+        with self.lock:
+            if now - self.current.timestamp < self.ttl and self.current.timestamp:
+                return self.current
+            if self.static_at is None or now - self.static_at >= self.static_ttl:
+                self.refresh_static(now)
+            fields = dict(self.static)
+            live = read_proc_wireless(self.iface)
+            if live:
+                fields["signal_dbm"], fields["noise_dbm"] = live
+            fields.update(self.read_stations())
+            self.current = HalowSample(self.iface, timestamp=now, **fields)
+            return self.current
+
+
+if __name__ == "__main__":
+    s = HalowTelemetry().sample()
+    for field in HalowSample._fields[:-1]:
+        print(f"{field:12}: {getattr(s, field)}")
+    print(f"{'snr':12}: {s.snr}")
@@ -1,53 +1,24 @@
 #!/usr/bin/env python3
 """Reticulum network status with live refresh and data exchange"""
 import RNS
-import subprocess
-import re
 import sys
 import os
 import time
 import threading
 import hashlib
 import zlib
+import halow_telemetry
 
 # ── Config ──────────────────────────────────────────────────────────
 PING_INTERVAL = 3
+RECONNECT_MIN = 1           # seconds before retrying the peer; doubles with each failure
+RECONNECT_MAX = 60          # longest wait between attempts
 APP_NAME = "haven"
 ASPECT = "status"
 IDENTITY_FILE = "/root/.rns_status_identity"
 
 # ── HaLow info ─────────────────────────────────────────────────────
-def get_halow_info():
-    try:
-        out = subprocess.check_output(["iwinfo", "wlan0", "info"], stderr=subprocess.DEVNULL).decode()
-        info = {}
-        for line in out.split("\n"):
-            line = line.strip()
-            if "Channel:" in line:
-                m = re.search(r'Channel:\s*(\d+)\s*\(([^)]+)\)', line)
-                if m:
-                    info["channel"] = m.group(1)
-                    info["frequency"] = m.group(2)
-            if "Bit Rate:" in line:
-                m = re.search(r'Bit Rate:\s*(.+?)$', line)
-                if m: info["bitrate"] = m.group(1).strip()
-            if "Signal:" in line:
-                m = re.search(r'Signal:\s*(\S+ \S+)', line)
-                if m: info["signal"] = m.group(1)
-            if "Encryption:" in line:
-                m = re.search(r'Encryption:\s*(.+?)$', line)
-                if m: info["encryption"] = m.group(1).strip()
-            if "Mode:" in line and "Mesh" in line:
-                info["mode"] = "Mesh Point"
-            if "ESSID:" in line:
-                m = re.search(r'ESSID:\s*"([^"]+)"', line)
-                if m: info["mesh_id"] = m.group(1)
-            if "Hardware:" in line:
-                m = re.search(r'Hardware:\s*(.+?)$', line)
-                if m: info["hardware"] = m.group(1).strip()
-        return info
-    except:
-        return {}
+radio = halow_telemetry.HalowTelemetry()
 
 # ── Hostname ────────────────────────────────────────────────────────
 try:
@@ -112,34 +83,69 @@ dest.set_link_established_callback(link_established)
 
 # ── Outbound link (if peer hash provided) ──────────────────────────
 outbound_link = None
+reconnects = 0
 if len(sys.argv) > 1:
     peer_hash = bytes.fromhex(sys.argv[1])
     link_status = "Connecting to peer..."
+    wake = threading.Event()    # the link closed, or the peer announced
+
+    class PeerAnnounces:
+        """Wakes the link thread when a path to the peer turns up"""
+        aspect_filter = f"{APP_NAME}.{ASPECT}"
+        receive_path_responses = True
+
+        def received_announce(self, destination_hash, announced_identity, app_data, announce_packet_hash, is_path_response):
+            if destination_hash != peer_hash:
+                return
+            link = outbound_link
+            if link and link.status == RNS.Link.ACTIVE and not is_path_response:
+                link.teardown()     # the peer restarted; our link to it is dead
+            wake.set()
+
+    RNS.Transport.register_announce_handler(PeerAnnounces())
 
     def connect_to_peer():
-        global outbound_link, link_status
+        global outbound_link
         if not RNS.Transport.has_path(peer_hash):
             RNS.Transport.request_path(peer_hash)
-            for _ in range(15):
-                time.sleep(1)
-                if RNS.Transport.has_path(peer_hash):
-                    break
-
+            return None
         peer_identity = RNS.Identity.recall(peer_hash)
-        if peer_identity:
-            peer_dest = RNS.Destination(peer_identity, RNS.Destination.OUT, RNS.Destination.SINGLE, APP_NAME, ASPECT)
-            outbound_link = RNS.Link(peer_dest)
-            outbound_link.set_packet_callback(on_packet)
-            outbound_link.set_link_established_callback(lambda l: on_outbound_ready(l))
-        else:
-            link_status = "Could not find peer"
+        if not peer_identity:
+            return None
+        peer_dest = RNS.Destination(peer_identity, RNS.Destination.OUT, RNS.Destination.SINGLE, APP_NAME, ASPECT)
+        outbound_link = RNS.Link(peer_dest)
+        outbound_link.set_packet_callback(on_packet)
+        outbound_link.set_link_established_callback(lambda l: on_outbound_ready(l))
+        outbound_link.set_link_closed_callback(lambda l: wake.set())
+        return outbound_link
+
+    def keep_linked():
+        """Link to the peer, and again whenever the link drops, backing off while it can't be reached"""
+        global link_status, reconnects
+        backoff = RECONNECT_MIN
+        while True:
+            link = connect_to_peer()
+            if link:
+                while link.status != RNS.Link.CLOSED:
+                    wake.wait()
+                    wake.clear()
+                if link.activated_at:
+                    # It was up, so try again straight away
+                    backoff = RECONNECT_MIN
+                    reconnects += 1
+                    link_status = "Link lost, reconnecting..."
+                    continue
+            link_status = f"Peer unreachable, retrying in {backoff}s"
+            wake.wait(backoff)
+            wake.clear()
+            backoff = min(backoff * 2, RECONNECT_MAX)
 
     def on_outbound_ready(link):
         global link_status
         link_status = "Link active"
         RNS.Packet(link, f"HELLO:{hostname}".encode()).send()
 
-    t = threading.Thread(target=connect_to_peer, daemon=True)
+    t = threading.Thread(target=keep_linked, daemon=True)
     t.start()
 
 # ── Ping loop ──────────────────────────────────────────────────────
@@ -177,7 +183,7 @@ except:
 # ── Display loop ───────────────────────────────────────────────────
 try:
     while True:
-        halow = get_halow_info()
+        halow = radio.sample()
 
         # Clear screen
         print("\033[2J\033[H", end="", flush=True)
@@ -191,14 +197,14 @@ try:
         print()
         print(f"  Radio Transport Layer")
         print(f"  {'-'*54}")
-        print(f"    Hardware      : {halow.get('hardware', 'N/A')}")
-        print(f"    Mode          : {halow.get('mode', 'N/A')}")
-        print(f"    Mesh ID       : {halow.get('mesh_id', 'N/A')}")
-        print(f"    Frequency     : {halow.get('frequency', 'N/A')}")
-        print(f"    Channel       : {halow.get('channel', 'N/A')}")
-        print(f"    Bit Rate      : {halow.get('bitrate', 'N/A')}")
-        print(f"    Signal        : {halow.get('signal', 'N/A')}")
-        print(f"    Encryption    : {halow.get('encryption', 'N/A')}")
+        print(f"    Hardware      : {halow.hardware or 'N/A'}")
+        print(f"    Mode          : {halow.mode or 'N/A'}")
+        print(f"    Mesh ID       : {halow.mesh_id or 'N/A'}")
+        print(f"    Frequency     : {halow.frequency or 'N/A'}")
+        print(f"    Channel       : {halow.channel or 'N/A'}")
+        print(f"    Bit Rate      : {halow.bitrate or 'N/A'}")
+        print(f"    Signal        : {halow.signal or 'N/A'}")
+        print(f"    Encryption    : {halow.encryption or 'N/A'}")
         print()
         print(f"  Reticulum Interfaces")
         print(f"  {'-'*54}")
@@ -219,6 +225,8 @@ try:
         print(f"  {'-'*54}")
         print(f"    Packets TX    : {packets_tx}")
         print(f"    Packets RX    : {packets_rx}")
+        if outbound_link is not None:
+            print(f"    Reconnects    : {reconnects}")
 
         if peers:
             for name, info in peers.items():
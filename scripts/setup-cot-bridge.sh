@@ -10,6 +10,7 @@
 # Usage:
 #   sh setup-cot-bridge.sh                    # Install only (Gate node)
 #   sh setup-cot-bridge.sh <peer_hash>        # Install and configure peering (Point node)
+#   sh setup-cot-bridge.sh <hash> <hash> ...  # Link to several peer bridges
 #
 # How it works:
 #   The bridge joins ATAK's standard multicast groups (SA and Chat),
@@ -22,14 +23,14 @@
 #   2. Start the bridge and note its destination hash
 #   3. Run this script on each Point node, passing the Gate's hash
 #
-#   You can also set the peer hash later:
+#   You can also set the peer hash later (one hash per line):
 #     echo "<hash>" > /root/.cot_peer
 #     /etc/init.d/cot_bridge restart
 #
 
 set -e
 
-PEER_HASH="$1"
+PEER_HASHES="$*"
 
 echo "═══════════════════════════════════════════════════════════════════"
 echo "  ATAK CoT Bridge Setup"
@@ -47,21 +48,33 @@ if ! command -v rnsd >/dev/null 2>&1; then
     exit 1
 fi
 
-echo "[1/3] Installing CoT Bridge script..."
+echo "[1/3] Installing CoT Bridge scripts..."
 cat > /root/cot_bridge.py << 'BRIDGE'
 #!/usr/bin/env python3
 """CoT Bridge — ATAK over Reticulum via HaLow mesh"""
 import RNS
 import socket
 import struct
-import subprocess
-import re
 import sys
 import os
 import time
-import zlib
 import hashlib
+import heapq
+import itertools
+import random
 import threading
+import asyncio
+import argparse
+import json
+import cot_codec
+import cot_metrics
+import cot_aoi
+try:
+    import halow_telemetry
+except ImportError:  # running from a repo checkout rather than /root
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+    import halow_telemetry
+from collections import OrderedDict, deque
 
 COT_SA_MULTICAST = "239.2.3.1"
 COT_SA_PORT = 6969
@@ -70,9 +83,170 @@ COT_CHAT_PORT = 17012
 APP_NAME = "atak"
 ASPECT = "cot"
 IDENTITY_FILE = "/root/.cot_identity"
-MAX_PAYLOAD = 400
+MAX_PAYLOAD = 400           # packet size for a link that doesn't report its MDU
+MAX_FRAGMENTS = 4           # fragments per message on a link; bigger messages go as an RNS Resource
+MAX_FRAGMENTS_LEGACY = 255  # fragments per message to a peer that doesn't take Resources (one-byte count)
+MAX_FRAGMENTS_RX = 255      # fragments accepted per message, so a peer that thinks we are legacy gets through
+MAX_BULK_SIZE = 1048576     # largest Resource accepted from a peer
+COMPRESSION = "auto"        # codec for the link, e.g. "zdict", "zlib:6", "lzma", or "auto" to pick per message
+CODEC_CANDIDATES = ("zdict:1", "zdict:6", "zdict", "deflate", "lzma", "zstd", "brotli")  # tried by "auto" if installed
+CODEC_CPU_WEIGHT = 1.0      # airtime seconds one second of compression CPU is worth
+LEGACY_CODECS = cot_codec.LEGACY_CODECS  # assumed for peers that send no hello
+DELTA_SA = True             # delta-code repeated SA beacons, to peers whose hello lists "delta"
 DISPLAY_INTERVAL = 2
 MAX_LOG_LINES = 12
+HOUSEKEEPING_INTERVAL = 5   # seconds between fragment-expiry sweeps
+FRAGMENT_TIMEOUT = 30       # drop partial messages older than this
+MAX_PARTIAL = 64            # partial messages held for reassembly
+MAX_PARTIAL_BYTES = 262144  # fragment bytes held for reassembly
+NACK_CLASSES = ("CHAT", "CoT")  # classes whose lost fragments peers may ask for again
+NACK_DELAY = 1.0            # seconds without a new fragment before asking for the missing ones
+NACK_RETRIES = 3            # times one message's missing fragments are asked for
+RETRANSMIT_CACHE = 64       # sent fragmented messages kept for retransmission
+FEC = "auto"                # parity for fragmented messages: "auto" from the loss peers report, "off", "1" or "2" groups
+FEC_TARGET = 0.99           # chance of a fragmented message arriving whole that "auto" aims for
+FEC_MAX_GROUPS = 2          # most parity packets per message
+MIN_LOSS_SAMPLE = 20        # fragments counted before reporting loss to a peer
+FEATURES = ("nack", "fec", "standby", "delta", "agg", "resource")  # protocol extensions announced in the hello
+RECONNECT_MIN = 1           # seconds before retrying a failed link; doubles with each failure
+RECONNECT_MAX = 60          # longest wait between link attempts to one peer
+RECONNECT_JITTER = 0.25     # +/- fraction of each wait, so peers that lost each other don't retry in step
+STANDBY = True              # keep a second, idle link to each configured peer to fail over to
+HELLO_INTERVAL = 2          # seconds between hellos until the peer confirms it has ours
+HELLO_RETRIES = 5           # intervals to wait before a silent peer is taken to be an older bridge
+MAX_DRAIN = 256             # datagrams read per socket per wakeup
+MAX_PENDING_SA = 256        # queued SA events (one per UID) before dropping oldest
+MAX_PENDING_CHAT = 128      # queued chat messages before dropping oldest
+STALE_MARGIN = 1.0          # seconds before its stale time an event is no longer worth sending
+UNDATED_STALE = 75          # queue order for events without a stale time, as if stale this long after arrival
+SEND_RATE = 25000           # token-bucket pacing for link sends, payload bytes/s
+SEND_BURST = 4000           # token-bucket depth, bytes
+AGGREGATE_HOLD = 0.2        # seconds small SA events may wait to share a packet (0 = off)
+AGGREGATE_SLACK = 0.2       # aggregates estimated within this fraction of the packet size are compressed to check
+MAX_IN_FLIGHT = 4           # messages per priority class being sent at once
+MAX_PEER_BACKLOG = 32       # messages per class queued for one slow peer before dropping
+MAX_PEER_BULK = 8           # large messages queued for one peer before dropping
+MAX_PEER_ROWS = 6           # peers listed on the dashboard
+PRIORITIES = ("CHAT", "CoT")  # send order, highest first
+SEEN_TTL = 60               # seconds a bridged message digest is remembered
+MAX_SEEN = 4096             # digests remembered for duplicate/loop suppression
+ROUTES = (                  # CoT type prefix -> local multicast groups ("sa", "chat"); longest prefix wins
+    ("b-t-f", ("chat",)),   # GeoChat messages, delivery and read receipts
+    ("", ("sa",)),          # everything else
+)
+TCP_ADDR = "0.0.0.0"        # streaming CoT listener bind address
+TCP_PORT = 8087             # streaming CoT over TCP for WinTAK/iTAK/ATAK server connections (0 = off)
+MAX_TCP_CLIENTS = 64        # streaming connections accepted at once
+MAX_TCP_BUFFER = 262144     # bytes queued to one slow TCP client before events to it are dropped
+MAX_DATAGRAM = 65507        # largest UDP payload; bigger events only reach TCP clients
+MAX_TCP_EVENT = 1048576     # largest CoT event accepted from a TCP client
+TCP_PING = b"t-x-c-t"       # client keep-alive event type; answered by nobody, never bridged
+AOI = None                  # this node's area of interest, told to peers: "bbox:S,W,N,E" or "radius:LAT,LON,KM"
+METRICS_ADDR = "127.0.0.1"  # metrics endpoint bind address ("0.0.0.0" to scrape from other hosts)
+METRICS_PORT = 9105         # http://METRICS_ADDR:METRICS_PORT/metrics (0 = off)
+LOG_LEVEL = "info"          # headless output threshold: debug (every packet), info, warning, error
+LOG_RATE = 20               # headless events/s sustained before lines are suppressed
+LOG_BURST = 200             # headless events allowed in a burst
+LOG_FLUSH = 1               # seconds between headless output writes
+
+# ── Egress routing ─────────────────────────────────────────────────
+GROUP_NAMES = ("sa", "chat")
+
+def parse_route(spec):
+    """"b-t-f=chat", "a-f=sa,chat" or "t-x=none" -> (type prefix, groups)"""
+    prefix, sep, names = spec.partition("=")
+    groups = tuple(g for g in names.split(",") if g and g != "none")
+    if not sep or any(g not in GROUP_NAMES for g in groups):
+        raise argparse.ArgumentTypeError(f"route {spec!r}: expected TYPE=sa, TYPE=chat, TYPE=sa,chat or TYPE=none")
+    return prefix, groups
+
+class RouteTable:
+    """Local multicast groups for each CoT type, by longest matching type prefix
+
+    Classification reads only the <event> start tag. Results are cached
+    per type; a mesh carries a few dozen distinct types at most.
+    """
+
+    MAX_CACHE = 1024
+
+    def __init__(self, routes=ROUTES):
+        routes = [(p.encode() if isinstance(p, str) else p, tuple(g)) for p, g in routes]
+        self.routes = sorted(routes, key=lambda r: -len(r[0]))  # stable: earlier entries win ties
+        self.cache = {}
+
+    def groups(self, cot_type):
+        groups = self.cache.get(cot_type)
+        if groups is None:
+            groups = next((g for p, g in self.routes if cot_type.startswith(p)), ())
+            if len(self.cache) < self.MAX_CACHE:
+                self.cache[cot_type] = groups
+        return groups
+
+    def classify(self, data):
+        """(type, priority label, groups) for one CoT event"""
+        cot_type = cot_codec.event_header(data).get(b"type")
+        if cot_type is None:
+            # Not a well-formed event; fall back to sniffing the start of it
+            sample = data[:512]
+            groups = ("chat",) if b"GeoChat" in sample or b"__chat" in sample else ("sa",)
+        else:
+            groups = self.groups(cot_type)
+        return cot_type, "CHAT" if "chat" in groups else "CoT", groups
+
+# ── Fragment repair ────────────────────────────────────────────────
+CLASS_NAMES = {"chat": "CHAT", "sa": "CoT"}
+
+def parse_classes(spec):
+    """"chat,sa", "chat" or "none" -> priority labels"""
+    names = [n for n in spec.split(",") if n and n != "none"]
+    if any(n not in CLASS_NAMES for n in names):
+        raise argparse.ArgumentTypeError(f"classes {spec!r}: expected chat, sa, chat,sa or none")
+    return tuple(CLASS_NAMES[n] for n in names)
+
+def positive(spec):
+    """An int above zero"""
+    try:
+        n = int(spec)
+    except ValueError:
+        n = 0
+    if n <= 0:
+        raise argparse.ArgumentTypeError(f"{spec!r}: expected a whole number above 0")
+    return n
+
+parser = argparse.ArgumentParser(description="ATAK CoT bridge over Reticulum")
+parser.add_argument("peers", nargs="*", metavar="peer", help="destination hashes of peer bridges to link to")
+parser.add_argument("--rate", type=positive, default=SEND_RATE, help=f"link send rate in bytes/s (default: {SEND_RATE})")
+parser.add_argument("--burst", type=int, default=SEND_BURST, help=f"send burst size in bytes (default: {SEND_BURST})")
+parser.add_argument("--hold", type=float, default=AGGREGATE_HOLD,
+                    help=f"max seconds to hold small events for aggregation, 0 to disable (default: {AGGREGATE_HOLD})")
+parser.add_argument("--codec", default=COMPRESSION,
+                    help=f"compression codec[:level], or auto to pick per message by cost (default: {COMPRESSION}; "
+                         f"available: {', '.join(cot_codec.CODECS)})")
+parser.add_argument("--route", action="append", default=[], metavar="TYPE=GROUPS", type=parse_route,
+                    help="send CoT types starting with TYPE to GROUPS (sa, chat, sa,chat or none) on local "
+                         "multicast; repeatable, and takes precedence over the built-in table (b-t-f=chat, everything else "
+                         "sa), which still applies to other types")
+parser.add_argument("--nack", type=parse_classes, default=NACK_CLASSES, metavar="CLASSES",
+                    help="classes whose lost fragments peers may ask for again: chat, sa, chat,sa or none "
+                         "(default: chat,sa)")
+parser.add_argument("--fec", choices=("auto", "off", "1", "2"), default=FEC,
+                    help="parity packets for fragmented messages: auto (from the loss each peer reports), off, "
+                         f"or a fixed 1 or 2 per message (default: {FEC})")
+parser.add_argument("--no-standby", dest="standby", action="store_false",
+                    help="don't hold a second, idle link to each peer to switch to when the first one closes")
+parser.add_argument("--tcp-port", type=int, default=TCP_PORT,
+                    help=f"streaming CoT TCP port, 0 to disable (default: {TCP_PORT})")
+parser.add_argument("--tcp-addr", default=TCP_ADDR, help=f"streaming CoT bind address (default: {TCP_ADDR})")
+parser.add_argument("--aoi", default=AOI, metavar="AREA",
+                    help="only ask peers for positions inside AREA, bbox:S,W,N,E or radius:LAT,LON,KM; "
+                         "chat, alerts and events without a position still arrive (default: everything)")
+parser.add_argument("--metrics-port", type=int, default=METRICS_PORT,
+                    help=f"Prometheus metrics port, 0 to disable (default: {METRICS_PORT})")
+parser.add_argument("--metrics-addr", default=METRICS_ADDR, help=f"metrics bind address (default: {METRICS_ADDR})")
+parser.add_argument("--log", choices=("tui", "jsonl", "syslog"),
+                    help="output: live dashboard, JSON lines on stdout, or syslog (default: tui on a terminal, else jsonl)")
+parser.add_argument("--log-level", choices=("debug", "info", "warning", "error"), default=LOG_LEVEL,
+                    help=f"lowest level written in jsonl/syslog mode (default: {LOG_LEVEL})")
 
 # ── Hostname ────────────────────────────────────────────────────────
 try:
@@ -80,47 +254,6 @@ try:
 except:
     hostname = "unknown"
 
-# ── HaLow radio info ───────────────────────────────────────────────
-def get_halow_info():
-    try:
-        out = subprocess.check_output(["iwinfo", "wlan0", "info"], stderr=subprocess.DEVNULL).decode()
-        info = {}
-        for line in out.split("\n"):
-            line = line.strip()
-            if "Channel:" in line:
-                m = re.search(r'Channel:\s*(\d+)\s*\(([^)]+)\)', line)
-                if m:
-                    info["channel"] = m.group(1)
-                    info["frequency"] = m.group(2)
-            if "Bit Rate:" in line:
-                m = re.search(r'Bit Rate:\s*(.+?)$', line)
-                if m: info["bitrate"] = m.group(1).strip()
-            if "Signal:" in line:
-                m = re.search(r'Signal:\s*(\S+ \S+)', line)
-                if m: info["signal"] = m.group(1)
-            if "Encryption:" in line:
-                m = re.search(r'Encryption:\s*(.+?)$', line)
-                if m: info["encryption"] = m.group(1).strip()
-            if "Mode:" in line and "Mesh" in line:
-                info["mode"] = "Mesh Point"
-            if "ESSID:" in line:
-                m = re.search(r'ESSID:\s*"([^"]+)"', line)
-                if m: info["mesh_id"] = m.group(1)
-        return info
-    except:
-        return {}
-
-# ── Reticulum setup ────────────────────────────────────────────────
-reticulum = RNS.Reticulum()
-
-if os.path.exists(IDENTITY_FILE):
-    identity = RNS.Identity.from_file(IDENTITY_FILE)
-else:
-    identity = RNS.Identity()
-    identity.to_file(IDENTITY_FILE)
-
-destination = RNS.Destination(identity, RNS.Destination.IN, RNS.Destination.SINGLE, APP_NAME, ASPECT)
-
 # ── Multicast sockets ──────────────────────────────────────────────
 def make_mcast_socket(mcast_addr, port):
     s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
@@ -129,33 +262,1520 @@ def make_mcast_socket(mcast_addr, port):
     mreq = struct.pack("4sl", socket.inet_aton(mcast_addr), socket.INADDR_ANY)
     s.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
     s.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 0)
-    s.settimeout(0.1)
+    s.setblocking(False)
     return s
 
-sa_socket = make_mcast_socket(COT_SA_MULTICAST, COT_SA_PORT)
-chat_socket = make_mcast_socket(COT_CHAT_MULTICAST, COT_CHAT_PORT)
-
-# ── Shared state ───────────────────────────────────────────────────
-lock = threading.Lock()
-tx_packets = 0
-rx_packets = 0
-tx_bytes = 0
-rx_bytes = 0
-link_status = "Waiting for peer..."
-active_link = None
-outbound_link = None
-fragment_buffer = {}
-event_log = []
-start_time = time.time()
+# ── Outbound queue ─────────────────────────────────────────────────
+class OutboundQueue:
+    """Pending sends: newest SA event per UID, every chat message; earliest stale time first
+
+    Events without a stale time are ordered as if they went stale
+    UNDATED_STALE seconds after arrival. When a full class overflows, the
+    event closest to going stale is dropped. Expired events are returned
+    like any other; the scheduler decides what is still worth sending.
+    """
+
+    def __init__(self, max_sa=MAX_PENDING_SA, max_chat=MAX_PENDING_CHAT):
+        self.max_sa = max_sa
+        self.max_chat = max_chat
+        self.sa = {}                # uid -> (data, label, time received, stale time or None)
+        self.sa_order = []          # heap of (deadline, seq, uid), one per entry in self.sa
+        self.chat = []              # heap of (deadline, seq, item)
+        self.seq = itertools.count()
+        self.lock = threading.Lock()
+        self.superseded = 0
+        self.dropped = 0
+
+    def put(self, data, label):
+        header = cot_codec.event_header(data)
+        stale = cot_codec.parse_time(header.get(b"stale"))
+        item = (data, label, time.monotonic(), stale)
+        deadline = stale if stale is not None else time.time() + UNDATED_STALE
+        with self.lock:
+            if label == "CHAT":
+                heapq.heappush(self.chat, (deadline, next(self.seq), item))
+                if len(self.chat) > self.max_chat:
+                    heapq.heappop(self.chat)
+                    self.dropped += 1
+                return
+            uid = header.get(b"uid") or hashlib.md5(data).digest()
+            if uid in self.sa:
+                # Replace in place: the contact keeps its turn in the queue
+                self.superseded += 1
+            else:
+                heapq.heappush(self.sa_order, (deadline, next(self.seq), uid))
+            self.sa[uid] = item
+            if len(self.sa) > self.max_sa:
+                del self.sa[heapq.heappop(self.sa_order)[2]]
+                self.dropped += 1
+
+    def get(self, label=None):
+        """Next (data, label, time received, stale time) to send, chat first, or None"""
+        with self.lock:
+            if self.chat and label in (None, "CHAT"):
+                return heapq.heappop(self.chat)[2]
+            if self.sa and label != "CHAT":
+                return self.sa.pop(heapq.heappop(self.sa_order)[2])
+            return None
+
+    def __len__(self):
+        return len(self.sa) + len(self.chat)
+
+# ── Duplicate / loop suppression ───────────────────────────────────
+class SeenCache:
+    """Digests of recently bridged CoT, so replays and loops are dropped
+
+    Every entry lives for the same TTL, so the OrderedDict's insertion
+    order is also expiry order.
+    """
+
+    def __init__(self, ttl=SEEN_TTL, max_entries=MAX_SEEN):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # digest -> expiry
+        self.lock = threading.Lock()
+        self.ingest_dropped = 0
+        self.egress_dropped = 0
+
+    def seen(self, data):
+        """True if data was bridged within the TTL; otherwise remember it"""
+        digest = hashlib.blake2b(data, digest_size=8).digest()
+        now = time.monotonic()
+        with self.lock:
+            while self.entries:
+                oldest, expiry = next(iter(self.entries.items()))
+                if expiry > now:
+                    break
+                del self.entries[oldest]
+            if digest in self.entries:
+                return True
+            self.entries[digest] = now + self.ttl
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            return False
+
+    def __len__(self):
+        return len(self.entries)
+
+# ── Peers ──────────────────────────────────────────────────────────
+class Peer:
+    """One Reticulum link to another bridge, with its own send queue and stats"""
+
+    def __init__(self, link, name, direction):
+        self.link = link
+        self.name = name
+        self.direction = direction  # "in" or "out"
+        self.queue = {label: deque() for label in PRIORITIES}  # label -> deque of (time received, stale, packet deque)
+        self.decoder = cot_codec.DeltaDecoder()
+        self.tx_packets = 0
+        self.tx_bytes = 0
+        self.rx_packets = 0
+        self.rx_bytes = 0
+        self.dropped = 0
+        self.bulk = deque()         # large payloads waiting to go out as Resources
+        self.bulk_sent = 0
+        self.bulk_failed = 0
+        self.bulk_size = 0          # bytes of the Resource in progress
+        self.bulk_charged = 0       # of those, bytes taken from the token bucket so far
+        self.codecs = set(LEGACY_CODECS)  # replaced by the peer's hello
+        self.zdicts = set(cot_codec.LEGACY_ZDICTS)  # zdict versions the peer has
+        self.features = set()       # FEATURES the peer's hello announced
+        self.loss = 0.0             # fragment loss the peer reports from us
+        self.standby = False        # an idle link held for failover; nothing is sent on it
+        self.node = None            # the peer's destination hash, from its hello
+        self.hello_seen = None      # round of the peer's latest hello, once one has arrived
+        self.hello_acked = False    # the peer has confirmed our latest hello
+        self.hello_round = 0        # bumped each time our hello changes
+
+    def enqueue(self, label, packets, stamp, stale):
+        msgs = self.queue[label]
+        msgs.append((stamp, stale, deque(packets)))
+        if len(msgs) > MAX_PEER_BACKLOG:
+            msgs.popleft()
+            self.dropped += 1
+
+    def enqueue_bulk(self, payload):
+        self.bulk.append(payload)
+        if len(self.bulk) > MAX_PEER_BULK:
+            self.bulk.popleft()
+            self.dropped += 1
+
+    def backlog(self):
+        return sum(len(q) for q in self.queue.values()) + len(self.bulk)
+
+    def payload(self):
+        """Largest packet this link carries, read live so MTU updates are followed"""
+        return getattr(self.link, "mdu", None) or MAX_PAYLOAD
+
+# ── Link supervision ───────────────────────────────────────────────
+class PeerTarget:
+    """A configured peer and the links the supervisor holds to it"""
+
+    def __init__(self, remote_hash):
+        self.hash = remote_hash
+        self.name = remote_hash.hex()[:8]
+        self.destination = None     # built once the peer's identity is known, then reused
+        self.primary = None         # Peer carrying traffic
+        self.standby = None         # idle Peer to fail over to
+        self.pending = None         # link being established
+        self.backoff = 0            # seconds to wait after the next failure is doubled from this
+        self.next_attempt = 0.0     # time.monotonic() of the next attempt
+        self.down_since = None      # when the last primary was lost with nothing to take over
+        self.refresh = False        # the peer restarted; replace the primary with a new link
+
+class LinkSupervisor:
+    """Keeps a link open to every configured peer, for as long as the bridge runs
+
+    Paths come from announces rather than polling: the supervisor is an
+    RNS announce handler for atak.cot, so an announce or path response
+    from a configured peer caches its identity and wakes the supervisor
+    at once. Links that fail to establish are retried with exponential
+    backoff, RECONNECT_MIN doubling to RECONNECT_MAX. Once a peer is
+    linked, a standby link is opened behind the primary (if the peer
+    understands them) and takes over the moment the primary closes. A
+    live announce from a linked peer means it restarted and our links to
+    it are dead, so a new link is made and swapped in. When both ends
+    have each other configured, the one with the higher destination hash
+    leaves its own link idle and sends on the one the peer opened.
+    """
+
+    aspect_filter = f"{APP_NAME}.{ASPECT}"
+    receive_path_responses = True
+
+    def __init__(self, bridge, hashes, standby=STANDBY):
+        self.bridge = bridge
+        self.targets = {h: PeerTarget(h) for h in hashes}
+        self.standby = standby
+        self.wake = None    # asyncio.Event, made on the loop by run()
+
+    def notify(self):
+        if self.wake:
+            self.wake.set()
+
+    def received_announce(self, destination_hash, announced_identity, app_data, announce_packet_hash, is_path_response):
+        # Called on the RNS thread
+        if destination_hash in self.targets:
+            self.bridge.threadsafe(self.announced)(destination_hash, announced_identity, is_path_response)
+
+    def announced(self, remote_hash, identity, is_path_response):
+        target = self.targets[remote_hash]
+        T = self.bridge.transport
+        if identity is not None:
+            target.destination = T.Destination(identity, T.Destination.OUT, T.Destination.SINGLE, APP_NAME, ASPECT)
+        if target.primary is not None:
+            if is_path_response or target.refresh:
+                return
+            self.bridge.add_event(f"LINK {target.name} restarted ─ relinking")
+            target.refresh = True
+            if target.standby:
+                target.standby.link.teardown()
+        target.backoff = 0
+        target.next_attempt = 0.0
+        self.notify()
+
+    def wanted(self, target):
+        """Whether target needs another link opened"""
+        if target.pending is not None:
+            return False
+        if target.primary is None or target.refresh:
+            return True
+        return (self.standby and target.standby is None and not target.primary.standby
+                and "standby" in target.primary.features)
+
+    def connect(self, target):
+        bridge, T = self.bridge, self.bridge.transport
+        if not T.Transport.has_path(target.hash):
+            # The path response is an announce, which wakes us
+            T.Transport.request_path(target.hash)
+            self.retry(target, "no_path")
+            return
+        if target.destination is None:
+            identity = T.Identity.recall(target.hash)
+            if not identity:
+                self.retry(target, "no_path")
+                return
+            target.destination = T.Destination(identity, T.Destination.OUT, T.Destination.SINGLE, APP_NAME, ASPECT)
+        try:
+            link = T.Link(target.destination)
+        except Exception as e:
+            bridge.add_event(f"ERR {target.name} link {e}", "error")
+            self.retry(target, "failed")
+            return
+        link.set_link_established_callback(bridge.threadsafe(self.established))
+        link.set_link_closed_callback(bridge.threadsafe(bridge.link_closed))
+        link.set_packet_callback(bridge.threadsafe(bridge.link_packet_callback))
+        target.pending = link
+
+    def retry(self, target, result):
+        """Count a failed attempt and back off before the next"""
+        self.bridge.m_link_attempts.inc(result=result)
+        target.backoff = min(max(target.backoff * 2, RECONNECT_MIN), RECONNECT_MAX)
+        wait = target.backoff * random.uniform(1 - RECONNECT_JITTER, 1 + RECONNECT_JITTER)
+        target.next_attempt = time.monotonic() + wait
+        level = "warning" if target.primary is None else "debug"
+        self.bridge.add_event(f"LINK {target.name} {result.replace('_', ' ')} ─ retry in {wait:.0f}s", level)
+
+    def established(self, link):
+        target = next((t for t in self.targets.values() if t.pending is link), None)
+        if target is None:
+            link.teardown()
+            return
+        bridge = self.bridge
+        target.pending = None
+        target.backoff = 0
+        bridge.m_link_attempts.inc(result="established")
+        if target.primary is None or target.refresh:
+            old, target.refresh = target.primary, False
+            target.primary = bridge.add_peer(link, target.name, "out", standby=self.yields(target))
+            if target.down_since is not None:
+                down = time.monotonic() - target.down_since
+                bridge.m_recovery.observe(down, how="reconnect")
+                bridge.add_event(f"LINK {target.name} back after {down:.1f}s")
+                target.down_since = None
+            if old is not None:
+                old.link.teardown()
+        else:
+            target.standby = bridge.add_peer(link, target.name, "out", standby=True)
+        self.notify()
+
+    def closed(self, link):
+        """A link closed; fail over to the standby or start reconnecting"""
+        for target in self.targets.values():
+            if target.pending is link:
+                target.pending = None
+                self.retry(target, "failed")
+            elif target.standby and target.standby.link is link:
+                target.standby = None
+                target.next_attempt = time.monotonic() + max(target.backoff, RECONNECT_MIN)
+            elif target.primary and target.primary.link is link:
+                standby, target.primary, target.standby = target.standby, None, None
+                if standby and standby.link.status == self.bridge.transport.Link.ACTIVE:
+                    target.primary = standby
+                    self.bridge.promote(standby)
+                    self.bridge.m_recovery.observe(0, how="standby")
+                    self.bridge.add_event(f"LINK {target.name} switched to standby link")
+                else:
+                    if standby:
+                        # Not usable, and no longer tracked: close it rather than leak it
+                        standby.link.teardown()
+                    target.down_since = time.monotonic()
+                    target.next_attempt = 0.0
+                    self.bridge.add_event(f"LINK {target.name} lost ─ reconnecting", "warning")
+            else:
+                continue
+            self.notify()
+            return
+
+    def inbound(self, target, standby=True):
+        """Links the peer opened to us, idle ones too unless standby is False"""
+        return [p for p in self.bridge.peers.values() if p.direction == "in" and p.node == target.hash
+                and p.link.status == self.bridge.transport.Link.ACTIVE and (standby or not p.standby)]
+
+    def yields(self, target):
+        """Whether the peer's own link to us should carry the traffic instead of ours"""
+        return self.bridge.destination.hash > target.hash and bool(self.inbound(target, standby=False))
+
+    def duplicated(self, node):
+        """The peer's hello names it as a configured peer: keep one active link between us"""
+        target = self.targets.get(node)
+        primary = target and target.primary
+        if primary is None or primary.standby or not self.yields(target):
+            return
+        primary.standby = True
+        self.bridge.hello(primary)
+        if target.standby:
+            # The peer holds its own standby behind its link
+            target.standby.link.teardown()
+        self.bridge.update_link_status()
+        self.bridge.add_event(f"LINK {target.name} also links to us ─ sending on its link")
+
+    def reclaim(self, node):
+        """The last link the peer opened to us closed: send on ours again"""
+        target = self.targets.get(node)
+        primary = target and target.primary
+        if primary is None or not primary.standby or self.inbound(target):
+            return
+        self.bridge.promote(primary)
+        self.bridge.add_event(f"LINK {target.name} link to us closed ─ sending on ours")
+
+    def down(self):
+        return sum(t.primary is None for t in self.targets.values())
+
+    async def run(self):
+        self.wake = asyncio.Event()
+        while True:
+            now = time.monotonic()
+            for target in self.targets.values():
+                if self.wanted(target) and target.next_attempt <= now:
+                    self.connect(target)
+            due = [t.next_attempt for t in self.targets.values() if self.wanted(t)]
+            try:
+                await asyncio.wait_for(self.wake.wait(), max(min(due, default=now + RECONNECT_MAX) - now, 0.05))
+            except asyncio.TimeoutError:
+                pass
+            self.wake.clear()
+
+    def stop(self):
+        for target in self.targets.values():
+            if target.pending is not None:
+                target.pending.teardown()
+                target.pending = None
+
+# ── Streaming TCP clients ──────────────────────────────────────────
+class TcpClient:
+    """One streaming CoT connection; writes never wait on a slow reader"""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        addr = writer.get_extra_info("peername")
+        self.name = f"{addr[0]}:{addr[1]}" if addr else "tcp"
+        self.framer = cot_codec.EventFramer(MAX_TCP_EVENT)
+        self.rx_events = 0
+        self.tx_events = 0
+        self.dropped = 0
+
+    def send(self, data):
+        """Queue data on the socket, or drop it if the client is this far behind"""
+        if self.writer.transport.get_write_buffer_size() > MAX_TCP_BUFFER:
+            self.dropped += 1
+            return False
+        self.writer.write(data)
+        self.tx_events += 1
+        return True
+
+# ── Send scheduler ─────────────────────────────────────────────────
+class TokenBucket:
+    def __init__(self, rate, burst):
+        if rate <= 0:
+            raise ValueError(f"send rate {rate}: must be above 0")
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = time.monotonic()
+
+    def delay(self, n):
+        """Seconds until n bytes may be sent"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        return 0 if self.tokens >= min(n, self.burst) else (min(n, self.burst) - self.tokens) / self.rate
+
+    def take(self, n):
+        self.tokens -= n
+
+class Batch:
+    """Small prepared events of one class waiting to share a packet
+
+    Whether another event fits is estimated from the compression ratios
+    measured so far. Only an aggregate close to the packet size is
+    compressed to make sure; otherwise it is compressed once, when it is
+    flushed. If an estimate was short it goes out in two packets.
+    """
+
+    def __init__(self, bridge):
+        self.bridge = bridge
+        self.payloads = []
+        self.sizes = []     # CoT bytes each payload represents
+        self.size = 0       # CoT bytes represented
+        self.raw = 1        # bytes of the aggregate block before compression
+        self.limit = 0      # packet size the aggregate has to fit
+        self.packed = None  # aggregate frame of self.payloads, if it had to be checked
+        self.codec = None   # codec of self.packed
+        self.peers = []     # codec sets of the peers it is for
+        self.zdict = None   # zdict version they share
+        self.since = 0
+        self.stamp = 0      # when the oldest event was received
+        self.stale = None   # when the last event goes stale, None if any has no stale time
+
+    def add(self, payload, size, stamp, stale, limit, peers, zdict=None):
+        """Add payload if the aggregate still fits in one packet of limit bytes"""
+        payloads = self.payloads + [payload]
+        raw = self.raw + cot_codec.varint_size(len(payload)) + len(payload)
+        guess = 1 + self.bridge.codec_selector.estimate(raw, peers, packed=True)
+        if guess > limit * (1 + AGGREGATE_SLACK):
+            return False
+        packed = codec = None
+        if guess > limit * (1 - AGGREGATE_SLACK):
+            # Too close to call
+            packed, codec = self.pack(payloads, raw, peers, zdict)
+            if len(packed) > limit:
+                return False
+        if not self.payloads:
+            self.since = time.monotonic()
+            self.stamp = stamp
+            self.stale = stale
+        elif self.stale is not None:
+            self.stale = None if stale is None else max(self.stale, stale)
+        self.payloads = payloads
+        self.sizes.append(size)
+        self.size += size
+        self.raw = raw
+        self.limit = limit
+        self.packed = packed
+        self.codec = codec
+        self.peers = peers
+        self.zdict = zdict
+        return True
+
+    def pack(self, payloads, raw, peers, zdict):
+        """(aggregate frame, codec) of payloads, raw bytes before compression"""
+        selector = self.bridge.codec_selector
+        codec = selector.choose(raw, peers)
+        start = time.perf_counter()
+        packed = cot_codec.pack_aggregate(payloads, codec, zdict)
+        selector.record(codec, raw, len(packed), time.perf_counter() - start, packed=True)
+        return packed, codec
+
+    def flush(self, label):
+        """Encoded messages for everything batched so far, usually one"""
+        messages = self.encode(label, self.payloads, self.sizes, self.raw, self.packed, self.codec)
+        self.payloads = []
+        self.sizes = []
+        self.size = 0
+        self.raw = 1
+        self.packed = None
+        return messages
+
+    def encode(self, label, payloads, sizes, raw, pkt=None, codec=None):
+        bridge = self.bridge
+        n, size = len(payloads), sum(sizes)
+        if n == 1:
+            pkt, codec = bridge.codec_selector.compress(payloads[0], self.peers, self.zdict)
+        elif pkt is None:
+            pkt, codec = self.pack(payloads, raw, self.peers, self.zdict)
+            if len(pkt) > self.limit:
+                # Compressed worse than estimated: two packets rather than fragments
+                half = n // 2
+                return (self.encode(label, payloads[:half], sizes[:half], self.block_size(payloads[:half]))
+                        + self.encode(label, payloads[half:], sizes[half:], self.block_size(payloads[half:])))
+        ratio = int((1 - len(pkt) / size) * 100)
+        bridge.m_ratio.observe(len(pkt) / size, type=label)
+        bridge.m_codec.inc(codec=codec)
+        if n > 1:
+            bridge.m_aggregated.inc(n, type=label)
+        bridge.add_event(f"▶ {label} x{n} {size}b ─▶ packed {codec} {len(pkt)}b (-{ratio}%) ─▶ RNS", "debug")
+        return [Encoded(pkt)]
+
+    @staticmethod
+    def block_size(payloads):
+        return 1 + sum(cot_codec.varint_size(len(p)) + len(p) for p in payloads)
+
+class SendScheduler:
+    """Sends queued events from the bridge's event loop, chat before SA, paced by a token bucket
+
+    Each event is encoded once and its packets are queued on every
+    active peer that wants it (see cot_aoi). Peers take turns, and within
+    a peer up to MAX_IN_FLIGHT messages per class are sent round-robin
+    one packet at a time, so fragments of different messages interleave
+    and a long chat never holds up the whole class behind it.
+    """
+
+    def __init__(self, bridge, rate, burst, hold):
+        self.bridge = bridge
+        self.queue = bridge.outbound
+        self.bucket = TokenBucket(rate, burst)
+        self.hold = hold
+        self.batches = {}   # (label, peers) -> Batch
+        self.held = {}      # label -> (item, peers) taken from the queue while those peers were full
+        self.sent = OrderedDict()   # msg_id -> (time sent, label, stale, message), for NACKs
+        self.wake = None    # asyncio.Event, made on the loop by run()
+        self.turn = 0
+
+    def notify(self):
+        """Wake the send loop; call from the bridge's event loop"""
+        if self.wake:
+            self.wake.set()
+
+    def in_flight(self):
+        return max((p.backlog() for p in self.bridge.active_peers()), default=0)
+
+    def refill(self, targets):
+        expired = 0     # CoT bytes dropped as stale
+        for label in PRIORITIES:
+            while min(len(p.queue[label]) for p in targets) < MAX_IN_FLIGHT:
+                if label in self.held:
+                    item, wanted = self.held.pop(label)
+                    wanted = [p for p in wanted if p in targets]
+                else:
+                    item = self.queue.get(label)
+                    if not item:
+                        break
+                    wanted = None
+                data, _, stamp, stale = item
+                if stale is not None and stale - STALE_MARGIN <= time.time():
+                    # ATAK would discard it on arrival
+                    expired += len(data)
+                    self.bridge.m_stale.inc(stage="queue")
+                    continue
+                if wanted is None:
+                    wanted = self.select(data, targets)
+                if not wanted:
+                    continue
+                if min(len(p.queue[label]) for p in wanted) >= MAX_IN_FLIGHT:
+                    # Only peers with no room want this one; keep it for the next pass
+                    self.held[label] = (item, wanted)
+                    break
+                try:
+                    self.encode(label, data, stamp, stale, wanted)
+                except Exception as e:
+                    self.bridge.add_event(f"ERR {e}", "error")
+            # Chat never waits for company; SA waits at most self.hold
+            now = time.monotonic()
+            for key, batch in list(self.batches.items()):
+                if key[0] != label:
+                    continue
+                if batch.payloads:
+                    if label != "CHAT" and now - batch.since < self.hold:
+                        continue
+                    for message in batch.flush(label):
+                        self.dispatch(key[1], label, batch.stamp, batch.stale, message)
+                del self.batches[key]
+        if expired:
+            # Not yet compressed: estimate the link bytes from the compression seen so far
+            self.saved(expired * self.mean_ratio() * len(targets))
+            self.bridge.add_event(f"▶ {expired}b of stale events dropped before sending", "debug")
+
+    def mean_ratio(self):
+        """Average encoded size / CoT size so far, 1 before anything is sent"""
+        n = total = 0
+        for h in self.bridge.m_ratio.merged().values():
+            n += sum(h[:-1])
+            total += h[-1]
+        return total / n if n else 1
+
+    def saved(self, link_bytes):
+        """Count the airtime not spent on link_bytes of stale events"""
+        self.bridge.m_stale_saved.inc(link_bytes / self.bucket.rate)
+
+    def select(self, data, targets):
+        """The targets whose area of interest data is for"""
+        bridge = self.bridge
+        wanted, entered = bridge.aoi.targets(data, targets)
+        if entered:
+            # Someone is about to see this contact for the first time: send it whole
+            uid = cot_codec.event_header(data).get(b"uid")
+            bridge.delta_encoder.resync(cot_codec.uid_key(uid))
+        if not wanted:
+            bridge.add_event(f"▶ {len(data)}b outside every peer's area ─ not sent", "debug")
+        return wanted
+
+    def encode(self, label, data, stamp, stale, peers):
+        """Prepare one event for peers, delta-coded and batched for those whose hello allows it"""
+        bridge = self.bridge
+        bridge.m_events.inc(direction="tx", type=label)
+        bridge.m_bytes.inc(len(data), direction="tx", layer="cot")
+        groups = {}
+        for p in peers:
+            groups.setdefault((DELTA_SA and "delta" in p.features, self.hold > 0 and "agg" in p.features), []).append(p)
+        prepared = {}
+        for (delta, agg), group in groups.items():
+            # The delta encoder runs once per event, whatever the number of groups
+            if delta not in prepared:
+                prepared[delta] = bridge.prepare_cot(data) if delta else (data, "")
+            self.encode_for(label, data, stamp, stale, group, *prepared[delta], agg)
+
+    def encode_for(self, label, data, stamp, stale, peers, payload, kind, agg):
+        bridge = self.bridge
+        codecs = [p.codecs for p in peers]
+        zdict = cot_codec.shared_zdict(p.zdicts for p in peers)
+        if not zdict:
+            codecs = [c - {"zdict"} for c in codecs]
+        if agg:
+            key = (label, tuple(peers))
+            batch = self.batches.get(key) or self.batches.setdefault(key, Batch(bridge))
+            limit = min(p.payload() for p in peers)
+            if batch.add(payload, len(data), stamp, stale, limit, codecs, zdict):
+                return
+            if batch.payloads:
+                for message in batch.flush(label):
+                    self.dispatch(peers, label, batch.stamp, batch.stale, message)
+                if batch.add(payload, len(data), stamp, stale, limit, codecs, zdict):
+                    return
+        self.dispatch(peers, label, stamp, stale, bridge.frame_cot(data, payload, kind, label, codecs, zdict))
+
+    def dispatch(self, targets, label, stamp, stale, message):
+        """Queue an Encoded message on every target, framed to each link's MDU"""
+        framed = {}
+        for peer in targets:
+            size = peer.payload()
+            key = (size, "resource" in peer.features)
+            if key not in framed:
+                packets = framed[key] = frame_for(message, *key)
+                if isinstance(packets, BulkPayload):
+                    self.bridge.add_event(f"▶ {label} {len(message)}b ─▶ resource (mdu {size})", "debug")
+                elif packets:
+                    self.bridge.m_frags.observe(len(packets), type=label)
+                    if len(packets) > 1:
+                        self.bridge.add_event(f"▶ {label} {len(message)}b ─▶ {len(packets)} frags (mdu {size})", "debug")
+            packets = framed[key]
+            if packets is None:
+                self.bridge.add_event(f"▶ {label} {len(message)}b too large for fragments to {peer.name}, which refuses resources", "warning")
+                continue
+            if isinstance(packets, BulkPayload):
+                peer.enqueue_bulk(packets)
+                continue
+            groups = self.bridge.fec_groups(peer, len(packets))
+            if groups:
+                if key + (groups,) not in framed:
+                    framed[key + (groups,)] = packets + cot_codec.parity(packets, groups)
+                packets = framed[key + (groups,)]
+                self.bridge.m_parity.inc(len(packets) - len(framed[key]))
+            peer.enqueue(label, packets, stamp, stale)
+        if label in self.bridge.nack_classes:
+            fragmented = [p for p in framed.values() if p and not isinstance(p, BulkPayload) and len(p) > 1]
+            # Every framing of a message shares its msg_id
+            if fragmented:
+                self.sent[fragmented[0][0][1:5]] = (time.monotonic(), label, stale, message)
+                if len(self.sent) > RETRANSMIT_CACHE:
+                    self.sent.popitem(last=False)
+
+    def retransmit(self, peer, msg_id, total, missing):
+        """Queue the fragments a peer asked for again, ahead of new messages of their class"""
+        bridge = self.bridge
+        missing = sorted({i for i in missing if i < total})
+        entry = self.sent.get(msg_id) if missing else None
+        if entry is not None:
+            sent, label, stale, message = entry
+            # Framed again for this link; the NACK's fragment count confirms it still splits the same way
+            packets = frame_for(message, peer.payload(), "resource" in peer.features)
+            if (time.monotonic() - sent < FRAGMENT_TIMEOUT and packets and len(packets) == total
+                    and not isinstance(packets, BulkPayload)
+                    and (stale is None or stale - STALE_MARGIN > time.time())):
+                resend = [packets[i] for i in missing]
+                peer.queue[label].appendleft((None, stale, deque(resend)))
+                bridge.m_nack.inc(event="answered")
+                bridge.m_retransmitted.inc(len(resend))
+                bridge.add_event(f"▶ {label} resending {len(resend)}/{total} frags to {peer.name}")
+                self.notify()
+                return
+        bridge.m_nack.inc(event="unanswered")
+        bridge.add_event(f"▶ NACK from {peer.name} for {msg_id.hex()} ─ no longer held", "debug")
+
+    def idle_timeout(self):
+        """How long the send loop may sleep before a held batch is due"""
+        due = [b.since + self.hold - time.monotonic() for b in self.batches.values() if b.payloads]
+        return max(0, min(due + [1]))
+
+    def start_bulk(self, targets):
+        """Hand the next large payload to RNS on every link with no Resource in progress"""
+        bridge = self.bridge
+        for peer in targets:
+            if peer.bulk and peer.link.ready_for_new_resource():
+                payload = peer.bulk.popleft()
+                # Charged as its parts go out, so chat and SA keep their share of the link meanwhile
+                peer.bulk_size, peer.bulk_charged = len(payload), 0
+                try:
+                    bridge.transport.Resource(payload, peer.link, auto_compress=False,
+                                              callback=bridge.threadsafe(bridge.bulk_concluded),
+                                              progress_callback=bridge.threadsafe(self.bulk_progress))
+                    bridge.m_bytes.inc(len(payload), direction="tx", layer="link")
+                except Exception as e:
+                    peer.bulk_failed += 1
+                    bridge.add_event(f"ERR {peer.name} resource {e}", "error")
+
+    def bulk_progress(self, resource, done=None):
+        """Take the part of a Resource sent since the last call from the token bucket"""
+        peer = self.bridge.peers.get(resource.link.link_id)
+        if not peer:
+            return
+        if done is None:
+            done = min(1.0, resource.get_progress())
+        sent = int(peer.bulk_size * done)
+        if sent > peer.bulk_charged:
+            # At most a burst at once, however coarse the progress reports
+            self.bucket.take(min(sent - peer.bulk_charged, self.bucket.burst))
+            peer.bulk_charged = sent
+
+    def next_packet(self, targets):
+        """(peer, label, packet, stamp); stamp is set on a message's last packet"""
+        now = time.time()
+        for label in PRIORITIES:
+            for _ in range(len(targets)):
+                self.turn = (self.turn + 1) % len(targets)
+                peer = targets[self.turn]
+                msgs = peer.queue[label]
+                # A message that went stale waiting for this peer isn't worth the rest of its packets
+                while msgs and msgs[0][1] is not None and msgs[0][1] - STALE_MARGIN <= now:
+                    self.saved(sum(len(p) for p in msgs.popleft()[2]))
+                    self.bridge.m_stale.inc(stage="link")
+                if msgs:
+                    entry = msgs.popleft()
+                    stamp, _, pkts = entry
+                    pkt = pkts.popleft()
+                    if pkts:
+                        msgs.append(entry)
+                        stamp = None
+                    return peer, label, pkt, stamp
+        return None, None, None, None
+
+    async def sleep(self, timeout):
+        """Wait until notify() or timeout"""
+        try:
+            await asyncio.wait_for(self.wake.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self.wake.clear()
+
+    async def run(self):
+        bridge = self.bridge
+        self.wake = asyncio.Event()
+        while True:
+            targets = bridge.active_peers()
+            if not targets:
+                await self.sleep(1)
+                continue
+            self.refill(targets)
+            self.start_bulk(targets)
+            peer, label, pkt, stamp = self.next_packet(targets)
+            if pkt is None:
+                await self.sleep(self.idle_timeout())
+                continue
+            # Always yield, so ingest runs between packets even with tokens to spare
+            await asyncio.sleep(self.bucket.delay(len(pkt)))
+            self.bucket.take(len(pkt))
+            try:
+                bridge.transport.Packet(peer.link, pkt).send()
+                peer.tx_packets += 1
+                peer.tx_bytes += len(pkt)
+                bridge.m_bytes.inc(len(pkt), direction="tx", layer="link")
+                if stamp is not None:
+                    bridge.m_latency.observe(time.monotonic() - stamp, type=label)
+            except Exception as e:
+                bridge.add_event(f"ERR {peer.name} {e}", "error")
+
+class Encoded(bytes):
+    """A compressed message, not yet split to fit a particular link"""
+
+class BulkPayload(bytes):
+    """Compressed message too large for fragments; sent as an RNS Resource"""
+
+def frame_for(message, size, bulk=True):
+    """Packets of at most size bytes for message, or a BulkPayload
+
+    Without bulk (a peer that refuses Resources) a large message goes as
+    up to MAX_FRAGMENTS_LEGACY fragments, or None if that isn't enough.
+    """
+    if len(message) <= size:
+        return [bytes(message)]
+    step = size - cot_codec.PARITY_HEADER
+    if bulk and len(message) > MAX_FRAGMENTS * step:
+        return BulkPayload(message)
+    if len(message) > MAX_FRAGMENTS_LEGACY * step:
+        return None
+    return cot_codec.fragment(message, hashlib.md5(message).digest()[:4], size)
 
 def ts():
     return time.strftime("%H:%M:%S")
 
-def add_event(msg):
-    with lock:
-        event_log.append(f"  {ts()}  {msg}")
-        if len(event_log) > MAX_LOG_LINES:
-            event_log.pop(0)
+# ── Headless output ────────────────────────────────────────────────
+LEVELS = {"debug": 10, "info": 20, "warning": 30, "error": 40}
+
+class EventSink:
+    """Rate-limited event output for running without the dashboard
+
+    Events at or above the level are buffered and written by a
+    background thread every LOG_FLUSH seconds, as JSON lines on stdout
+    or to syslog. Past LOG_RATE/LOG_BURST, events are counted and
+    reported as one warning instead of written.
+    """
+
+    def __init__(self, mode, level, rate=LOG_RATE, burst=LOG_BURST):
+        self.mode = mode
+        self.threshold = LEVELS[level]
+        self.bucket = TokenBucket(rate, burst)
+        self.lock = threading.Lock()
+        self.pending = []
+        self.suppressed = 0
+        if mode == "syslog":
+            import syslog
+            self.syslog = syslog
+            self.priority = {"debug": syslog.LOG_DEBUG, "info": syslog.LOG_INFO,
+                             "warning": syslog.LOG_WARNING, "error": syslog.LOG_ERR}
+            syslog.openlog("cot_bridge", syslog.LOG_PID, syslog.LOG_DAEMON)
+
+    def emit(self, level, msg):
+        if LEVELS[level] < self.threshold:
+            return
+        with self.lock:
+            if self.bucket.delay(1):
+                self.suppressed += 1
+                return
+            self.bucket.take(1)
+            self.pending.append((time.time(), level, msg))
+
+    def flush(self):
+        with self.lock:
+            events, self.pending = self.pending, []
+            suppressed, self.suppressed = self.suppressed, 0
+        if suppressed:
+            events.append((time.time(), "warning", f"{suppressed} events suppressed by rate limit"))
+        if not events:
+            return
+        if self.mode == "syslog":
+            for _, level, msg in events:
+                self.syslog.syslog(self.priority[level], msg)
+            return
+        sys.stdout.write("".join(
+            json.dumps({"ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(t)) + f".{int(t % 1 * 1000):03d}Z",
+                        "host": hostname, "level": level, "msg": msg}) + "\n"
+            for t, level, msg in events))
+        sys.stdout.flush()
+
+    def run(self):
+        while True:
+            time.sleep(LOG_FLUSH)
+            self.flush()
+
+def counter_total(counter, direction, layer=None):
+    return sum(v for k, v in counter.merged().items() if k[0] == direction and layer in (None, k[1]))
+
+# ── Bridge engine ──────────────────────────────────────────────────
+class CotBridge:
+    """One ATAK multicast group pair bridged to Reticulum peers
+
+    Nothing touches the network until start(), which must be awaited on
+    a running asyncio loop. Ingest, send scheduling and housekeeping run
+    as tasks on that loop, and Reticulum callbacks are handed over to it,
+    so bridge state is only changed from the loop thread. Several
+    bridges can share one loop if each has its own identity and groups.
+
+    transport is the RNS module or a stand-in with the same Identity,
+    Destination, Link, Packet, Resource and Transport names.
+    socket_factory(group, port) returns a non-blocking datagram socket
+    joined to the group; the bridge reads from it and sends to the group
+    on it. Reticulum itself (RNS.Reticulum()) is set up by the caller,
+    once per process.
+    """
+
+    def __init__(self, peers=(), rate=SEND_RATE, burst=SEND_BURST, hold=AGGREGATE_HOLD, codec=COMPRESSION,
+                 sa_group=(COT_SA_MULTICAST, COT_SA_PORT), chat_group=(COT_CHAT_MULTICAST, COT_CHAT_PORT),
+                 routes=ROUTES, tcp_port=TCP_PORT, tcp_addr=TCP_ADDR, aoi=AOI, nack=NACK_CLASSES,
+                 fec=FEC, standby=STANDBY, identity_file=IDENTITY_FILE, transport=RNS, socket_factory=make_mcast_socket, sink=None):
+        self.peer_hashes = [bytes.fromhex(h) if isinstance(h, str) else h for h in peers]
+        self.sa_group = sa_group
+        self.chat_group = chat_group
+        self.groups = {"sa": sa_group, "chat": chat_group}
+        self.routes = RouteTable(routes)
+        self.tcp_port = tcp_port
+        self.tcp_addr = tcp_addr
+        self.area = cot_aoi.parse_area(aoi) if isinstance(aoi, str) else aoi
+        self.aoi = cot_aoi.AoiIndex()   # what each peer has asked for
+        self.nack_classes = tuple(nack)
+        self.fec = fec
+        self.identity_file = identity_file
+        self.transport = transport
+        self.socket_factory = socket_factory
+        self.sink = sink
+        self.loop = None
+        self.tasks = []
+        self.done = None
+        self.destination = None
+        self.sa_socket = None
+        self.chat_socket = None
+        self.tcp_server = None
+        self.tcp_clients = set()
+        self.tcp_dropped = 0        # from clients that have disconnected
+
+        self.link_status = "Waiting for peer..."
+        self.event_log = deque(maxlen=MAX_LOG_LINES)
+        self.start_time = time.time()
+        self.outbound = OutboundQueue()
+        self.seen = SeenCache()
+        self.fragments = cot_codec.FragmentStore(FRAGMENT_TIMEOUT, MAX_PARTIAL, MAX_PARTIAL_BYTES,
+                                                  MAX_FRAGMENTS_RX)
+        self.delta_encoder = cot_codec.DeltaEncoder()
+        self.codec_selector = cot_codec.CodecSelector(
+            CODEC_CANDIDATES if codec == "auto" else [codec], rate, CODEC_CPU_WEIGHT)
+        self.peers = {}             # link_id -> Peer
+        self.peers_lock = threading.Lock()  # for readers on other threads (metrics, dashboard)
+        self.init_metrics()
+        self.scheduler = SendScheduler(self, rate, burst, hold)
+        self.supervisor = LinkSupervisor(self, self.peer_hashes, standby)
+
+    # ── Events and metrics ──
+    def add_event(self, msg, level="info"):
+        if self.sink:
+            self.sink.emit(level, msg)
+        else:
+            self.event_log.append(f"  {ts()}  {msg}")
+
+    def init_metrics(self):
+        metrics = self.metrics = cot_metrics.Registry("cot_bridge_")
+        self.m_events = metrics.counter("events_total", "CoT events bridged", ("direction", "type"))
+        self.m_bytes = metrics.counter("bytes_total", "Bytes bridged, as CoT XML or on the Reticulum link",
+                                       ("direction", "layer"))
+        self.m_ratio = metrics.histogram("compression_ratio", "Encoded size / CoT size per outbound message",
+                                         (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.8, 1.0), ("type",))
+        self.m_frags = metrics.histogram("packets_per_message", "Link packets per outbound message, per link MDU",
+                                         (1, 2, 3, 4), ("type",))
+        self.m_aggregated = metrics.counter("aggregated_events_total", "Events sent packed with others in one packet",
+                                            ("type",))
+        self.m_unpack_failed = metrics.counter("aggregated_failed_total", "Events in a received aggregate that could "
+                                               "not be delivered")
+        self.m_codec = metrics.counter("codec_messages_total", "Outbound messages by compression codec", ("codec",))
+        self.m_published = metrics.counter("multicast_published_total", "Events published to local multicast",
+                                           ("group",))
+        self.m_unpublished = metrics.counter("multicast_failed_total", "Events that could not be sent to local multicast",
+                                             ("group", "reason"))
+        self.m_tcp = metrics.counter("tcp_events_total", "Events on streaming TCP connections", ("direction",))
+        self.m_stale = metrics.counter("stale_dropped_total", "Messages dropped unsent because their CoT stale time "
+                                       "had passed, before encoding or waiting for a link", ("stage",))
+        self.m_stale_saved = metrics.counter("stale_airtime_saved_seconds_total",
+                                             "Link airtime not spent on stale messages, at the send rate")
+        self.m_nack = metrics.counter("nack_total", "Requests for lost fragments", ("event",))
+        self.m_retransmitted = metrics.counter("retransmitted_packets_total", "Fragments sent again after a NACK")
+        self.m_parity = metrics.counter("parity_packets_total", "Parity packets sent with fragmented messages")
+        self.m_link_attempts = metrics.counter("link_attempts_total", "Outbound links tried to configured peers",
+                                               ("result",))
+        self.m_recovery = metrics.histogram("link_recovery_seconds", "Time from losing a peer's link to a new one "
+                                            "carrying traffic", (0.5, 1, 2, 5, 10, 30, 60, 120, 300), ("how",))
+        self.m_latency = metrics.histogram("send_latency_seconds", "Multicast receive to last link packet sent, per peer",
+                                           (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30), ("type",))
+
+        def peer_stats(attr):
+            return {(p.name, d): getattr(p, f"{d}_{attr}") for p in self.active_peers() for d in ("tx", "rx")}
+
+        outbound, fragments, seen = self.outbound, self.fragments, self.seen
+        metrics.gauge("queue_depth", "Events waiting to be sent",
+                      lambda: {("pending",): len(outbound), ("in_flight",): self.scheduler.in_flight()}, ("stage",))
+        metrics.gauge("queue_dropped_total", "Outbound events dropped before sending",
+                      lambda: {("superseded",): outbound.superseded, ("overflow",): outbound.dropped},
+                      ("reason",), "counter")
+        metrics.gauge("reassembly_partial", "Fragmented messages waiting for more fragments", lambda: len(fragments))
+        metrics.gauge("reassembly_dropped_total", "Fragments or incomplete messages discarded",
+                      lambda: {("timeout",): fragments.expired, ("evicted",): fragments.evicted,
+                               ("duplicate",): fragments.duplicates, ("bad",): fragments.out_of_range},
+                      ("reason",), "counter")
+        metrics.gauge("reassembly_repaired_total", "Fragmented messages completed after asking for lost fragments",
+                      lambda: fragments.repaired, kind="counter")
+        metrics.gauge("reassembly_recovered_total", "Lost fragments rebuilt from parity",
+                      lambda: fragments.recovered, kind="counter")
+        metrics.gauge("peer_fragment_loss", "Fragment loss each peer last reported on our packets",
+                      lambda: {(p.name,): p.loss for p in self.active_peers()}, ("peer",))
+        metrics.gauge("duplicates_dropped_total", "Replayed or looped messages suppressed",
+                      lambda: {("in",): seen.ingest_dropped, ("out",): seen.egress_dropped}, ("direction",), "counter")
+        metrics.gauge("aoi_suppressed_total", "Events not sent to a peer because they are outside its area of interest",
+                      lambda: self.aoi.suppressed, kind="counter")
+        metrics.gauge("tcp_clients", "Streaming TCP clients connected", lambda: len(self.tcp_clients))
+        metrics.gauge("tcp_dropped_total", "Events not sent to a TCP client that was too far behind",
+                      lambda: self.tcp_dropped + sum(c.dropped for c in list(self.tcp_clients)), kind="counter")
+        metrics.gauge("peers_linked", "Active Reticulum links to other bridges", lambda: len(self.active_peers()))
+        metrics.gauge("standby_links", "Idle links held open for failover", lambda: len(self.standby_peers()))
+        metrics.gauge("peers_unreachable", "Configured peers with no link", lambda: self.supervisor.down())
+        metrics.gauge("peer_payload_bytes", "Largest packet each link carries (its MDU)",
+                      lambda: {(p.name,): p.payload() for p in self.active_peers()}, ("peer",))
+        metrics.gauge("peer_packets_total", "Link packets per peer", lambda: peer_stats("packets"),
+                      ("peer", "direction"), "counter")
+        metrics.gauge("peer_bytes_total", "Link bytes per peer", lambda: peer_stats("bytes"),
+                      ("peer", "direction"), "counter")
+        metrics.gauge("uptime_seconds", "Seconds since the bridge started", lambda: int(time.time() - self.start_time))
+
+    # ── Lifecycle ──
+    async def start(self):
+        """Open the multicast sockets and the Reticulum destination, and start the loop tasks"""
+        T = self.transport
+        self.loop = asyncio.get_running_loop()
+        self.done = asyncio.Event()
+        self.start_time = time.time()
+
+        if os.path.exists(self.identity_file):
+            identity = T.Identity.from_file(self.identity_file)
+        else:
+            identity = T.Identity()
+            identity.to_file(self.identity_file)
+        self.destination = T.Destination(identity, T.Destination.IN, T.Destination.SINGLE, APP_NAME, ASPECT)
+
+        self.sa_socket = self.socket_factory(*self.sa_group)
+        self.chat_socket = self.socket_factory(*self.chat_group)
+        # Wake only when a socket is readable (epoll on Linux)
+        self.loop.add_reader(self.sa_socket, self.drain, self.sa_socket, "CoT")
+        self.loop.add_reader(self.chat_socket, self.drain, self.chat_socket, "CHAT")
+
+        if self.tcp_port:
+            try:
+                self.tcp_server = await asyncio.start_server(self.tcp_session, self.tcp_addr, self.tcp_port)
+                self.add_event(f"TCP streaming CoT on {self.tcp_addr}:{self.tcp_port}")
+            except OSError as e:
+                self.add_event(f"ERR TCP port {self.tcp_port}: {e}", "error")
+
+        self.tasks = []
+        for job in (self.scheduler.run, self.housekeeping, self.repair):
+            self.spawn(job)
+        self.destination.set_link_established_callback(self.inbound_link)
+        self.destination.announce()
+        if self.peer_hashes:
+            n = len(self.peer_hashes)
+            self.link_status = f"Connecting to {n} peer{'s' if n != 1 else ''}..."
+            self.add_event(f"LINK resolving {', '.join(h.hex()[:16] for h in self.peer_hashes)}...")
+            T.Transport.register_announce_handler(self.supervisor)
+            self.spawn(self.supervisor.run)
+
+        self.add_event("Bridge started ─ listening for ATAK traffic")
+        if self.sink:
+            self.sink.emit("info", f"Node Hash {self.destination.hash.hex()}")
+
+    async def stop(self):
+        """Stop the loop tasks, close links and sockets, and release the destination"""
+        if self.done is None or self.done.is_set() and not self.tasks:
+            return
+        self.done.set()
+        tasks, self.tasks = self.tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.supervisor.stop()
+        for sock in (self.sa_socket, self.chat_socket):
+            if sock is not None:
+                self.loop.remove_reader(sock)
+                sock.close()
+        if self.tcp_server:
+            self.tcp_server.close()
+            for client in list(self.tcp_clients):
+                client.writer.close()
+            await self.tcp_server.wait_closed()
+            self.tcp_server = None
+        with self.peers_lock:
+            links = [p.link for p in self.peers.values()]
+            self.peers.clear()
+        for link in links:
+            try:
+                link.teardown()
+            except Exception:
+                pass
+        try:
+            self.transport.Transport.deregister_destination(self.destination)
+            if self.peer_hashes:
+                self.transport.Transport.deregister_announce_handler(self.supervisor)
+        except Exception:
+            pass
+        self.update_link_status()
+        self.add_event("Bridge stopped")
+
+    async def run(self):
+        """Start, then serve until stop() is called or the task is cancelled"""
+        await self.start()
+        try:
+            await self.done.wait()
+        finally:
+            await self.stop()
+
+    def spawn(self, job):
+        """Run the coroutine function job as a loop task, restarted a second after any error"""
+        task = asyncio.ensure_future(job())
+        self.tasks.append(task)
+
+        def finished(task):
+            if task in self.tasks:
+                self.tasks.remove(task)
+            if task.cancelled() or self.done.is_set():
+                return
+            self.add_event(f"ERR {job.__qualname__} stopped: {task.exception()!r} ─ restarting", "error")
+            self.loop.call_later(1, lambda: self.done.is_set() or self.spawn(job))
+        task.add_done_callback(finished)
+
+    def threadsafe(self, fn):
+        """Wrap an RNS callback so it runs on the bridge's event loop"""
+        def call(*args):
+            try:
+                self.loop.call_soon_threadsafe(fn, *args)
+            except RuntimeError:
+                pass    # loop already closed
+        return call
+
+    async def housekeeping(self):
+        while True:
+            await asyncio.sleep(HOUSEKEEPING_INTERVAL)
+            if self.fragments.expire():
+                self.add_event(f"◀ dropped incomplete message ({self.fragments.expired} total)", "warning")
+            # Tell each peer how many of its fragments go missing, so it can size its parity
+            for peer, loss in self.fragments.loss_reports(MIN_LOSS_SAMPLE):
+                if "fec" in peer.features and peer.link.status == self.transport.Link.ACTIVE:
+                    try:
+                        self.transport.Packet(peer.link, cot_codec.loss_report(loss)).send()
+                    except Exception as e:
+                        self.add_event(f"ERR {peer.name} loss report {e}", "error")
+
+    async def repair(self):
+        """Ask peers for the fragments of messages that stopped arriving"""
+        while True:
+            await asyncio.sleep(NACK_DELAY / 2)
+            for msg_id, peer, total, missing in self.fragments.gaps(NACK_DELAY, NACK_RETRIES):
+                if peer is None or "nack" not in peer.features or peer.link.status != self.transport.Link.ACTIVE:
+                    continue
+                try:
+                    self.transport.Packet(peer.link, cot_codec.nack(msg_id, total, missing)).send()
+                    self.m_nack.inc(event="sent")
+                    self.add_event(f"◀ missing {len(missing)}/{total} frags of {msg_id.hex()} ─ NACK to {peer.name}",
+                                   "debug")
+                except Exception as e:
+                    self.add_event(f"ERR {peer.name} nack {e}", "error")
+
+    def fec_groups(self, peer, fragments):
+        """Parity packets to send with a message of this many fragments to peer"""
+        if fragments < 2 or "fec" not in peer.features or self.fec == "off":
+            return 0
+        if self.fec == "auto":
+            return cot_codec.parity_groups(fragments, peer.loss, FEC_TARGET, FEC_MAX_GROUPS)
+        return int(self.fec)
+
+    # ── Peers ──
+    def active_peers(self):
+        with self.peers_lock:
+            return [p for p in self.peers.values() if p.link.status == self.transport.Link.ACTIVE and not p.standby]
+
+    def standby_peers(self):
+        with self.peers_lock:
+            return [p for p in self.peers.values() if p.link.status == self.transport.Link.ACTIVE and p.standby]
+
+    def update_link_status(self):
+        n = len(self.active_peers())
+        self.link_status = f"{n} peer{'s' if n != 1 else ''} linked" if n else "Waiting for peer..."
+
+    def add_peer(self, link, name, direction, standby=False):
+        link.set_packet_callback(self.threadsafe(self.link_packet_callback))
+        link.set_link_closed_callback(self.threadsafe(self.link_closed))
+        link.set_resource_strategy(self.transport.Link.ACCEPT_APP)
+        link.set_resource_callback(self.accept_resource)
+        link.set_resource_concluded_callback(self.resource_received)
+        peer = Peer(link, name, direction)
+        # An inbound link stays idle until its hello says whether it is someone's standby
+        peer.standby = standby or direction == "in"
+        with self.peers_lock:
+            self.peers[link.link_id] = peer
+        if not peer.standby:
+            # The new peer holds none of our delta keyframes
+            self.delta_encoder.reset()
+        self.hello(peer)
+        self.update_link_status()
+        self.add_event(f"LINK {direction}bound {'standby ' if standby else ''}link {name} established")
+        self.scheduler.notify()
+        return peer
+
+    def promote(self, peer):
+        """Start sending on a standby link, and tell the peer to do the same"""
+        self.activate(peer)
+        self.hello(peer)
+
+    def activate(self, peer):
+        """Start sending on a link that was idle"""
+        peer.standby = False
+        self.delta_encoder.reset()
+        self.update_link_status()
+        self.scheduler.notify()
+
+    def hello(self, peer):
+        """Send peer our hello, and again every HELLO_INTERVAL until it confirms it
+
+        Until a hello has come back from the peer it may be an older
+        bridge, which would publish ours to multicast, so only the first
+        is sent; its own hello, or its reply to ours, starts the resends.
+        """
+        peer.hello_acked = False
+        peer.hello_round += 1
+        self.send_hello(peer)
+        self.loop.call_later(HELLO_INTERVAL, self.resend_hello, peer, peer.hello_round, HELLO_RETRIES)
+
+    def resend_hello(self, peer, round, tries):
+        if peer.hello_acked or round != peer.hello_round or self.peers.get(peer.link.link_id) is not peer:
+            return
+        if not tries:
+            if peer.hello_seen is None:
+                self.add_event(f"◀ {peer.name} sent no hello ─ treating it as an older bridge", "warning")
+                if peer.standby and peer.direction == "in":
+                    self.activate(peer)
+            return
+        if peer.hello_seen is not None:
+            self.send_hello(peer)
+        self.loop.call_later(HELLO_INTERVAL, self.resend_hello, peer, round, tries - 1)
+
+    def send_hello(self, peer, reply=False):
+        """One hello packet: round=N numbers ours, seen=N confirms the peer's, and a reply isn't answered"""
+        tokens = list(cot_codec.CODECS) + list(FEATURES) + ([f"aoi={self.area}"] if self.area else [])
+        if cot_codec.ZDICTS:
+            tokens.append(f"zdict={','.join(str(v) for v in sorted(cot_codec.ZDICTS))}")
+        if peer.standby and peer.direction == "out":
+            tokens.append("role=standby")
+        tokens.append(f"node={self.destination.hash.hex()}")
+        tokens.append(f"round={peer.hello_round}")
+        if peer.hello_seen is not None:
+            tokens.append(f"seen={peer.hello_seen}")
+        if reply:
+            tokens.append("reply")
+        try:
+            self.transport.Packet(peer.link, cot_codec.hello(tokens)).send()
+        except Exception as e:
+            self.add_event(f"ERR {peer.name} hello {e}", "error")
+
+    def link_closed(self, link):
+        with self.peers_lock:
+            peer = self.peers.pop(link.link_id, None)
+        if peer:
+            self.aoi.remove(peer)
+            self.fragments.loss.pop(peer, None)
+            self.update_link_status()
+            self.add_event(f"LINK {peer.name} {'standby ' if peer.standby else ''}closed")
+        self.supervisor.closed(link)
+        if peer and peer.direction == "in" and peer.node:
+            self.supervisor.reclaim(peer.node)
+
+    def inbound_link(self, link):
+        # Called on the RNS thread. The link is handed to the loop before its packet
+        # callback is set, so the peer's first packets can't overtake add_peer()
+        self.threadsafe(self.link_established)(link)
+        link.set_packet_callback(self.threadsafe(self.link_packet_callback))
+
+    def link_established(self, link):
+        self.add_peer(link, f"in:{link.link_id.hex()[:6]}", "in")
+
+    # ── ATAK to Reticulum ──
+    def drain(self, sock, label):
+        """Read every datagram queued on a readable socket into the outbound queue"""
+        for _ in range(MAX_DRAIN):
+            try:
+                data, addr = sock.recvfrom(65535)
+            except BlockingIOError:
+                break
+            except Exception as e:
+                self.add_event(f"ERR {e}", "error")
+                break
+            if self.seen.seen(data):
+                self.seen.ingest_dropped += 1
+                continue
+            self.outbound.put(data, label)
+            # Streaming clients can't hear the multicast groups
+            self.publish(data, ())
+        self.scheduler.notify()
+
+    async def tcp_session(self, reader, writer):
+        """Read streaming CoT from one client until it disconnects"""
+        client = TcpClient(reader, writer)
+        if len(self.tcp_clients) >= MAX_TCP_CLIENTS:
+            self.add_event(f"TCP {client.name} refused ─ {MAX_TCP_CLIENTS} clients connected", "warning")
+            writer.close()
+            return
+        self.tcp_clients.add(client)
+        self.add_event(f"TCP {client.name} connected")
+        try:
+            while True:
+                chunk = await reader.read(65536)
+                if not chunk:
+                    break
+                for data in client.framer.feed(chunk):
+                    self.tcp_ingest(data, client)
+                self.scheduler.notify()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            self.tcp_clients.discard(client)
+            self.tcp_dropped += client.dropped
+            writer.close()
+            self.add_event(f"TCP {client.name} disconnected ({client.rx_events} in, {client.tx_events} out)")
+
+    def tcp_ingest(self, data, client):
+        """Queue one event from a TCP client for the mesh and share it locally"""
+        client.rx_events += 1
+        self.m_tcp.inc(direction="rx")
+        cot_type, label, groups = self.routes.classify(data)
+        if cot_type == TCP_PING:
+            return
+        if self.seen.seen(data):
+            self.seen.ingest_dropped += 1
+            return
+        self.outbound.put(data, label)
+        self.publish(data, groups, exclude=client)
+
+    def publish(self, data, groups, exclude=None):
+        """Send CoT to local ATAK: the given multicast groups and every TCP client but exclude"""
+        for group in groups:
+            if len(data) > MAX_DATAGRAM:
+                # Only a TCP client can take it
+                self.m_unpublished.inc(group=group, reason="too_big")
+                continue
+            sock = self.chat_socket if group == "chat" else self.sa_socket
+            try:
+                sock.sendto(data, self.groups[group])
+                self.m_published.inc(group=group)
+            except OSError as e:
+                self.m_unpublished.inc(group=group, reason="error")
+                self.add_event(f"ERR multicast {group} {len(data)}b: {e}", "error")
+        for client in self.tcp_clients:
+            if client is not exclude and client.send(data):
+                self.m_tcp.inc(direction="tx")
+
+    def prepare_cot(self, data):
+        """Delta-code one event; returns (payload, "delta" or "" for the log)"""
+        payload = self.delta_encoder.encode(data)
+        if payload is None:
+            return data, ""
+        return payload, "delta" if payload[1] == cot_codec.DELTA else ""
+
+    def frame_cot(self, data, payload, kind, label, peers, zdict=None):
+        """Compress one prepared event with a codec every peer reads; dispatch() splits it per link"""
+        compressed, codec = self.codec_selector.compress(payload, peers, zdict)
+        ratio = int((1 - len(compressed) / len(data)) * 100)
+        self.m_ratio.observe(len(compressed) / len(data), type=label)
+        self.m_codec.inc(codec=codec)
+        self.add_event(f"▶ {label} {len(data)}b ─▶ {kind + '+' if kind else ''}{codec} {len(compressed)}b (-{ratio}%) ─▶ RNS",
+                       "debug")
+        return Encoded(compressed)
+
+    # ── Reticulum to ATAK ──
+    def decode_payload(self, payload, peer):
+        """Decompress a link payload and expand delta-coded beacons to CoT XML"""
+        payload = cot_codec.decompress(payload)
+        if payload[:1] == cot_codec.DELTA_TAG:
+            try:
+                payload = peer.decoder.decode(payload)
+            except cot_codec.ResyncNeeded as e:
+                self.transport.Packet(peer.link, cot_codec.RESYNC_TAG + e.key).send()
+                self.add_event(f"◀ delta {e.key.hex()} missing keyframe ─ resync")
+                return None
+        return payload
+
+    def deliver(self, payload, peer, how):
+        """Decode a complete link payload and publish it to local ATAK"""
+        data = self.decode_payload(payload, peer)
+        if not data:
+            return
+        _, label, groups = self.routes.classify(data)
+        if self.seen.seen(data):
+            self.seen.egress_dropped += 1
+            self.add_event(f"◀ {label} {len(data)}b duplicate ─ dropped", "debug")
+            return
+        self.m_events.inc(direction="rx", type=label)
+        self.m_bytes.inc(len(data), direction="rx", layer="cot")
+        self.add_event(f"◀ {label} {len(data)}b {how} ─▶ ATAK {'+'.join(groups) or 'tcp'}", "debug")
+        self.publish(data, groups)
+
+    def handle_payload(self, payload, peer, how):
+        """Deliver a complete link payload, unpacking aggregates"""
+        if payload[:1] == cot_codec.AGGREGATE_TAG:
+            for p in cot_codec.unpack_aggregate(payload):
+                # One bad event (a stale delta reference, say) must not lose the rest
+                try:
+                    self.deliver(p, peer, "unpacked")
+                except Exception as e:
+                    self.m_unpack_failed.inc()
+                    self.add_event(f"◀ ERR unpacked event from {peer.name}: {e}", "error")
+        else:
+            self.deliver(payload, peer, how)
+
+    def link_packet_callback(self, message, packet):
+        peer = self.peers.get(packet.link.link_id)
+        if not peer:
+            return
+        peer.rx_packets += 1
+        peer.rx_bytes += len(message)
+        self.m_bytes.inc(len(message), direction="rx", layer="link")
+        try:
+            if message[0:1] == cot_codec.RESYNC_TAG and len(message) == 5:
+                self.delta_encoder.resync(message[1:5])
+                self.add_event(f"◀ resync request for {message[1:5].hex()}")
+            elif message[0:1] == cot_codec.HELLO_TAG:
+                self.peer_hello(peer, cot_codec.parse_hello(message))
+            elif message[0:1] == cot_codec.NACK_TAG and len(message) > 6:
+                self.m_nack.inc(event="received")
+                self.scheduler.retransmit(peer, *cot_codec.parse_nack(message))
+            elif message[0:1] == cot_codec.PARITY_TAG and len(message) > cot_codec.PARITY_HEADER:
+                full = self.fragments.add_parity(*cot_codec.parse_parity(message), source=peer)
+                if full:
+                    self.handle_payload(full, peer, "rebuilt")
+            elif message[0:1] == cot_codec.LOSS_TAG and len(message) == 3:
+                loss = cot_codec.parse_loss_report(message)
+                peer.loss += 0.5 * (loss - peer.loss)
+                self.add_event(f"◀ {peer.name} lost {loss:.1%} of our fragments", "debug")
+            elif message[0:1] == cot_codec.FRAGMENT_TAG and len(message) > 6:
+                msg_id, seq, total, data = cot_codec.parse_fragment(message)
+                self.add_event(f"◀ frag {seq+1}/{total} ({len(data)}b)", "debug")
+                full = self.fragments.add(msg_id, seq, total, data, source=peer)
+                if full:
+                    self.handle_payload(full, peer, "reassembled")
+            else:
+                self.handle_payload(message, peer, "via Reticulum")
+        except Exception as e:
+            self.add_event(f"◀ ERR {e}", "error")
+
+    def peer_hello(self, peer, tokens):
+        """Take a peer's codecs, protocol features and area of interest from its hello"""
+        first = peer.hello_seen is None
+        values = dict(t.split("=", 1) for t in tokens if "=" in t)
+        round = values.get("round", "")
+        if round.isdigit() and (peer.hello_seen or "").isdigit() and int(round) < int(peer.hello_seen):
+            return      # overtaken by a newer hello
+        peer.hello_seen = round
+        if values.get("seen") == str(peer.hello_round):
+            peer.hello_acked = True
+        if "reply" not in tokens:
+            # Tells the peer its hello arrived, so it stops resending
+            self.send_hello(peer, reply=True)
+        area = values.get("aoi")
+        peer.features = tokens & set(FEATURES)
+        if peer.direction == "in" and peer.standby != (values.get("role") == "standby"):
+            # The other end opened this link; it decides whether traffic uses it
+            if peer.standby:
+                self.activate(peer)
+            else:
+                peer.standby = True
+        try:
+            peer.node = bytes.fromhex(values.get("node", "")) or None
+        except ValueError:
+            peer.node = None
+        if peer.direction == "in" and peer.node:
+            self.supervisor.duplicated(peer.node)
+        peer.codecs = {t for t in tokens if "=" not in t} - peer.features - {"reply"}
+        versions = {int(v) for v in values.get("zdict", "").split(",") if v.isdigit()}
+        peer.zdicts = versions or set(cot_codec.LEGACY_ZDICTS)
+        try:
+            self.aoi.set_policy(peer, cot_aoi.parse_area(area) if area else None)
+        except ValueError as e:
+            self.add_event(f"◀ {peer.name} {e} ─ sending everything", "warning")
+            area = None
+        self.supervisor.notify()
+        if not first:
+            return
+        self.add_event(f"◀ {peer.name} codecs {' '.join(sorted(peer.codecs))}"
+                       + (f", {' '.join(sorted(peer.features))}" if peer.features else "") + (f", area {area}" if area else ""))
+
+    def accept_resource(self, advertisement):
+        # Called on the RNS thread; only reads the advertisement
+        return advertisement.get_data_size() <= MAX_BULK_SIZE
+
+    def resource_received(self, resource):
+        # Called on the RNS thread: the data is closed once this returns, so read it here
+        payload = error = None
+        if resource.status == self.transport.Resource.COMPLETE:
+            try:
+                payload = resource.data.read()
+            except Exception as e:
+                error = e
+        self.threadsafe(self.resource_concluded)(resource.link.link_id, payload, error)
+
+    def resource_concluded(self, link_id, payload, error=None):
+        peer = self.peers.get(link_id)
+        if not peer:
+            return
+        if payload is None:
+            self.add_event(f"◀ ERR resource from {peer.name} {error or 'failed'}", "warning")
+            return
+        try:
+            peer.rx_packets += 1
+            peer.rx_bytes += len(payload)
+            self.m_bytes.inc(len(payload), direction="rx", layer="link")
+            self.handle_payload(payload, peer, "via resource")
+        except Exception as e:
+            self.add_event(f"◀ ERR {e}", "error")
+
+    def bulk_concluded(self, resource):
+        peer = self.peers.get(resource.link.link_id)
+        if peer:
+            if resource.status == self.transport.Resource.COMPLETE:
+                self.scheduler.bulk_progress(resource, 1.0)
+                peer.bulk_sent += 1
+            else:
+                peer.bulk_failed += 1
+                self.add_event(f"▶ ERR resource to {peer.name} failed", "warning")
+        self.scheduler.notify()
 
 # ── Display thread ─────────────────────────────────────────────────
 W = 62  # inner content width (between | and |)
@@ -167,31 +1787,49 @@ def row(text=""):
 def sep(ch="="):
     return "  +" + ch * (W + 2) + "+"
 
-def display_loop():
+def display_loop(bridge, radio):
     sys.stdout.write("\033[?25l\033[2J")
     sys.stdout.flush()
     while True:
         time.sleep(DISPLAY_INTERVAL)
-        halow = get_halow_info()
-        freq = halow.get('frequency', 'N/A')
-        chan = halow.get('channel', '?')
-        sig = halow.get('signal', 'N/A')
-        rate = halow.get('bitrate', 'N/A')
-        enc = halow.get('encryption', 'N/A')
-        mesh = halow.get('mesh_id', 'N/A')
-        mode = halow.get('mode', 'N/A')
-        uptime = int(time.time() - start_time)
+        halow = radio.sample()
+        freq = halow.frequency or 'N/A'
+        chan = halow.channel or '?'
+        sig = halow.signal or 'N/A'
+        rate = halow.bitrate or 'N/A'
+        enc = halow.encryption or 'N/A'
+        mesh = halow.mesh_id or 'N/A'
+        mode = halow.mode or 'N/A'
+        uptime = int(time.time() - bridge.start_time)
         m, s = divmod(uptime, 60)
         h, m = divmod(m, 60)
         up_str = f"{h}h {m}m {s}s" if h else f"{m}m {s}s"
 
-        with lock:
-            ltx = tx_packets
-            lrx = rx_packets
-            ltxb = tx_bytes
-            lrxb = rx_bytes
-            lstatus = link_status
-            logs = list(event_log)
+        outbound, fragments, seen = bridge.outbound, bridge.fragments, bridge.seen
+        ltx = counter_total(bridge.m_events, "tx")
+        lrx = counter_total(bridge.m_events, "rx")
+        ltxb = counter_total(bridge.m_bytes, "tx", "cot")
+        lrxb = counter_total(bridge.m_bytes, "rx", "cot")
+        lstatus = bridge.link_status
+        logs = list(bridge.event_log)
+        lpend = len(outbound) + bridge.scheduler.in_flight()
+        lsup = outbound.superseded
+        ldrop = outbound.dropped
+        lstale = f"{int(sum(bridge.m_stale.merged().values())):<6} drop   {sum(bridge.m_stale_saved.merged().values()):.1f} s airtime saved"
+        lpart = len(fragments)
+        lfrag = f"{fragments.duplicates} dup  {fragments.out_of_range} bad  {fragments.expired + fragments.evicted} lost"
+        nacks = bridge.m_nack.merged()
+        lrepair = (f"{nacks.get(('sent',), 0):<6} nack   {fragments.repaired} repaired  "
+                   f"{int(sum(bridge.m_retransmitted.merged().values()))} resent")
+        lfec = f"{int(sum(bridge.m_parity.merged().values())):<6} sent   {fragments.recovered} rebuilt"
+        lpeers = bridge.active_peers()
+        recoveries = bridge.m_recovery.merged()
+        lup = f"{len(bridge.supervisor.targets) - bridge.supervisor.down()}/{len(bridge.supervisor.targets)}"
+        llinks = f"{lup:<6} up     {len(bridge.standby_peers())} standby  {sum(sum(h[:-1]) for h in recoveries.values())} recovered"
+        lseen = f"{len(seen):<6} seen   {seen.ingest_dropped} in  {seen.egress_dropped} out dropped"
+        laoi = f"{len(bridge.aoi.policies):<6} peers  {bridge.aoi.suppressed} suppressed"
+        lhash = bridge.destination.hash.hex() if bridge.destination else "..."
+        ltcp = f"{len(bridge.tcp_clients)} on port {bridge.tcp_port}" if bridge.tcp_server else "off"
 
         txkb = f"{ltxb/1024:.1f} KB" if ltxb >= 1024 else f"{ltxb} B"
         rxkb = f"{lrxb/1024:.1f} KB" if lrxb >= 1024 else f"{lrxb} B"
@@ -202,8 +1840,9 @@ def display_loop():
             sep("="),
             row(),
             row(f"Reticulum      RNS {RNS.__version__}"),
-            row(f"Node Hash      {destination.hash.hex()}"),
+            row(f"Node Hash      {lhash}"),
             row(f"Link Status    {lstatus}"),
+            row(f"TCP Clients    {ltcp}"),
             row(f"Uptime         {up_str}"),
             row(),
             sep("-"),
@@ -220,9 +1859,23 @@ def display_loop():
             row(),
             row(f"TX (ATAK > Reticulum)   {ltx:<6} pkts   {txkb}"),
             row(f"RX (Reticulum > ATAK)   {lrx:<6} pkts   {rxkb}"),
+            row(f"Queue                   {lpend:<6} pend   {lsup} superseded  {ldrop} dropped"),
+            row(f"Stale                   {lstale}"),
+            row(f"Reassembly              {lpart:<6} part   {lfrag}"),
+            row(f"Repair                  {lrepair}"),
+            row(f"Parity                  {lfec}"),
+            row(f"Duplicates              {lseen}"),
+            row(f"Area Filter             {laoi}"),
+            row(f"Links                   {llinks}"),
             row(),
             sep("-"),
         ]
+        for p in lpeers[:MAX_PEER_ROWS]:
+            lines.append(row(f"{p.direction:<3} {p.name:<9} mdu {p.payload():<4} tx {p.tx_packets:<6} rx {p.rx_packets:<6} q {p.backlog():<3} drop {p.dropped}"))
+        if len(lpeers) > MAX_PEER_ROWS:
+            lines.append(row(f"    ... {len(lpeers) - MAX_PEER_ROWS} more peers"))
+        if lpeers:
+            lines.append(sep("-"))
         for line in logs:
             lines.append(row(line.strip()))
         for _ in range(MAX_LOG_LINES - len(logs)):
@@ -231,155 +1884,1712 @@ def display_loop():
         lines.append("  Ctrl+C to exit")
 
         # Cursor home, draw all lines, clear everything below
-        buf = "\033[H"
-        for line in lines:
-            buf += line + "\033[K\n"
-        buf += "\033[J"  # clear from cursor to end of screen
-        sys.stdout.write(buf)
+        sys.stdout.write("\033[H" + "\033[K\n".join(lines) + "\033[K\n\033[J")
         sys.stdout.flush()
 
-display_thread = threading.Thread(target=display_loop, daemon=True)
-display_thread.start()
-
-# ── Reticulum callbacks ────────────────────────────────────────────
-def reassemble(msg_id, seq, total, data):
-    global fragment_buffer
-    key = msg_id.hex()
-    if key not in fragment_buffer:
-        fragment_buffer[key] = {'frags': {}, 'total': total, 'time': time.time()}
-    fragment_buffer[key]['frags'][seq] = data
-    if len(fragment_buffer[key]['frags']) == total:
-        full = b''.join(fragment_buffer[key]['frags'][i] for i in range(total))
-        del fragment_buffer[key]
-        return full
-    return None
+# ── Main ───────────────────────────────────────────────────────────
+def main():
+    args = parser.parse_args()
+    if args.codec != "auto":
+        try:
+            cot_codec.parse_codec(args.codec)
+        except ValueError as e:
+            parser.error(str(e))
+    if args.aoi:
+        try:
+            cot_aoi.parse_area(args.aoi)
+        except ValueError as e:
+            parser.error(str(e))
+    if args.log is None:
+        args.log = "tui" if sys.stdout.isatty() else "jsonl"
 
-def detect_type(data):
-    """Detect if decompressed CoT XML is a chat message or SA beacon"""
-    try:
-        sample = data[:512] if len(data) > 512 else data
-        if b"GeoChat" in sample or b"__chat" in sample:
-            return "CHAT"
-    except:
-        pass
-    return "CoT"
+    RNS.Reticulum()
+
+    sink = None
+    if args.log != "tui":
+        sink = EventSink(args.log, args.log_level)
+        threading.Thread(target=sink.run, daemon=True).start()
+
+    bridge = CotBridge(args.peers, rate=args.rate, burst=args.burst, hold=args.hold, codec=args.codec,
+                       routes=args.route + list(ROUTES), tcp_port=args.tcp_port, tcp_addr=args.tcp_addr,
+                       aoi=args.aoi, nack=args.nack, fec=args.fec, standby=args.standby, sink=sink)
+
+    if args.metrics_port:
+        try:
+            cot_metrics.serve(bridge.metrics, args.metrics_addr, args.metrics_port)
+            bridge.add_event(f"Metrics at http://{args.metrics_addr}:{args.metrics_port}/metrics")
+        except OSError as e:
+            bridge.add_event(f"ERR metrics port {args.metrics_port}: {e}", "error")
+
+    if args.log == "tui":
+        radio = halow_telemetry.HalowTelemetry()
+        threading.Thread(target=display_loop, args=(bridge, radio), daemon=True).start()
 
-def link_packet_callback(message, packet):
-    global rx_packets, rx_bytes
     try:
-        if message[0:1] == b'F' and len(message) > 6:
-            msg_id, seq, total = message[1:5], message[5], message[6]
-            data = message[7:]
-            add_event(f"◀ frag {seq+1}/{total} ({len(data)}b)")
-            full = reassemble(msg_id, seq, total, data)
-            if full:
-                if full[:2] in (b"\x78\x9c", b"\x78\x01", b"\x78\xda"):
-                    full = zlib.decompress(full)
-                label = detect_type(full)
-                with lock:
-                    rx_packets += 1
-                    rx_bytes += len(full)
-                add_event(f"◀ {label} reassembled {len(full)}b ─▶ ATAK")
-                sa_socket.sendto(full, (COT_SA_MULTICAST, COT_SA_PORT))
-                chat_socket.sendto(full, (COT_CHAT_MULTICAST, COT_CHAT_PORT))
+        asyncio.run(bridge.run())
+    except KeyboardInterrupt:
+        if sink:
+            bridge.add_event("Shutting down")
+            sink.flush()
         else:
-            if message[:2] in (b"\x78\x9c", b"\x78\x01", b"\x78\xda"):
-                message = zlib.decompress(message)
-            label = detect_type(message)
-            with lock:
-                rx_packets += 1
-                rx_bytes += len(message)
-            add_event(f"◀ {label} {len(message)}b via Reticulum ─▶ ATAK")
-            sa_socket.sendto(message, (COT_SA_MULTICAST, COT_SA_PORT))
-            chat_socket.sendto(message, (COT_CHAT_MULTICAST, COT_CHAT_PORT))
-    except Exception as e:
-        add_event(f"◀ ERR {e}")
-
-def link_established(link):
-    global active_link, link_status
-    active_link = link
-    link.set_packet_callback(link_packet_callback)
-    with lock:
-        link_status = "Reticulum link active"
-    add_event("LINK inbound link established")
-
-destination.set_link_established_callback(link_established)
-destination.announce()
-
-if len(sys.argv) > 1:
-    remote_hash = bytes.fromhex(sys.argv[1])
-    with lock:
-        link_status = f"Connecting to {sys.argv[1][:16]}..."
-    add_event(f"LINK resolving peer {sys.argv[1][:16]}...")
-    if not RNS.Transport.has_path(remote_hash):
-        RNS.Transport.request_path(remote_hash)
-        for _ in range(10):
-            time.sleep(1)
-            if RNS.Transport.has_path(remote_hash):
-                break
-    remote_identity = RNS.Identity.recall(remote_hash)
-    if remote_identity:
-        remote_dest = RNS.Destination(remote_identity, RNS.Destination.OUT, RNS.Destination.SINGLE, APP_NAME, ASPECT)
-        outbound_link = RNS.Link(remote_dest)
-        outbound_link.set_packet_callback(link_packet_callback)
-        def on_outbound_ready(link):
-            global link_status
-            with lock:
-                link_status = "Reticulum link active"
-            add_event("LINK outbound link ready ─ bridge active")
-        outbound_link.set_link_established_callback(on_outbound_ready)
-    else:
-        with lock:
-            link_status = "Could not resolve peer"
-        add_event("LINK peer identity not found")
-
-add_event("Bridge started ─ listening for ATAK traffic")
-
-# ── Main loop ──────────────────────────────────────────────────────
-def send_cot(data, label):
-    global tx_packets, tx_bytes, outbound_link, active_link
-    link = outbound_link if (outbound_link and outbound_link.status == RNS.Link.ACTIVE) else active_link
-    if not link or link.status != RNS.Link.ACTIVE:
-        return
-
-    compressed = zlib.compress(data, 9)
-    ratio = int((1 - len(compressed) / len(data)) * 100)
-    with lock:
-        tx_packets += 1
-        tx_bytes += len(data)
-
-    if len(compressed) <= MAX_PAYLOAD:
-        RNS.Packet(link, compressed).send()
-        add_event(f"▶ {label} {len(data)}b ─▶ zlib {len(compressed)}b (-{ratio}%) ─▶ RNS")
+            sys.stdout.write("\033[?25h")  # restore cursor
+            print("\n  Shutting down...")
+
+if __name__ == "__main__":
+    main()
+BRIDGE
+chmod +x /root/cot_bridge.py
+
+cat > /root/cot_codec.py << 'CODEC'
+"""CoT wire codec — compression framing shared by the bridge and its tools
+
+Payload formats on a Reticulum link (first bytes decide):
+    78 01 / 78 9c / 78 da   zlib stream (original bridge format)
+    Z + version + deflate   raw deflate against preset dictionary <version>
+    C + codec id + body     any other registered codec (see CODECS)
+    H + version + tokens    capability hello, sent when a link comes up
+    A + compressed block    several events packed into one packet
+    F + id + seq + total    one fragment of a larger payload
+    N + id + total + seqs   request to resend the listed fragments of a message
+    P + id + group + ...    XOR parity over a group of fragments (see parity())
+    L + loss                fragment loss the receiver measured, in 1/10000
+    B                       delta-coded SA beacon (see DeltaEncoder)
+    R + key                 resync request for a delta-coded UID
+    <                       uncompressed CoT XML
+"""
+import calendar
+import hashlib
+import random
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+ZLIB_MAGIC = (b"\x78\x9c", b"\x78\x01", b"\x78\xda")
+ZDICT_TAG = b"Z"
+
+# Preset dictionaries, keyed by the version byte sent on the wire. Never
+# change or remove an entry that has shipped: peers running older builds
+# still send it. Regenerate with `python3 cot_dict.py --install`.
+# ── BEGIN ZDICTS (generated by cot_dict.py) ────────────────────────
+ZDICTS = {
+    1: (
+        b'" type="u-d-f" time="" type="b-m-r" time="" type="a-h-G" time=""'
+        b' type="b-m-p-w" time="" type="b-a-o-tbl" time="" type="b-m-p-s-m'
+        b'" time="</emergency></detail></event>"/><emergency type="911 Ale'
+        b'rt">" version="5.1.0.1"/></marti></detail></event>" how="h-e"><p'
+        b'oint lat="</remarks><marti><dest callsign="" production_time="</'
+        b'remarks></detail></event>"><chatgrp uid0="" senderCallsign="" ty'
+        b'pe="b-t-f" time=""/></__chat><link uid="</remarks><archive/><lab'
+        b'els_on value="true"/><precisionlocation altsrc="???"/></detail><'
+        b'/event>" name="Blue"/><status battery="" name="Cyan"/><status ba'
+        b'ttery="" type="a-f-G-U-C" parent_callsign=""/><strokeColor value'
+        b'="-16776961"/><strokeWeight value="4.0"/><fillColor value="16777'
+        b'21855"/><contact callsign=""/><remarks/><archive/><usericon icon'
+        b'setpath="COT_MAPPING_SPOTMAP/b-m-p-s-m/-65536"/><color argb="-65'
+        b'536"/><precisionlocation altsrc="DTED0"/></detail></event>"/><tr'
+        b'ack course="" ce="3.2" le="9999999.0"/><detail><takv os="34" ver'
+        b'sion="5.2.0.5 (4e1c7b2a).1712345678-CIV" device="SAMSUNG SM-8U" '
+        b'platform="ATAK-CIV"/><contact endpoint=""/></detail></event>" ty'
+        b'pe="a-f-G-U-C" relation="p-p"/><remarks source="" how="h-g-i-g-o'
+        b'"><point lat="" ce="9999999.0" le="9999999.0"/><detail><status r'
+        b'eadiness="true"/><archive/><link uid="" how="m-g"><point lat="" '
+        b'type="a-f-G-U-C" time="" remarks="" relation="c"/><link_attr pla'
+        b'nningmethod="Infil" color="-1" method="Walking" prefix="CP" type'
+        b'="On Foot" stroke="3" direction="Infil" routetype="Primary" orde'
+        b'r="Ascending Check Points"/><strokeColor value="-1"/><strokeWeig'
+        b'ht value="3.0"/><__routeinfo><__navcues/></__routeinfo><contact '
+        b'callsign=""/><link point="" type="b-m-p-w" point="" ce="9999999.'
+        b'0" le="9999999.0"/><detail><__chat parent="RootContactGroup" gro'
+        b'upOwner="false" messageId=""/><precisionlocation altsrc="GPS" ge'
+        b'opointsrc="GPS"/><__group role="Team Member" name="" remarks="" '
+        b'relation="c"/><link uid="<?xml version="1.0" encoding="UTF-8" st'
+        b'andalone="yes"?><event version="2.0" uid="'
+    ),
+}
+# ── END ZDICTS ─────────────────────────────────────────────────────
+ZDICT_VERSION = max(ZDICTS) if ZDICTS else 0
+
+
+def deflate(data, zdict=None, level=9):
+    """Raw deflate (no zlib header or checksum), primed with zdict if given"""
+    if zdict:
+        c = zlib.compressobj(level, zlib.DEFLATED, -15, 9, zlib.Z_DEFAULT_STRATEGY, zdict)
     else:
-        msg_id = hashlib.md5(data).digest()[:4]
-        frag_size = MAX_PAYLOAD - 7
-        chunks = [compressed[i:i+frag_size] for i in range(0, len(compressed), frag_size)]
-        total = len(chunks)
-        for seq, chunk in enumerate(chunks):
-            pkt = b'F' + msg_id + bytes([seq, total]) + chunk
-            RNS.Packet(link, pkt).send()
-            time.sleep(0.02)
-        add_event(f"▶ {label} {len(data)}b ─▶ zlib {len(compressed)}b (-{ratio}%) ─▶ {total} frags ─▶ RNS")
+        c = zlib.compressobj(level, zlib.DEFLATED, -15, 9)
+    return c.compress(data) + c.flush()
+
+
+def inflate(data, zdict=None):
+    d = zlib.decompressobj(-15, zdict) if zdict else zlib.decompressobj(-15)
+    return d.decompress(data) + d.flush()
+
+
+# ── Codec registry ─────────────────────────────────────────────────
+# zlib and zdict keep their original framing so older bridges can read
+# them. Every other codec is sent as C + codec id + body; a bridge only
+# uses those towards peers that listed the codec in their hello.
+CODEC_TAG = b"C"
+HELLO_TAG = b"H"
+HELLO_VERSION = 1
+LEGACY_CODECS = ("zlib",)           # assumed for a peer that never sends a hello, e.g. the original bridge
+LEGACY_ZDICTS = (1,)                # dictionary versions assumed for a peer whose hello lists none
+
+
+class Codec:
+    """One compression format: encode(data, level) and decode(body)"""
+
+    def __init__(self, name, wire_id, encode, decode, level, levels=range(1, 10)):
+        self.name = name
+        self.wire_id = wire_id      # None: self-identifying legacy format
+        self.encode = encode
+        self.decode = decode
+        self.level = level          # default
+        self.levels = levels
+
+
+CODECS = {}     # name -> Codec, only those usable on this node
+_BY_ID = {}
+
+
+def register(codec):
+    CODECS[codec.name] = codec
+    if codec.wire_id is not None:
+        _BY_ID[codec.wire_id] = codec
+
+
+def parse_codec(spec):
+    """(Codec, level) for a spec such as "zlib:6"; ValueError if unknown here"""
+    name, _, level = spec.partition(":")
+    codec = CODECS.get(name)
+    if codec is None:
+        raise ValueError(f"codec {name!r} not available (have {', '.join(CODECS)})")
+    level = int(level) if level else codec.level
+    if level not in codec.levels:
+        raise ValueError(f"{name} level must be {codec.levels[0]}..{codec.levels[-1]}")
+    return codec, level
+
+
+def _zdict_encode(data, level, version=None):
+    version = version or ZDICT_VERSION
+    return ZDICT_TAG + bytes([version]) + deflate(data, ZDICTS[version], level)
+
+
+def shared_zdict(peers):
+    """Newest dictionary version we and every peer (sets of versions) have, 0 if none"""
+    common = set(ZDICTS)
+    for versions in peers:
+        common &= versions
+    return max(common, default=0)
+
+
+if ZDICT_VERSION:
+    register(Codec("zdict", None, _zdict_encode, None, 9))
+register(Codec("zlib", None, zlib.compress, zlib.decompress, 9))
+register(Codec("deflate", 1, lambda d, l: deflate(d, None, l), inflate, 6))
+
+try:
+    import lzma     # a separate package on OpenWrt (python3-lzma)
+    # Raw LZMA2 with a fixed dictionary so the decoder needs no header
+    _LZMA_DICT = 1 << 20
+
+    register(Codec(
+        "lzma", 2,
+        lambda d, l: lzma.compress(d, lzma.FORMAT_RAW, filters=[
+            {"id": lzma.FILTER_LZMA2, "preset": l, "dict_size": _LZMA_DICT}]),
+        lambda b: lzma.decompress(b, lzma.FORMAT_RAW, filters=[
+            {"id": lzma.FILTER_LZMA2, "dict_size": _LZMA_DICT}]),
+        6, range(0, 10)))
+except ImportError:
+    pass
 
 try:
+    import zstandard
+    register(Codec(
+        "zstd", 3,
+        lambda d, l: zstandard.ZstdCompressor(level=l, write_checksum=False).compress(d),
+        lambda b: zstandard.ZstdDecompressor().decompress(b),
+        3, range(1, 20)))
+except ImportError:
+    pass
+
+try:
+    import brotli
+    register(Codec("brotli", 4, lambda d, l: brotli.compress(d, quality=l), brotli.decompress, 5, range(0, 12)))
+except ImportError:
+    pass
+
+
+def compress(data, mode="zdict", zdict=None):
+    """Compress CoT XML for the link; falls back to raw if it doesn't shrink
+
+    mode is a codec name with an optional level, e.g. "zdict" or "zlib:6".
+    zdict is the dictionary version for "zdict", by default the newest.
+    """
+    codec, level = parse_codec(mode)
+    out = _zdict_encode(data, level, zdict) if codec.name == "zdict" else codec.encode(data, level)
+    if codec.wire_id is not None:
+        out = CODEC_TAG + bytes([codec.wire_id]) + out
+    return out if len(out) < len(data) else data
+
+
+def decompress(payload):
+    """Undo compress() for any format a peer may send"""
+    if payload[:1] == ZDICT_TAG:
+        version = payload[1]
+        if version not in ZDICTS:
+            raise ValueError(f"unknown zdict version {version}")
+        return inflate(payload[2:], ZDICTS[version])
+    if payload[:1] == CODEC_TAG:
+        codec = _BY_ID.get(payload[1])
+        if codec is None:
+            raise ValueError(f"unknown codec id {payload[1]}")
+        return codec.decode(payload[2:])
+    if payload[:2] in ZLIB_MAGIC:
+        return zlib.decompress(payload)
+    return payload
+
+
+# ── Capability hello ───────────────────────────────────────────────
+# H + version + space-separated tokens, sent when a link comes up and
+# again until the peer confirms it (see cot_bridge.CotBridge.hello).
+# Unknown tokens are ignored, so later features can be advertised the
+# same way.
+def hello(tokens):
+    return HELLO_TAG + bytes([HELLO_VERSION]) + " ".join(tokens).encode()
+
+
+def parse_hello(packet):
+    """Token set from a hello packet"""
+    return set(packet[2:].decode("ascii", "replace").split())
+
+
+# ── Codec selection ────────────────────────────────────────────────
+class CodecSelector:
+    """Pick the cheapest codec per message from measured cost
+
+    Cost is in seconds: the bytes sent at `rate` bytes/s plus the CPU time
+    spent compressing, times cpu_weight. Ratio and CPU time per byte are
+    kept as moving averages per codec and size class. Every `explore`
+    messages the least recently measured candidate is tried instead, so
+    the averages follow the traffic.
+    """
+
+    SIZE_CLASSES = (256, 1024, 4096)
+    ALPHA = 0.2
+
+    def __init__(self, candidates, rate, cpu_weight=1.0, explore=32):
+        self.candidates = []
+        for spec in candidates:
+            try:
+                parse_codec(spec)
+            except ValueError:
+                continue            # not installed here
+            self.candidates.append(spec)
+        self.rate = rate
+        self.cpu_weight = cpu_weight
+        self.explore = explore
+        self.stats = {}         # (spec, size class) -> [ratio, seconds per byte, last used]
+        self.packed = {}        # (spec, size class) -> ratio of aggregates, which compress better than one event
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def size_class(self, size):
+        for i, bound in enumerate(self.SIZE_CLASSES):
+            if size <= bound:
+                return i
+        return len(self.SIZE_CLASSES)
+
+    def usable(self, peers):
+        """Candidates every peer in `peers` (sets of codec names) can decode"""
+        out = [c for c in self.candidates if all(c.partition(":")[0] in p for p in peers)]
+        if out:
+            return out
+        # Someone only speaks the original format
+        return ["zdict"] if all("zdict" in p for p in peers) and "zdict" in CODECS else ["zlib"]
+
+    def choose(self, size, peers):
+        usable = self.usable(peers)
+        if len(usable) == 1:
+            return usable[0]
+        cls = self.size_class(size)
+        with self.lock:
+            self.count += 1
+            unmeasured = [c for c in usable if (c, cls) not in self.stats]
+            if unmeasured:
+                return unmeasured[0]
+            if self.count % self.explore == 0:
+                return min(usable, key=lambda c: self.stats[c, cls][2])
+            return min(usable, key=lambda c: self.cost(c, cls, size))
+
+    def cost(self, spec, cls, size):
+        ratio, per_byte, _ = self.stats[spec, cls]
+        return size * ratio / self.rate + size * per_byte * self.cpu_weight
+
+    def record(self, spec, size, out, seconds, packed=False):
+        """Feed back one measured compression of size bytes into out bytes; packed for an aggregate"""
+        if not size:
+            return
+        key = spec, self.size_class(size)
+        with self.lock:
+            if packed:
+                ratio = self.packed.get(key, out / size)
+                self.packed[key] = ratio + self.ALPHA * (out / size - ratio)
+            s = self.stats.get(key)
+            if s is None:
+                self.stats[key] = [out / size, seconds / size, self.count]
+                return
+            s[0] += self.ALPHA * (out / size - s[0])
+            s[1] += self.ALPHA * (seconds / size - s[1])
+            s[2] = self.count
+
+    def estimate(self, size, peers, packed=False):
+        """Expected compressed size of size bytes for peers, from the nearest size class measured"""
+        usable = self.usable(peers)
+        cls = self.size_class(size)
+        with self.lock:
+            for near in sorted(range(len(self.SIZE_CLASSES) + 1), key=lambda c: abs(c - cls)):
+                measured = [c for c in usable if (c, near) in self.stats]
+                if measured:
+                    spec = min(measured, key=lambda c: self.cost(c, near, size))
+                    ratio = self.packed.get((spec, near), self.stats[spec, near][0]) if packed else self.stats[spec, near][0]
+                    return int(size * ratio) + 1
+        return size
+
+    def compress(self, data, peers, zdict=None):
+        """(compressed, codec spec) for data sent to peers; zdict as for compress()"""
+        spec = self.choose(len(data), peers)
+        start = time.perf_counter()
+        out = compress(data, spec, zdict)
+        self.record(spec, len(data), len(out), time.perf_counter() - start)
+        return out, spec
+
+
+# ── Varints ────────────────────────────────────────────────────────
+def put_varint(out, n):
+    while n > 0x7f:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def varint_size(n):
+    return max(1, (n.bit_length() + 6) // 7)
+
+
+def get_varint(buf, pos):
+    n = shift = 0
     while True:
-        for sock, label in [(sa_socket, "CoT"), (chat_socket, "CHAT")]:
+        if shift > 63:
+            raise ValueError("varint too long")
+        b = buf[pos]
+        pos += 1
+        n |= (b & 0x7f) << shift
+        if b < 0x80:
+            return n, pos
+        shift += 7
+
+
+def zigzag(n):
+    return n * 2 if n >= 0 else -n * 2 - 1
+
+
+def unzigzag(n):
+    return n >> 1 if not n & 1 else -(n >> 1) - 1
+
+
+# ── Delta codec for SA beacons ─────────────────────────────────────
+#
+# A beacon is split into a template (the XML with every numeric or
+# timestamp attribute value cut out) and the list of cut values. The
+# first beacon for a UID is sent as a keyframe carrying both; after that
+# only the values that differ from the keyframe are sent, as small
+# integer deltas. Deltas are relative to the keyframe, not to the
+# previous beacon, so a lost delta never corrupts the ones after it.
+#
+#   B + 0 + key(4) + gen(1) + template_len + template + slots + values
+#   B + 1 + key(4) + gen(1) + changed-slot bitmap + values
+#
+# A receiver that has no keyframe for key/gen answers with
+#   R + key(4)
+# and the sender starts over with a keyframe.
+DELTA_TAG = b"B"
+RESYNC_TAG = b"R"
+KEYFRAME = 0
+DELTA = 1
+
+_VALUE_RE = re.compile(rb'=(["\'])([-\d.:TZ]+)\1')
+_EVENT_RE = re.compile(rb'<event\s[^>]*>')
+_ATTR_RE = re.compile(rb'\s([\w:-]+)=(["\'])(.*?)\2')
+_NUM_RE = re.compile(rb'-?\d{1,18}(?:\.\d{1,18})?')
+_TIME_RE = re.compile(rb'(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)(?:\.(\d{1,9}))?Z')
+
+# Value tags
+NUM = 1         # scale, zigzag mantissa
+NUM_DELTA = 2   # zigzag mantissa change from keyframe
+TIME = 3        # fraction digits, zigzag units
+TIME_DELTA = 4  # zigzag units change from keyframe
+TIME_SAME = 5   # same change as the previous TIME_DELTA in this frame
+
+
+class ResyncNeeded(Exception):
+    """A delta referenced a keyframe this receiver doesn't hold"""
+    def __init__(self, key):
+        super().__init__(f"no keyframe for {key.hex()}")
+        self.key = key
+
+
+def _format_num(scale, mant):
+    if not scale:
+        return str(mant).encode()
+    sign = "-" if mant < 0 else ""
+    digits = str(abs(mant)).rjust(scale + 1, "0")
+    return f"{sign}{digits[:-scale]}.{digits[-scale:]}".encode()
+
+
+def _format_time(frac, units):
+    secs, sub = divmod(units, 10 ** frac)
+    out = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(secs))
+    if frac:
+        out += "." + str(sub).rjust(frac, "0")
+    return (out + "Z").encode()
+
+
+def _tokenize(value):
+    """Integer form of a numeric or timestamp attribute, if it round-trips"""
+    m = _TIME_RE.fullmatch(value)
+    if m:
+        frac = len(m.group(7) or b"")
+        secs = calendar.timegm(tuple(int(g) for g in m.groups()[:6]))
+        tok = (TIME, frac, secs * 10 ** frac + int(m.group(7) or 0))
+    elif _NUM_RE.fullmatch(value):
+        scale = len(value) - value.index(b".") - 1 if b"." in value else 0
+        tok = (NUM, scale, int(value.replace(b".", b"")))
+    else:
+        return None
+    return tok if _render(tok) == value else None
+
+
+def _render(tok):
+    return _format_time(tok[1], tok[2]) if tok[0] == TIME else _format_num(tok[1], tok[2])
+
+
+def parse_time(value):
+    """Seconds since the epoch for a CoT timestamp like b"2025-03-14T18:22:07.047Z", or None"""
+    m = _TIME_RE.fullmatch(value or b"")
+    if not m:
+        return None
+    secs = calendar.timegm(tuple(int(g) for g in m.groups()[:6]))
+    return secs + (int(m.group(7)) / 10 ** len(m.group(7)) if m.group(7) else 0)
+
+
+def event_header(xml):
+    """Attributes of the <event> start tag, e.g. {b"uid": ..., b"type": ...}"""
+    head = _EVENT_RE.search(xml, 0, 2048)
+    if not head:
+        return {}
+    return {m.group(1): m.group(3) for m in _ATTR_RE.finditer(head.group(0))}
+
+
+def split_event(xml):
+    """Split CoT XML into (uid, type, template, slot offsets, value tokens)"""
+    attrs = event_header(xml)
+    if b"uid" not in attrs:
+        return None
+    template, offsets, tokens, last = bytearray(), [], [], 0
+    for m in _VALUE_RE.finditer(xml):
+        tok = _tokenize(m.group(2))
+        if tok is None:
+            continue
+        template += xml[last:m.start(2)]
+        offsets.append(len(template))
+        tokens.append(tok)
+        last = m.end(2)
+    template += xml[last:]
+    return attrs[b"uid"], attrs.get(b"type", b""), bytes(template), offsets, tokens
+
+
+def join_event(template, offsets, tokens):
+    out, last = bytearray(), 0
+    for off, tok in zip(offsets, tokens):
+        out += template[last:off]
+        out += _render(tok)
+        last = off
+    out += template[last:]
+    return bytes(out)
+
+
+def uid_key(uid):
+    return hashlib.blake2s(uid, digest_size=4).digest()
+
+
+def _put_value(out, tok, ref=None, prev_dt=None):
+    """Write one value; returns the time delta used, if any"""
+    if ref is not None and ref[0] == tok[0] and ref[1] == tok[1]:
+        diff = tok[2] - ref[2]
+        if tok[0] == NUM:
+            out.append(NUM_DELTA)
+            put_varint(out, zigzag(diff))
+            return None
+        if diff == prev_dt:
+            out.append(TIME_SAME)
+        else:
+            out.append(TIME_DELTA)
+            put_varint(out, zigzag(diff))
+        return diff
+    out.append(tok[0])
+    out.append(tok[1])
+    put_varint(out, zigzag(tok[2]))
+    return None
+
+
+def _get_value(buf, pos, ref=None, prev_dt=None):
+    tag = buf[pos]
+    pos += 1
+    if tag in (NUM, TIME):
+        scale = buf[pos]
+        n, pos = get_varint(buf, pos + 1)
+        return (tag, scale, unzigzag(n)), pos, None
+    if ref is None:
+        raise ValueError("delta value without keyframe value")
+    if tag == TIME_SAME:
+        if prev_dt is None:
+            raise ValueError("TIME_SAME without a previous time delta")
+        return (ref[0], ref[1], ref[2] + prev_dt), pos, prev_dt
+    if tag in (NUM_DELTA, TIME_DELTA):
+        n, pos = get_varint(buf, pos)
+        diff = unzigzag(n)
+        return (ref[0], ref[1], ref[2] + diff), pos, (diff if tag == TIME_DELTA else None)
+    raise ValueError(f"bad value tag {tag}")
+
+
+class DeltaEncoder:
+    """Sender side: keyframe state per UID, deltas against it"""
+
+    def __init__(self, refresh=30, max_age=300, max_uids=512, types=(b"a-",)):
+        self.refresh = refresh      # deltas before a fresh keyframe
+        self.max_age = max_age      # seconds before a fresh keyframe
+        self.max_uids = max_uids
+        self.types = types          # CoT type prefixes worth tracking
+        self.state = OrderedDict()  # key -> [gen, template, offsets, tokens, deltas, time]
+        # Shared by all UIDs and never reset, so a keyframe after reset(),
+        # resync() or eviction doesn't reuse the generation of one the peer
+        # still holds; random start for the same across restarts
+        self.generation = random.randrange(256)
+        self.lock = threading.Lock()
+        self.keyframes = 0
+        self.deltas = 0
+
+    def encode(self, xml):
+        """B-frame for xml, or None if this event isn't a tracked type"""
+        parts = split_event(xml)
+        if not parts:
+            return None
+        uid, typ, template, offsets, tokens = parts
+        if not typ.startswith(self.types):
+            return None
+        key = uid_key(uid)
+        now = time.monotonic()
+        with self.lock:
+            st = self.state.get(key)
+            if (st and st[1] == template and st[2] == offsets and st[4] < self.refresh
+                    and now - st[5] < self.max_age):
+                self.state.move_to_end(key)
+                st[4] += 1
+                self.deltas += 1
+                return self._delta(key, st, tokens)
+            self.generation = (self.generation + 1) & 0xff
+            if st and st[0] == self.generation:
+                self.generation = (self.generation + 1) & 0xff
+            gen = self.generation
+            self.state[key] = [gen, template, offsets, tokens, 0, now]
+            self.state.move_to_end(key)
+            while len(self.state) > self.max_uids:
+                self.state.popitem(last=False)
+            self.keyframes += 1
+        return self._keyframe(key, gen, template, offsets, tokens)
+
+    def _keyframe(self, key, gen, template, offsets, tokens):
+        out = bytearray(DELTA_TAG + bytes([KEYFRAME]) + key + bytes([gen]))
+        put_varint(out, len(template))
+        out += template
+        put_varint(out, len(offsets))
+        last = 0
+        for off in offsets:
+            put_varint(out, off - last)
+            last = off
+        for tok in tokens:
+            _put_value(out, tok)
+        return bytes(out)
+
+    def _delta(self, key, st, tokens):
+        ref = st[3]
+        out = bytearray(DELTA_TAG + bytes([DELTA]) + key + bytes([st[0]]))
+        mask = bytearray((len(tokens) + 7) // 8)
+        values = bytearray()
+        dt = None
+        for i, (tok, r) in enumerate(zip(tokens, ref)):
+            if tok == r:
+                continue
+            mask[i // 8] |= 1 << (i % 8)
+            d = _put_value(values, tok, r, dt)
+            if d is not None:
+                dt = d
+        return bytes(out + mask + values)
+
+    def resync(self, key):
+        """Peer lost our keyframe: send a full event next time"""
+        with self.lock:
+            self.state.pop(key, None)
+
+    def reset(self):
+        with self.lock:
+            self.state.clear()
+
+
+class DeltaDecoder:
+    """Receiver side: rebuilds byte-identical CoT XML from B-frames"""
+
+    def __init__(self, max_uids=512):
+        self.max_uids = max_uids
+        self.state = OrderedDict()  # key -> (gen, template, offsets, tokens)
+
+    def decode(self, frame):
+        kind, key, gen = frame[1], frame[2:6], frame[6]
+        pos = 7
+        if kind == KEYFRAME:
+            n, pos = get_varint(frame, pos)
+            template = bytes(frame[pos:pos + n])
+            pos += n
+            count, pos = get_varint(frame, pos)
+            offsets, last = [], 0
+            for _ in range(count):
+                d, pos = get_varint(frame, pos)
+                last += d
+                offsets.append(last)
+            tokens = []
+            for _ in range(count):
+                tok, pos, _ = _get_value(frame, pos)
+                tokens.append(tok)
+            self.state[key] = (gen, template, offsets, tokens)
+            self.state.move_to_end(key)
+            while len(self.state) > self.max_uids:
+                self.state.popitem(last=False)
+            return join_event(template, offsets, tokens)
+        if kind != DELTA:
+            raise ValueError(f"bad B-frame kind {kind}")
+        st = self.state.get(key)
+        if not st or st[0] != gen:
+            raise ResyncNeeded(bytes(key))
+        _, template, offsets, ref = st
+        mask_len = (len(ref) + 7) // 8
+        mask = frame[pos:pos + mask_len]
+        pos += mask_len
+        tokens = list(ref)
+        dt = None
+        for i in range(len(ref)):
+            if mask[i // 8] & (1 << (i % 8)):
+                tok, pos, d = _get_value(frame, pos, ref[i], dt)
+                if d is not None:
+                    dt = d
+                tokens[i] = tok
+        return join_event(template, offsets, tokens)
+
+
+# ── Fragmentation ──────────────────────────────────────────────────
+FRAGMENT_TAG = b"F"
+FRAGMENT_HEADER = 7     # tag + msg_id(4) + seq + total
+PARITY_TAG = b"P"
+PARITY_HEADER = 9       # tag + msg_id(4) + group + total + payload length(2)
+NACK_TAG = b"N"
+LOSS_TAG = b"L"
+
+
+def fragment(payload, msg_id, size):
+    """Split payload into F packets of at most size bytes
+
+    Fragments leave room for the longer parity header, so a P packet
+    over them fits the same link.
+    """
+    step = size - PARITY_HEADER
+    chunks = [payload[i:i + step] for i in range(0, len(payload), step)]
+    return [FRAGMENT_TAG + msg_id + bytes([seq, len(chunks)]) + chunk for seq, chunk in enumerate(chunks)]
+
+
+def parse_fragment(packet):
+    """(msg_id, seq, total, data) of an F packet"""
+    if len(packet) < FRAGMENT_HEADER:
+        raise ValueError("short fragment")
+    return packet[1:5], packet[5], packet[6], packet[7:]
+
+
+def parity(packets, groups):
+    """P packets for the F packets of one message, one per group
+
+    Group g covers fragments g, g + groups, g + 2*groups, ... and its P
+    packet is their XOR, each padded to the longest. Any one missing
+    fragment of a group can be rebuilt from the rest and the P packet.
+    """
+    msg_id, total = packets[0][1:5], packets[0][6]
+    chunks = [p[FRAGMENT_HEADER:] for p in packets]
+    step, length = len(chunks[0]), sum(len(c) for c in chunks)
+    if length > 0xffff or not 0 < groups < 16:
+        return []
+    out = []
+    for first in range(min(groups, total)):
+        x = 0
+        for c in chunks[first::groups]:
+            x ^= int.from_bytes(c.ljust(step, b"\0"), "big")
+        out.append(PARITY_TAG + msg_id + bytes([groups << 4 | first, total]) + length.to_bytes(2, "big")
+                   + x.to_bytes(step, "big"))
+    return out
+
+
+def parse_parity(packet):
+    """(msg_id, groups, first, total, payload length, data) of a P packet"""
+    if len(packet) <= PARITY_HEADER:
+        raise ValueError("short parity")
+    return (packet[1:5], packet[5] >> 4, packet[5] & 15, packet[6], int.from_bytes(packet[7:9], "big"),
+            packet[PARITY_HEADER:])
+
+
+def delivery(n, loss, groups):
+    """Chance an n-fragment message arrives whole, with parity over groups groups"""
+    q = 1 - loss
+    if not groups:
+        return q ** n
+    p = 1.0
+    for first in range(min(groups, n)):
+        k = len(range(first, n, groups)) + 1    # fragments and parity
+        p *= q ** k + k * loss * q ** (k - 1)
+    return p
+
+
+def parity_groups(n, loss, target=0.99, most=2):
+    """Fewest parity groups, up to most, that deliver an n-fragment message with chance target"""
+    for groups in range(most + 1):
+        if delivery(n, loss, groups) >= target:
+            return groups
+    return most
+
+
+def loss_report(loss):
+    return LOSS_TAG + min(10000, round(loss * 10000)).to_bytes(2, "big")
+
+
+def parse_loss_report(packet):
+    return int.from_bytes(packet[1:3], "big") / 10000
+
+
+def nack(msg_id, total, missing):
+    """N packet asking for the fragments in missing of a total-fragment message"""
+    return NACK_TAG + msg_id + bytes([total]) + bytes(missing)
+
+
+def parse_nack(packet):
+    """(msg_id, total, missing seqs) of an N packet"""
+    if len(packet) < 7:
+        raise ValueError("short nack")
+    return packet[1:5], packet[5], list(packet[6:])
+
+
+# ── Fragment reassembly ────────────────────────────────────────────
+class FragmentStore:
+    """Bounded reassembly of F-fragments, with P-parity recovery
+
+    Partial messages sit in an OrderedDict keyed by msg_id. Every entry
+    gets the same timeout, so insertion order is deadline order: expiry
+    and eviction only ever look at the front. Slots are indexed by seq,
+    so adding a fragment is O(1) and completion needs no sorting.
+    gaps() reports messages that have stopped arriving, so the caller
+    can ask the source for the missing fragments. Recently completed
+    ids are remembered, so late copies don't start a new partial.
+
+    Fragment loss is counted per source: every fragment a message needed
+    that didn't arrive first time, whether it was rebuilt from parity,
+    resent, or never came.
+    """
+
+    def __init__(self, timeout=30, max_messages=64, max_bytes=256 * 1024, max_total=255):
+        self.timeout = timeout
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.max_total = max_total      # most fragments a message may have
+        # msg_id -> [deadline, total, slots, received, nbytes, source, last, asked, parity, lost]
+        self.partial = OrderedDict()
+        self.done = OrderedDict()       # msg_id -> None, recently completed
+        self.nbytes = 0
+        self.lock = threading.Lock()
+        self.completed = 0
+        self.duplicates = 0
+        self.out_of_range = 0
+        self.expired = 0
+        self.evicted = 0
+        self.repaired = 0   # completed after gaps() reported them
+        self.recovered = 0  # fragments rebuilt from parity
+        self.loss = {}      # source -> [fragments needed, fragments lost]
+
+    def _entry(self, msg_id, total, n, now, source):
+        """The partial entry for msg_id, made if new; None if it is done or doesn't match"""
+        if msg_id in self.done:
+            self.duplicates += 1
+            return None
+        entry = self.partial.get(msg_id)
+        if entry is None:
+            self._make_room(n)
+            entry = [now + self.timeout, total, [None] * total, 0, 0, source, now, 0, [], 0]
+            self.partial[msg_id] = entry
+        elif entry[1] != total:
+            self.out_of_range += 1
+            return None
+        return entry
+
+    def _fill(self, msg_id, entry, seq, data):
+        """Store one fragment; False if its message had to be dropped to keep within max_bytes"""
+        entry[2][seq] = data
+        entry[3] += 1
+        entry[4] += len(data)
+        self.nbytes += len(data)
+        while self.nbytes > self.max_bytes:
+            # Older messages go first; this one only if it is too big on its own
+            victim = next((m for m in self.partial if m != msg_id), msg_id)
+            self._evict(victim)
+            if victim == msg_id:
+                return False
+        return True
+
+    def add(self, msg_id, seq, total, data, now=None, source=None):
+        """Store one fragment; returns the whole message once complete"""
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            if not 0 <= seq < total <= self.max_total:
+                self.out_of_range += 1
+                return None
+            entry = self._entry(msg_id, total, len(data), now, source)
+            if entry is None:
+                return None
+            if entry[2][seq] is not None:
+                self.duplicates += 1
+                return None
+            if not self._fill(msg_id, entry, seq, data):
+                return None
+            entry[6] = now
+            if entry[7]:
+                entry[9] += 1       # only came after asking
+            return self._finish(msg_id, entry)
+
+    def add_parity(self, msg_id, groups, first, total, length, data, now=None, source=None):
+        """Store one parity packet; returns the whole message if it completes it"""
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            if not (0 <= first < groups and first < total <= self.max_total):
+                self.out_of_range += 1
+                return None
+            if msg_id in self.done:
+                return None         # every fragment came; parity not needed
+            entry = self._entry(msg_id, total, len(data), now, source)
+            if entry is None:
+                return None
+            entry[8].append((groups, first, length, data))
+            entry[6] = now
+            return self._finish(msg_id, entry)
+
+    def _finish(self, msg_id, entry):
+        """Rebuild what parity allows; the whole message if nothing is missing"""
+        total, slots = entry[1], entry[2]
+        for groups, first, length, data in entry[8]:
+            missing = [i for i in range(first, total, groups) if slots[i] is None]
+            if len(missing) != 1:
+                continue
+            step = len(data)
+            x = int.from_bytes(data, "big")
+            for i in range(first, total, groups):
+                if slots[i] is not None:
+                    x ^= int.from_bytes(slots[i].ljust(step, b"\0"), "big")
+            seq = missing[0]
+            size = min(step, length - seq * step)
+            if size <= 0:
+                self.out_of_range += 1
+                continue
+            if not self._fill(msg_id, entry, seq, x.to_bytes(step, "big")[:size]):
+                return None
+            entry[9] += 1
+            self.recovered += 1
+        if entry[3] < total:
+            return None
+        del self.partial[msg_id]
+        self.done[msg_id] = None
+        if len(self.done) > 4 * self.max_messages:
+            self.done.popitem(last=False)
+        self.nbytes -= entry[4]
+        self.completed += 1
+        if entry[7]:
+            self.repaired += 1
+        self._count_loss(entry)
+        return b"".join(slots)
+
+    def _count_loss(self, entry):
+        if entry[5] is not None:
+            counts = self.loss.setdefault(entry[5], [0, 0])
+            counts[0] += entry[1]
+            counts[1] += entry[9] + entry[1] - entry[3]
+
+    def loss_reports(self, min_fragments):
+        """[(source, fragment loss)] for sources with at least min_fragments counted; restarts their counts"""
+        with self.lock:
+            out = [(src, lost / needed) for src, (needed, lost) in self.loss.items() if needed >= min_fragments]
+            for src, _ in out:
+                del self.loss[src]
+        return out
+
+    def gaps(self, quiet, retries, now=None):
+        """Partial messages with no new fragment for quiet seconds, each reported at most retries times
+
+        Returns a list of (msg_id, source, total, missing seqs).
+        """
+        now = time.monotonic() if now is None else now
+        out = []
+        with self.lock:
+            for msg_id, entry in self.partial.items():
+                if entry[7] < retries and now - entry[6] >= quiet:
+                    entry[6] = now
+                    entry[7] += 1
+                    out.append((msg_id, entry[5], entry[1], [i for i, d in enumerate(entry[2]) if d is None]))
+        return out
+
+    def _make_room(self, n):
+        while self.partial and (len(self.partial) >= self.max_messages or self.nbytes + n > self.max_bytes):
+            self._evict(next(iter(self.partial)))
+
+    def _evict(self, msg_id):
+        entry = self.partial.pop(msg_id)
+        self.nbytes -= entry[4]
+        self.evicted += 1
+        self._count_loss(entry)
+
+    def expire(self, now=None):
+        """Drop partial messages past their deadline; returns how many"""
+        now = time.monotonic() if now is None else now
+        dropped = 0
+        with self.lock:
+            while self.partial:
+                msg_id, entry = next(iter(self.partial.items()))
+                if entry[0] > now:
+                    break
+                del self.partial[msg_id]
+                self.nbytes -= entry[4]
+                self._count_loss(entry)
+                dropped += 1
+            self.expired += dropped
+        return dropped
+
+    def __len__(self):
+        return len(self.partial)
+
+
+# ── Aggregation ────────────────────────────────────────────────────
+#
+#   A + compress(00 + len + payload + len + payload ...)
+#
+# The leading 00 keeps an uncompressed block from being mistaken for a
+# compressed one. Payloads are prepared events (XML or B-frames) and are
+# compressed together, so the dictionary and cross-event repetition
+# both help.
+AGGREGATE_TAG = b"A"
+
+
+def pack_aggregate(payloads, mode="zdict", zdict=None):
+    block = bytearray(b"\x00")
+    for p in payloads:
+        put_varint(block, len(p))
+        block += p
+    return AGGREGATE_TAG + compress(bytes(block), mode, zdict)
+
+
+def unpack_aggregate(frame):
+    block = decompress(frame[1:])
+    if block[:1] != b"\x00":
+        raise ValueError("bad aggregate block")
+    payloads, pos = [], 1
+    while pos < len(block):
+        n, pos = get_varint(block, pos)
+        if pos + n > len(block):
+            raise ValueError("truncated aggregate block")
+        payloads.append(block[pos:pos + n])
+        pos += n
+    return payloads
+
+
+# ── Stream framing ─────────────────────────────────────────────────
+# TAK streaming CoT over TCP is a plain concatenation of XML documents
+# with no length prefix, each <event> optionally after an <?xml ?> prolog.
+class EventFramer:
+    """Pull complete <event> documents out of a byte stream
+
+    feed() only scans bytes it has not looked at yet: an event split
+    across reads resumes its search where the last one stopped. Bytes
+    outside any event (whitespace, keep-alive junk) are discarded, and
+    an event over max_size is dropped rather than buffered forever.
+    """
+
+    START = b"<event"
+    END = b"</event>"
+    PROLOG = b"<?xml"
+
+    def __init__(self, max_size=1048576):
+        self.max_size = max_size
+        self.buf = bytearray()
+        self.scan = 0           # where the next search starts
+        self.in_event = False   # buf starts with an event (or its prolog)
+        self.in_body = False    # the <event ...> start tag is complete
+        self.oversize = 0
+
+    def feed(self, data):
+        """Every event completed by data, as bytes"""
+        buf = self.buf
+        buf += data
+        events = []
+        while True:
+            if not self.in_event:
+                i = buf.find(self.START, self.scan)
+                if i < 0:
+                    # Keep a prolog, or just enough to spot a start tag split across reads
+                    p = buf.rfind(self.PROLOG)
+                    del buf[:p if p >= 0 else max(len(buf) - len(self.START) + 1, 0)]
+                    self.scan = max(len(buf) - len(self.START) + 1, 0)
+                    if len(buf) > self.max_size:
+                        self.oversize += 1
+                        buf.clear()
+                        self.scan = 0
+                    break
+                p = buf.rfind(self.PROLOG, 0, i)
+                start = p if p >= 0 else i
+                del buf[:start]
+                self.scan = i - start + len(self.START)
+                self.in_event, self.in_body = True, False
+            if not self.in_body:
+                j = buf.find(b">", self.scan)
+                if j < 0:
+                    self.scan = len(buf)
+                    if not self.check_size():
+                        continue
+                    break
+                if buf[j - 1:j] == b"/":    # <event .../>
+                    events.append(self.take(j + 1))
+                    continue
+                self.in_body = True
+                self.scan = j + 1
+            k = buf.find(self.END, self.scan)
+            if k < 0:
+                self.scan = max(self.scan, len(buf) - len(self.END) + 1)
+                if not self.check_size():
+                    continue
+                break
+            events.append(self.take(k + len(self.END)))
+        return events
+
+    def take(self, n):
+        event = bytes(self.buf[:n])
+        del self.buf[:n]
+        self.scan = 0
+        self.in_event = self.in_body = False
+        return event
+
+    def check_size(self):
+        """False (and the partial event dropped) if it has outgrown max_size"""
+        if len(self.buf) <= self.max_size:
+            return True
+        self.oversize += 1
+        self.take(len(self.buf))
+        return False
+CODEC
+
+cat > /root/cot_aoi.py << 'AOI'
+#!/usr/bin/env python3
+"""Area-of-interest filtering for the CoT bridge
+
+Each peer can have an area (a bounding box or a radius) outside which it
+doesn't want position traffic. The map is cut into a grid of CELL-degree
+cells, and each cell's relation to every area (inside, outside or on the
+edge) is worked out once and cached. Deciding who gets an event is then
+one dict lookup, plus an exact test only for peers whose edge runs
+through that cell.
+
+    index = AoiIndex()
+    index.set_policy(peer, parse_area("radius:37.77,-122.42,25"))
+    wanted, entered = index.targets(xml, peers)   # the peers that should get xml
+
+Areas are written as
+    bbox:SOUTH,WEST,NORTH,EAST      degrees
+    radius:LAT,LON,KM
+"""
+import math
+import re
+import cot_codec
+
+CELL = 0.05                 # grid cell size in degrees (~5.5 km of latitude)
+MAX_CELLS = 65536           # cached cell relations before the cache is cleared
+MAX_CONTACTS = 4096         # contacts whose last recipients are remembered
+ALWAYS = (b"b-t-f", b"b-a-", b"b-r-f-h-c", b"t-x-")  # chat, alerts, medevac, control: sent everywhere
+
+INSIDE, OUTSIDE, EDGE = 0, 1, 2
+EARTH_KM = 6371.0
+
+_POINT_RE = re.compile(rb'<point\s[^>]*>')
+_ATTR_RE = re.compile(rb'\s([\w:-]+)=(["\'])(.*?)\2')
+
+
+def parse_event(xml):
+    """(uid, type, lat, lon) from the <event> and <point> tags; lat/lon None if absent"""
+    event = cot_codec.event_header(xml)
+    if not event:
+        return None, b"", None, None
+    point = _POINT_RE.search(xml)
+    lat = lon = None
+    if point:
+        p = {m.group(1): m.group(3) for m in _ATTR_RE.finditer(point.group(0))}
+        try:
+            lat, lon = float(p[b"lat"]), float(p[b"lon"])
+        except (KeyError, ValueError):
+            pass
+    return event.get(b"uid"), event.get(b"type", b""), lat, lon
+
+
+class BoundingBox:
+    def __init__(self, south, west, north, east):
+        if south > north:
+            raise ValueError("bbox south is north of north")
+        self.south, self.west, self.north, self.east = south, west, north, east
+
+    def contains(self, lat, lon):
+        # A box with west > east crosses the antimeridian
+        inside_lon = self.west <= lon <= self.east if self.west <= self.east else lon >= self.west or lon <= self.east
+        return self.south <= lat <= self.north and inside_lon
+
+    def relation(self, cell):
+        s, w = cell[0] * CELL, cell[1] * CELL
+        n, e = s + CELL, w + CELL
+        if n < self.south or s > self.north:
+            return OUTSIDE
+        lat_inside = self.south <= s and n <= self.north
+        if self.west <= self.east:
+            if e < self.west or w > self.east:
+                return OUTSIDE
+            return INSIDE if lat_inside and self.west <= w and e <= self.east else EDGE
+        # Crosses the antimeridian; contains() settles the edge cases
+        return INSIDE if lat_inside and (w >= self.west or e <= self.east) else EDGE
+
+    def __str__(self):
+        return f"bbox:{self.south},{self.west},{self.north},{self.east}"
+
+
+class Radius:
+    def __init__(self, lat, lon, km):
+        if km <= 0:
+            raise ValueError("radius must be positive")
+        self.lat, self.lon, self.km = lat, lon, km
+
+    def distance(self, lat, lon):
+        """Great-circle distance in km (haversine)"""
+        p1, p2 = math.radians(self.lat), math.radians(lat)
+        dp, dl = p2 - p1, math.radians(lon - self.lon)
+        a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+        return 2 * EARTH_KM * math.asin(min(1, math.sqrt(a)))
+
+    def contains(self, lat, lon):
+        return self.distance(lat, lon) <= self.km
+
+    def relation(self, cell):
+        s, w = cell[0] * CELL, cell[1] * CELL
+        if all(self.contains(lat, lon) for lat in (s, s + CELL) for lon in (w, w + CELL)):
+            return INSIDE
+        # Nearest point of the cell to the centre
+        lat = min(max(self.lat, s), s + CELL)
+        lon = min(max(self.lon, w), w + CELL)
+        return EDGE if self.contains(lat, lon) else OUTSIDE
+
+    def __str__(self):
+        return f"radius:{self.lat},{self.lon},{self.km}"
+
+
+def parse_area(spec):
+    """BoundingBox or Radius from "bbox:S,W,N,E" or "radius:LAT,LON,KM"; ValueError if malformed"""
+    kind, _, values = spec.partition(":")
+    try:
+        nums = [float(v) for v in values.split(",")]
+    except ValueError:
+        raise ValueError(f"area {spec!r}: values must be numbers") from None
+    if kind == "bbox" and len(nums) == 4:
+        return BoundingBox(*nums)
+    if kind == "radius" and len(nums) == 3:
+        return Radius(*nums)
+    raise ValueError(f"area {spec!r}: expected bbox:S,W,N,E or radius:LAT,LON,KM")
+
+
+class AoiIndex:
+    """Per-peer areas over a grid, and which peers each contact was last sent to
+
+    A peer with no area gets everything. Events of an ALWAYS type, and
+    events without a position, go to every peer. When a contact leaves a
+    peer's area, the first update outside it is still sent so the peer
+    sees it go rather than freeze at the edge.
+    """
+
+    def __init__(self, always=ALWAYS):
+        self.always = tuple(always)
+        self.policies = {}      # peer -> area
+        self.cells = {}         # cell -> (peers inside, peers on the edge)
+        self.contacts = {}      # uid -> peers the last update went to
+        self.suppressed = 0
+
+    def set_policy(self, peer, area):
+        if area is None:
+            self.policies.pop(peer, None)
+        else:
+            self.policies[peer] = area
+        self.cells.clear()
+
+    def remove(self, peer):
+        if self.policies.pop(peer, None) is not None:
+            self.cells.clear()
+
+    def cell_peers(self, cell):
+        entry = self.cells.get(cell)
+        if entry is None:
+            inside, edge = set(), set()
+            for peer, area in self.policies.items():
+                rel = area.relation(cell)
+                if rel == INSIDE:
+                    inside.add(peer)
+                elif rel == EDGE:
+                    edge.add(peer)
+            if len(self.cells) >= MAX_CELLS:
+                self.cells.clear()
+            entry = self.cells[cell] = (inside, edge)
+        return entry
+
+    def targets(self, xml, peers):
+        """(peers that should get xml, True if it just entered someone's area)"""
+        if not self.policies:
+            return peers, False
+        uid, typ, lat, lon = parse_event(xml)
+        if lat is None or (lat == 0 and lon == 0) or typ.startswith(self.always):
+            return peers, False
+        inside, edge = self.cell_peers((math.floor(lat / CELL), math.floor(lon / CELL)))
+        wanted = [p for p in peers if p not in self.policies or p in inside
+                  or (p in edge and self.policies[p].contains(lat, lon))]
+        entered = False
+        if uid is not None:
+            now = set(wanted)
+            before = self.contacts.pop(uid, None)
+            if before is None:
+                entered = True
+            else:
+                entered = bool(now - before)
+                # One last update to peers it has just left
+                wanted = [p for p in peers if p in now or p in before]
+            self.contacts[uid] = now
+            if len(self.contacts) > MAX_CONTACTS:
+                del self.contacts[next(iter(self.contacts))]
+        self.suppressed += len(peers) - len(wanted)
+        return wanted, entered
+AOI
+
+cat > /root/cot_metrics.py << 'METRICS'
+#!/usr/bin/env python3
+"""Prometheus-style metrics for the CoT bridge
+
+Counters and histograms are sharded per thread: each thread updates its
+own dict without taking a lock, and only a scrape walks every shard.
+Gauges are read from a callback at scrape time, so queue depths and the
+like cost nothing until someone asks.
+
+    registry = Registry()
+    sent = registry.counter("packets_total", "Packets sent", ("direction",))
+    sent.inc(direction="tx")
+    serve(registry, "127.0.0.1", 9105)   # GET /metrics
+"""
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(v):
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+def _number(v):
+    if v == float("inf"):
+        return "+Inf"
+    if isinstance(v, float) and v.is_integer():
+        return str(int(v))
+    return repr(v) if isinstance(v, float) else str(v)
+
+
+class _Sharded:
+    """Per-thread value dicts merged on read; subclasses define merge(into, key, value)"""
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.local = threading.local()
+        self.shards = []    # (owning thread, values)
+        self.retired = {}   # values folded in from threads that have exited
+        self.shards_lock = threading.Lock()  # only taken once per thread, and by readers
+
+    def shard(self):
+        try:
+            return self.local.values
+        except AttributeError:
+            values = {}
+            with self.shards_lock:
+                self.shards.append((threading.current_thread(), values))
+            self.local.values = values
+            return values
+
+    def key(self, labels):
+        return tuple(labels.get(n, "") for n in self.labels)
+
+    def merged(self):
+        """Every shard folded into one dict of label values -> value"""
+        with self.shards_lock:
+            # Short-lived callback threads would otherwise leave a shard each
+            for thread, values in [s for s in self.shards if not s[0].is_alive()]:
+                for key, v in values.items():
+                    self.merge(self.retired, key, v)
+                self.shards.remove((thread, values))
+            merged = {}
+            for key, v in self.retired.items():
+                self.merge(merged, key, v)
+            for _, values in self.shards:
+                # dict.items() copied in one C call, so a writer can't resize it mid-read
+                for key, v in list(values.items()):
+                    self.merge(merged, key, v)
+        return merged
+
+
+class Counter(_Sharded):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        values = self.shard()
+        key = self.key(labels)
+        values[key] = values.get(key, 0) + amount
+
+    def merge(self, into, key, v):
+        into[key] = into.get(key, 0) + v
+
+    def value(self, **labels):
+        return self.merged().get(self.key(labels), 0)
+
+    def render(self):
+        return [f"{self.name}{_labels(self.labels, k)} {_number(v)}"
+                for k, v in sorted(self.merged().items())]
+
+
+class Histogram(_Sharded):
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets, labels=()):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        values = self.shard()
+        key = self.key(labels)
+        h = values.get(key)
+        if h is None:
+            # per-bucket counts, then +Inf, then sum
+            h = values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        h[bisect.bisect_left(self.buckets, value)] += 1
+        h[-1] += value
+
+    def merge(self, into, key, h):
+        m = into.setdefault(key, [0] * len(h))
+        for i, v in enumerate(list(h)):
+            m[i] += v
+
+    def render(self):
+        lines = []
+        for key, h in sorted(self.merged().items()):
+            running = 0
+            for bound, n in zip(self.buckets + (float("inf"),), h[:-1]):
+                running += n
+                le = _labels(self.labels + ("le",), key + (_number(bound),))
+                lines.append(f"{self.name}_bucket{le} {running}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, key)} {_number(h[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.labels, key)} {running}")
+        return lines
+
+
+class Gauge:
+    """Value read from fn() at scrape time
+
+    fn returns a number, or a dict of label-value tuple -> number.
+    """
+
+    def __init__(self, name, help, fn, labels=(), kind="gauge"):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.labels = tuple(labels)
+        self.kind = kind
+
+    def render(self):
+        v = self.fn()
+        if not isinstance(v, dict):
+            v = {(): v}
+        return [f"{self.name}{_labels(self.labels, k)} {_number(n)}" for k, n in sorted(v.items())]
+
+
+class Registry:
+    def __init__(self, prefix=""):
+        self.prefix = prefix
+        self.metrics = []
+
+    def add(self, metric):
+        metric.name = self.prefix + metric.name
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.add(Counter(name, help, labels))
+
+    def histogram(self, name, help, buckets, labels=()):
+        return self.add(Histogram(name, help, buckets, labels))
+
+    def gauge(self, name, help, fn, labels=(), kind="gauge"):
+        """kind="counter" for totals kept elsewhere (e.g. object attributes)"""
+        return self.add(Gauge(name, help, fn, labels, kind))
+
+    def render(self):
+        out = []
+        for m in self.metrics:
+            out.append(f"# HELP {m.name} {m.help}")
+            out.append(f"# TYPE {m.name} {m.kind}")
             try:
-                data, addr = sock.recvfrom(8192)
-                send_cot(data, label)
-            except socket.timeout:
-                pass
+                out.extend(m.render())
             except Exception as e:
-                add_event(f"ERR {e}")
+                out.append(f"# {m.name} unavailable: {e}")
+        return "\n".join(out) + "\n"
 
-        now = time.time()
-        fragment_buffer = {k:v for k,v in fragment_buffer.items() if now - v['time'] < 30}
-except KeyboardInterrupt:
-    sys.stdout.write("\033[?25h")  # restore cursor
-    print("\n  Shutting down...")
-BRIDGE
-chmod +x /root/cot_bridge.py
+
+def serve(registry, addr, port):
+    """Serve registry at http://addr:port/metrics on a daemon thread"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/metrics", "/"):
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((addr, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+METRICS
+
+cat > /root/halow_telemetry.py << 'TELEMETRY'
+#!/usr/bin/env python3
+"""Cached HaLow radio telemetry shared by the Haven dashboards
+
+Radio settings (mesh ID, channel, encryption, hardware) hardly ever
+change, so `iwinfo` is forked at most once per STATIC_TTL. Signal and
+bit rate come from `iw dev <iface> station dump` (the strongest peer),
+since a mesh interface isn't listed in /proc/net/wireless; noise comes
+from /proc/net/wireless when it is listed, else from iwinfo. Both are
+refreshed at most once per TTL. Readers always get the cached sample.
+
+    from halow_telemetry import HalowTelemetry
+    radio = HalowTelemetry("wlan0")
+    s = radio.sample()
+    print(s.channel, s.frequency, s.signal)
+
+Run it directly to print one sample.
+"""
+import re
+import subprocess
+import threading
+import time
+from typing import NamedTuple, Optional
+
+# ── Config ──────────────────────────────────────────────────────────
+INTERFACE = "wlan0"
+TTL = 2                   # seconds a signal and bit rate reading is reused
+STATIC_TTL = 30           # seconds between iwinfo runs
+PROC_WIRELESS = "/proc/net/wireless"
+
+# One pass over the whole iwinfo output per field instead of per line
+_IWINFO_RE = {
+    "mesh_id": re.compile(r'ESSID:\s*"([^"]+)"'),
+    "channel": re.compile(r'Channel:\s*(\d+)\s*\(([^)]+)\)'),
+    "bitrate": re.compile(r'Bit Rate:\s*(.+?)\s*$', re.M),
+    "signal": re.compile(r'Signal:\s*(-?\d+) dBm'),
+    "noise": re.compile(r'Noise:\s*(-?\d+) dBm'),
+    "encryption": re.compile(r'Encryption:\s*(.+?)\s*$', re.M),
+    "hardware": re.compile(r'Hardware:\s*(.+?)\s*$', re.M),
+}
+
+_STATION_RE = re.compile(r'^Station\s', re.M)
+_STATION_SIGNAL_RE = re.compile(r'^\s*signal:\s*(-?\d+)', re.M)
+_STATION_BITRATE_RE = re.compile(r'^\s*tx bitrate:\s*([\d.]+ \S+)', re.M)
+
+
+class HalowSample(NamedTuple):
+    """One reading of the radio; text fields are None when unknown"""
+    interface: str
+    mode: Optional[str] = None
+    mesh_id: Optional[str] = None
+    channel: Optional[str] = None
+    frequency: Optional[str] = None
+    bitrate: Optional[str] = None
+    encryption: Optional[str] = None
+    hardware: Optional[str] = None
+    signal_dbm: Optional[int] = None
+    noise_dbm: Optional[int] = None
+    timestamp: float = 0.0
+
+    @property
+    def signal(self):
+        return None if self.signal_dbm is None else f"{self.signal_dbm} dBm"
+
+    @property
+    def snr(self):
+        if self.signal_dbm is None or self.noise_dbm is None:
+            return None
+        return self.signal_dbm - self.noise_dbm
+
+
+def parse_iwinfo(out):
+    """Fields of `iwinfo <iface> info` output as a dict"""
+    info = {}
+    for key, regex in _IWINFO_RE.items():
+        m = regex.search(out)
+        if not m:
+            continue
+        if key == "channel":
+            info["channel"], info["frequency"] = m.group(1), m.group(2)
+        elif key in ("signal", "noise"):
+            info[key + "_dbm"] = int(m.group(1))
+        else:
+            info[key] = m.group(1)
+    if re.search(r'Mode:\s*Mesh', out):
+        info["mode"] = "Mesh Point"
+    return info
+
+
+def parse_station_dump(out):
+    """Signal and tx bit rate of the strongest station in `iw dev <iface> station dump` output"""
+    best = {}
+    for block in _STATION_RE.split(out)[1:]:
+        m = _STATION_SIGNAL_RE.search(block)
+        if not m:
+            continue
+        signal = int(m.group(1))
+        if "signal_dbm" in best and signal <= best["signal_dbm"]:
+            continue
+        best = {"signal_dbm": signal}
+        m = _STATION_BITRATE_RE.search(block)
+        if m:
+            best["bitrate"] = m.group(1)
+    return best
+
+
+def read_proc_wireless(iface, path=PROC_WIRELESS):
+    """(signal, noise) in dBm from /proc/net/wireless, None if not listed"""
+    try:
+        with open(path) as f:
+            for line in f:
+                name, _, rest = line.partition(":")
+                if name.strip() != iface:
+                    continue
+                fields = rest.split()
+                signal = int(float(fields[2]))
+                noise = int(float(fields[3]))
+                if signal == 0:
+                    return None   # not associated / driver doesn't report
+                # -256 is the "no reading" value some drivers report
+                return signal, noise if noise > -256 else None
+    except (OSError, IndexError, ValueError):
+        pass
+    return None
+
+
+class HalowTelemetry:
+    """Thread-safe, TTL-cached source of HalowSample for one interface"""
+
+    def __init__(self, iface=INTERFACE, ttl=TTL, static_ttl=STATIC_TTL):
+        self.iface = iface
+        self.ttl = ttl
+        self.static_ttl = static_ttl
+        self.lock = threading.Lock()
+        self.static = {}
+        self.static_at = None
+        self.current = HalowSample(iface)
+        self.iwinfo_runs = 0
+        self.iw_runs = 0
+
+    def refresh_static(self, now):
+        self.static_at = now
+        try:
+            out = subprocess.check_output(["iwinfo", self.iface, "info"],
+                                          stderr=subprocess.DEVNULL, timeout=5).decode()
+        except (OSError, subprocess.SubprocessError):
+            return
+        self.iwinfo_runs += 1
+        self.static = parse_iwinfo(out)
+
+    def read_stations(self):
+        try:
+            out = subprocess.check_output(["iw", "dev", self.iface, "station", "dump"],
+                                          stderr=subprocess.DEVNULL, timeout=5).decode()
+        except (OSError, subprocess.SubprocessError):
+            return {}
+        self.iw_runs += 1
+        return parse_station_dump(out)
+
+    def sample(self):
+        """The cached sample, refreshed if older than the TTL"""
+        now = time.monotonic()
+        with self.lock:
+            if now - self.current.timestamp < self.ttl and self.current.timestamp:
+                return self.current
+            if self.static_at is None or now - self.static_at >= self.static_ttl:
+                self.refresh_static(now)
+            fields = dict(self.static)
+            live = read_proc_wireless(self.iface)
+            if live:
+                fields["signal_dbm"], fields["noise_dbm"] = live
+            fields.update(self.read_stations())
+            self.current = HalowSample(self.iface, timestamp=now, **fields)
+            return self.current
+
+
+if __name__ == "__main__":
+    s = HalowTelemetry().sample()
+    for field in HalowSample._fields[:-1]:
+        print(f"{field:12}: {getattr(s, field)}")
+    print(f"{'snr':12}: {s.snr}")
+TELEMETRY
 
 echo "[2/3] Creating CoT Bridge service..."
 cat > /etc/init.d/cot_bridge << 'EOF'
@@ -391,10 +3601,10 @@ start() {
     echo "Starting CoT Bridge..."
     PEER=""
     if [ -f /root/.cot_peer ]; then
-        PEER=$(cat /root/.cot_peer | tr -d ' \n\r\t')
+        PEER=$(tr -s ' \n\r\t' ' ' < /root/.cot_peer)
     fi
     cd /root
-    python3 /root/cot_bridge.py $PEER > /tmp/bridge.log 2>&1 &
+    python3 /root/cot_bridge.py --log jsonl $PEER > /tmp/bridge.log 2>&1 &
     echo "CoT Bridge started (PID: $!)"
 }
 
@@ -413,10 +3623,10 @@ EOF
 chmod +x /etc/init.d/cot_bridge
 
 echo "[3/3] Configuring peering..."
-if [ -n "$PEER_HASH" ]; then
-    echo "$PEER_HASH" > /root/.cot_peer
-    echo "  Peer hash saved to /root/.cot_peer"
-    echo "  Bridge will connect to: ${PEER_HASH}"
+if [ -n "$PEER_HASHES" ]; then
+    printf "%s\n" $PEER_HASHES > /root/.cot_peer
+    echo "  Peer hashes saved to /root/.cot_peer"
+    echo "  Bridge will connect to: ${PEER_HASHES}"
 else
     echo "  No peer hash provided (this is normal for the Gate node)"
     echo "  Start the bridge, then use its hash to set up Point nodes"
@@ -428,6 +3638,10 @@ echo "  ATAK CoT Bridge Setup Complete!"
 echo "═══════════════════════════════════════════════════════════════════"
 echo ""
 echo "  Script:  /root/cot_bridge.py"
+echo "  Codec:   /root/cot_codec.py"
+echo "  Areas:   /root/cot_aoi.py"
+echo "  Metrics: http://127.0.0.1:9105/metrics"
+echo "  Radio:   /root/halow_telemetry.py"
 echo "  Service: /etc/init.d/cot_bridge"
 echo "  Peer:    /root/.cot_peer (optional)"
 echo "  Logs:    /tmp/bridge.log"